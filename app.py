@@ -1,44 +1,316 @@
-from flask import Flask, request, jsonify
+from flask import (
+    Blueprint, Flask, Response, current_app, request, jsonify, g, json, stream_with_context
+)
 from flask_cors import CORS
-from database import conn
+from auth import login_required, bearer_token, token_cache
+from config import APP_CONFIG, DB_CONFIG, LOG_LEVEL
+from database import pool, replica_router, reset_after_fork, PoolTimeout
+from kitchen_feed import KitchenFeed, SSE_KEEPALIVE_INTERVAL, format_event
+from idempotency import (
+    IdempotencyStore, IdempotentResponse, IdempotencyConflict, IdempotencyInProgress,
+    MAX_IDEMPOTENCY_KEY_LENGTH, request_fingerprint, stored_response, wait_for_key
+)
+from logs import configure_logging, get_logger
+from migrations import MIGRATIONS
+from menu_cache import MenuCache, bump_menu_version
+import menu_bulk
+import metrics
+from metrics import RequestMetrics, start_request_sql
+from order_queue import OrderBatchWriter, OrderNotWritten, QueueFull
+from orders import (
+    InvalidOrder, DuplicateOrderId, IdempotencyKeyTaken, ORDER_ID_ATTEMPTS,
+    new_order_id, prepare_order, write_orders
+)
+from partitions import PartitionMaintainer
+from passwords import PasswordHasher, LoginThrottle, HashingBusy
+from prepared import statements
+import reports
+from reports import ReportRefresher, REPORT_BUCKETS
+from queries import (
+    MENU_ITEMS_SQL, INSERT_MENU_CONTAINER_SQL, INSERT_MENU_ITEM_SQL,
+    MENU_ITEM_CONTAINER_SQL, DELETE_FOOD_ITEM_SQL, DELETE_CONTAINER_SQL,
+    USER_BY_USERNAME_SQL, USERNAME_EXISTS_SQL, INSERT_USER_SQL,
+    ORDER_STATUS_PREVIOUS, UPDATE_ORDER_STATUS_SQL, ORDER_STATUS_SQL,
+    pending_orders_query
+)
 import psycopg2
+from psycopg2.errors import UniqueViolation
 from psycopg2.extras import RealDictCursor
+import queue
 import secrets
+import time
 import jwt
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
-
-app = Flask(__name__)
-CORS(app, resources={
-    r"/*": {
-        "origins": [
-            "http://localhost:5173",
-            "http://localhost:5174",
-            "http://127.0.0.1:5173",
-            "http://127.0.0.1:5174"
-        ],
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
-        "supports_credentials": True
+from datetime import datetime, timedelta, timezone
+
+logger = get_logger('app')
+
+# Development fallback; set POS_SECRET_KEY in any shared environment
+DEV_SECRET_KEY = 'your-secret-key'
+READINESS_TIMEOUT = 1.0  # seconds the readiness probe waits for a connection
+
+bp = Blueprint('pos', __name__)
+
+def build_menu(cursor):
+    statements.execute(cursor, 'menu_items', MENU_ITEMS_SQL)
+    return jsonify(cursor.fetchall()).get_data()
+
+# Per-process state, reset in forked workers along with the pools
+menu_cache = reset_after_fork(MenuCache(build_menu))
+kitchen_feed = reset_after_fork(KitchenFeed(pool, DB_CONFIG))
+password_hasher = reset_after_fork(PasswordHasher())
+login_throttle = reset_after_fork(LoginThrottle())
+request_metrics = reset_after_fork(RequestMetrics())
+order_writer = reset_after_fork(OrderBatchWriter(pool))
+idempotency_store = reset_after_fork(IdempotencyStore())
+partition_maintainer = reset_after_fork(PartitionMaintainer(pool))
+report_refresher = reset_after_fork(ReportRefresher(pool))
+reset_after_fork(token_cache)
+reset_after_fork(statements)
+
+def pending_orders_filters(order_type=None):
+    """Read kitchen-board filters and keyset pagination from the query string."""
+    limit = request.args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            raise ValueError("limit must be a positive integer")
+        limit = int(limit)
+    return {
+        'order_type': order_type or request.args.get('order_type'),
+        'location': request.args.get('location'),
+        'after': request.args.get('after'),
+        'limit': limit,
+        'since': kitchen_board_since()
     }
-})
-app.config['SECRET_KEY'] = 'your-secret-key'
 
-@app.route('/api/menu-items', methods=['GET', 'POST'])
+def kitchen_board_since():
+    """Oldest order creation time shown on the board, or None without a window."""
+    window = current_app.config['KITCHEN_BOARD_WINDOW']
+    return datetime.now(timezone.utc) - window if window is not None else None
+
+def get_db():
+    """Check out a pooled primary connection for the current request."""
+    if 'db_conn' not in g:
+        g.db_conn = pool.getconn()
+    return g.db_conn
+
+def wants_primary_read():
+    """Client asked for read-your-writes, e.g. right after submitting an order."""
+    return (request.headers.get('X-Read-From', '').lower() == 'primary'
+            or request.args.get('read_from') == 'primary')
+
+def get_read_db():
+    """Connection for read-only queries, from a replica when that's safe.
+
+    Once a request has used the primary, later reads stay on it so they see
+    its writes; so do requests that ask for a primary read.
+    """
+    if 'db_conn' in g or wants_primary_read():
+        return get_db()
+    if 'read_conn' not in g:
+        read_pool, read_conn = replica_router.getconn()
+        if read_conn is None:
+            return get_db()
+        g.read_pool, g.read_conn = read_pool, read_conn
+    return g.read_conn
+
+def detach_db(conn):
+    """Take ``conn`` out of request teardown; returns a callable that releases it."""
+    if g.get('db_conn') is conn:
+        g.pop('db_conn')
+        return lambda: pool.putconn(conn)
+    g.pop('read_conn')
+    read_pool = g.pop('read_pool')
+    return lambda: replica_router.putconn(read_pool, conn)
+
+@bp.teardown_app_request
+def release_db(exception):
+    db_conn = g.pop('db_conn', None)
+    if db_conn is not None:
+        pool.putconn(db_conn)
+    read_conn = g.pop('read_conn', None)
+    if read_conn is not None:
+        replica_router.putconn(g.pop('read_pool'), read_conn)
+
+def streaming_cursor(conn):
+    """Server-side cursor, so rows reach Python one batch at a time."""
+    cursor = conn.cursor(name=f"stream_{secrets.token_hex(8)}", cursor_factory=RealDictCursor)
+    cursor.itersize = current_app.config['STREAM_FETCH_SIZE']
+    return cursor
+
+def stream_query(cursor, sql, params):
+    """Execute on a streaming cursor and send the rows as a chunked JSON array.
+
+    The first batch is fetched before returning, so query errors still turn
+    into a normal error response. After that the connection belongs to the
+    response and goes back to the pool when the response is closed.
+    """
+    fetch_size = current_app.config['STREAM_FETCH_SIZE']
+    cursor.execute(sql, params)
+    batch = cursor.fetchmany(fetch_size)
+
+    putconn = detach_db(cursor.connection)
+    released = []
+    # Read by record_request_metrics() once the body has been sent
+    g.stream_state = state = {'failed': False}
+
+    def release():
+        if not released:
+            released.append(True)
+            putconn()
+
+    def generate():
+        yield b'['
+        separator = b''
+        rows = batch
+        try:
+            while rows:
+                yield separator + b','.join(json.dumps(row).encode() for row in rows)
+                separator = b','
+                rows = cursor.fetchmany(fetch_size)
+        except Exception:
+            # Headers are already sent, so re-raise: the server then drops the
+            # connection instead of ending the chunked body, and the client
+            # can't take the truncated array for a complete one.
+            state['failed'] = True
+            logger.exception("Error while streaming rows")
+            raise
+        yield b']'
+
+    # Keeps the request context, and with it the per-request SQL stats, alive
+    # while the rows are fetched
+    response = Response(stream_with_context(generate()), mimetype='application/json')
+    response.call_on_close(release)
+    return response
+
+def pending_orders_response(conn, filters):
+    """Kitchen-board rows for ``filters``.
+
+    A page that fits in one fetch gains nothing from streaming, so it runs
+    as a prepared statement on a regular cursor; server-side cursors can't
+    use prepared statements.
+    """
+    sql, params = pending_orders_query(**filters)
+    limit = filters['limit']
+    if limit is not None and limit <= current_app.config['STREAM_FETCH_SIZE']:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            statements.execute(cursor, 'pending_orders', sql, params)
+            return jsonify(cursor.fetchall())
+    return stream_query(streaming_cursor(conn), sql, params)
+
+@bp.app_errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify({"error": "Database busy, please retry"}), 503
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    start_request_sql()
+    if current_app.config['PARTITION_MAINTENANCE']:
+        partition_maintainer.ensure_started()
+    if current_app.config['REPORT_REFRESH']:
+        report_refresher.ensure_started()
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    sql_stats = g.get('sql_stats')
+    stream_state = g.get('stream_state')
+    if stream_state is None:
+        observe_request(endpoint, request.method, response.status_code, started, sql_stats)
+        return response
+
+    # A streamed body, and the fetches that produce it, comes after this
+    # hook; count the request once the response has been sent
+    method = request.method
+
+    def observe_stream():
+        status = 500 if stream_state['failed'] else response.status_code
+        observe_request(endpoint, method, status, started, sql_stats)
+
+    response.call_on_close(observe_stream)
+    return response
+
+def observe_request(endpoint, method, status, started, sql_stats):
+    elapsed = time.perf_counter() - started
+    request_metrics.observe(endpoint, method, status, elapsed, sql_stats)
+
+    if metrics.SLOW_REQUEST_MS is not None and elapsed * 1000 >= metrics.SLOW_REQUEST_MS:
+        logger.warning("Slow request", extra={'fields': {
+            'method': method,
+            'endpoint': endpoint,
+            'status': status,
+            'ms': round(elapsed * 1000, 2),
+            'sql_count': sql_stats.count,
+            'sql_ms': round(sql_stats.seconds * 1000, 2),
+            'sql': [
+                {'ms': round(seconds * 1000, 2), 'query': query}
+                for query, seconds in sql_stats.statements
+            ]
+        }})
+
+@bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    gauges = {f"db_pool_{key}": value for key, value in pool.stats().items()}
+    gauges.update({f"token_cache_{key}": value for key, value in token_cache.stats().items()})
+    gauges.update({f"db_{key}": value for key, value in replica_router.stats().items()})
+    gauges['kitchen_feed_subscribers'] = kitchen_feed.subscriber_count()
+    gauges['order_queue_depth'] = order_writer.depth()
+    gauges.update({f"idempotency_{key}": value for key, value in idempotency_store.stats().items()})
+    for name, stats in statements.stats().items():
+        gauges.update({f"prepared_{name}_{key}": value for key, value in stats.items()})
+    return Response(request_metrics.render(gauges),
+                    mimetype='text/plain; version=0.0.4')
+
+@bp.route('/health/live', methods=['GET'])
+def liveness():
+    """The process is up and serving requests; never touches the database."""
+    return jsonify({"status": "ok"})
+
+@bp.route('/health/ready', methods=['GET'])
+def readiness():
+    """Ready once the primary answers and every migration this code knows has been applied."""
+    conn = None
+    try:
+        conn = pool.getconn(timeout=READINESS_TIMEOUT)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT max(version) FROM schema_migrations")
+            version = cursor.fetchone()[0]
+    except (psycopg2.Error, PoolTimeout) as e:
+        return jsonify({"status": "unavailable", "error": str(e)}), 503
+    finally:
+        if conn is not None:
+            pool.putconn(conn)
+
+    expected = MIGRATIONS[-1][0]
+    # A newer schema is fine: during a rolling deploy it was migrated ahead
+    # of this worker's code
+    if version is None or version < expected:
+        return jsonify({"status": "migrations pending", "schema_version": version,
+                        "expected_version": expected}), 503
+    return jsonify({"status": "ready", "schema_version": version, "pool": pool.stats()})
+
+@bp.route('/api/menu-items', methods=['GET', 'POST'])
+@login_required
 def menu_items():
+    conn = get_read_db() if request.method == 'GET' else get_db()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
 
     if request.method == 'GET':
         try:
-            cursor.execute(""" 
-                SELECT f.item_id, f.food_name, f.price, c.packaging_type, f.is_ordered, f.image_url
-                FROM food_items f 
-                JOIN containers c ON f.container_id = c.container_id
-                WHERE f.is_ordered = FALSE
-                ORDER BY f.food_name
-            """)
-            items = cursor.fetchall()
-            return jsonify(items)
+            snapshot = menu_cache.get(cursor)
+            # Release the read transaction before the response is sent
+            conn.rollback()
+
+            if request.if_none_match.contains(snapshot.etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.response_class(snapshot.body, mimetype='application/json')
+            response.set_etag(snapshot.etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
             
         except Exception as e:
             conn.rollback()
@@ -68,23 +340,19 @@ def menu_items():
             cursor.execute("BEGIN")
 
             # Create new container
-            cursor.execute(
-                "INSERT INTO containers (packaging_type) VALUES (%s) RETURNING container_id",
-                (data['packaging_type'],)
-            )
+            cursor.execute(INSERT_MENU_CONTAINER_SQL, (data['packaging_type'],))
             container_id = cursor.fetchone()['container_id']
 
             # Create food item with image_url
-            cursor.execute(""" 
-                INSERT INTO food_items (container_id, food_name, price, is_ordered, image_url)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING item_id, food_name, price, is_ordered, image_url
-            """, (container_id, data['food_name'], price, False, data['image_url']))
+            cursor.execute(INSERT_MENU_ITEM_SQL,
+                           (container_id, data['food_name'], price, False, data['image_url']))
             
             new_item = cursor.fetchone()
+            bump_menu_version(cursor)
             
             # Commit transaction
             conn.commit()
+            menu_cache.invalidate()
             
             return jsonify({
                 "message": "Menu item added successfully",
@@ -100,18 +368,17 @@ def menu_items():
         finally:
             cursor.close()
 
-@app.route('/api/menu-items/<int:item_id>', methods=['DELETE'])
+@bp.route('/api/menu-items/<int:item_id>', methods=['DELETE'])
+@login_required
 def delete_menu_item(item_id):
+    conn = get_db()
     cursor = conn.cursor()
     try:
         # Start transaction
         cursor.execute("BEGIN")
         
         # Get container_id first
-        cursor.execute(
-            "SELECT container_id FROM food_items WHERE item_id = %s",
-            (item_id,)
-        )
+        cursor.execute(MENU_ITEM_CONTAINER_SQL, (item_id,))
         result = cursor.fetchone()
         
         if not result:
@@ -120,13 +387,15 @@ def delete_menu_item(item_id):
         container_id = result[0]
         
         # Delete food item
-        cursor.execute("DELETE FROM food_items WHERE item_id = %s", (item_id,))
+        cursor.execute(DELETE_FOOD_ITEM_SQL, (item_id,))
         
         # Delete associated container
-        cursor.execute("DELETE FROM containers WHERE container_id = %s", (container_id,))
+        cursor.execute(DELETE_CONTAINER_SQL, (container_id,))
+        bump_menu_version(cursor)
         
         # Commit transaction
         conn.commit()
+        menu_cache.invalidate()
         
         return jsonify({"message": "Menu item deleted successfully"}), 200
         
@@ -137,123 +406,285 @@ def delete_menu_item(item_id):
     finally:
         cursor.close()
 
-@app.route('/api/orders', methods=['GET'])
+@bp.route('/api/menu-items/bulk', methods=['POST'])
+@login_required
+def bulk_menu_items():
+    """Apply a CSV or NDJSON menu upload; see menu_bulk for the row format.
+
+    Any invalid row rejects the whole upload with 422 unless
+    ?skip_invalid=true, which applies the valid rows and reports the rest.
+    """
+    try:
+        rows = menu_bulk.parse_upload(request.get_data(), request.content_type)
+    except menu_bulk.InvalidUpload as e:
+        return jsonify({"error": str(e)}), 400
+    skip_invalid = request.args.get('skip_invalid', '').lower() in ('1', 'true', 'yes')
+
+    conn = get_db()
+    try:
+        summary = menu_bulk.apply_menu_upload(conn, rows, skip_invalid)
+        if summary['applied']:
+            conn.commit()
+            menu_cache.invalidate()
+        else:
+            conn.rollback()
+    except psycopg2.Error as e:
+        conn.rollback()
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+    if summary['errors'] and not skip_invalid:
+        return jsonify(dict(summary, error="Upload has invalid rows; nothing was applied")), 422
+    return jsonify(summary), 200
+
+@bp.route('/api/orders', methods=['GET'])
+@login_required
 def get_orders():
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
     try:
-        cursor.execute("""
-            SELECT o.*, 
-                   json_object_agg(
-                       c.container_id,
-                       json_build_object(
-                           'container_number', c.container_number,
-                           'packaging_type', c.packaging_type,
-                           'message', c.message,
-                           'FoodItems', (
-                               SELECT json_agg(
-                                   json_build_object(
-                                       'food_name', f.food_name,
-                                       'Price', f.price
-                                   )
-                               )
-                               FROM food_items f
-                               WHERE f.container_id = c.container_id
-                           )
-                       )
-                   ) as containers
-            FROM orders o
-            JOIN containers c ON o.user_id = c.order_id
-            WHERE o.payment = 'pending' 
-            AND o.order_type = 'customer_online'
-            GROUP BY o.user_id, o.order_type, o.location, o.payment
-        """)
-        orders = cursor.fetchall()
-        return jsonify(orders)
+        filters = pending_orders_filters(order_type='customer_online')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = get_read_db()
+    try:
+        return pending_orders_response(conn, filters)
             
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-            
-    finally:
-        cursor.close()
 
-@app.route('/api/submit-order', methods=['POST'])
+@bp.route('/api/submit-order', methods=['POST'])
+@login_required
 def submit_order():
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    """Create an order; an Idempotency-Key header makes retries safe (see idempotency.py)."""
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        status, body, _ = place_order()
+        return jsonify(body), status
+
+    key = key.strip()
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return jsonify({"error": f"Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters"}), 400
+    idempotency = (str(g.user.get('user_id')), key,
+                   request_fingerprint(request.path, request.get_data()))
+    try:
+        status, body, replayed = idempotency_store.run(*idempotency, lambda: place_order(idempotency))
+    except IdempotencyConflict as e:
+        return jsonify({"error": str(e)}), 422
+    except IdempotencyInProgress as e:
+        return jsonify({"error": str(e)}), 409
+
+    response = jsonify(body)
+    response.status_code = status
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def place_order(idempotency=None):
+    """Validate and write the submitted order; returns an IdempotentResponse.
+
+    ``idempotency`` is ``(scope, key, request_hash)``; the key is claimed in
+    the order's transaction, and if another request already holds it, that
+    request's stored response is returned instead.
+    """
     try:
         data = request.get_json()
-        
+        prepared = prepare_order(data)
+    except InvalidOrder as e:
+        return IdempotentResponse(400, {"error": str(e)}, False)
+    except Exception as e:
+        return IdempotentResponse(500, {"error": str(e)}, False)
+
+    for attempt in range(ORDER_ID_ATTEMPTS):
         # Generate unique order ID
-        order_id = f"CUST_{secrets.token_hex(4).upper()}"
-        
-        # Start transaction
-        cursor.execute("BEGIN")
-        
-        # Create order
-        cursor.execute("""
-            INSERT INTO orders (user_id, order_type, location, payment)
-            VALUES (%s, %s, %s, %s)
-            RETURNING user_id
-        """, (order_id, data['order_type'], data['location'], data['payment']))
-        
-        # Process containers and food items
-        for container in data['containers']:
-            cursor.execute("""
-                INSERT INTO containers (order_id, container_number, packaging_type, message)
-                VALUES (%s, %s, %s, %s)
-                RETURNING container_id
-            """, (order_id, container['container_number'], 
-                 container['packaging_type'], container['message']))
-            
-            container_id = cursor.fetchone()['container_id']
-            
-            # Add food items to container
-            for item in container['FoodItems']:
-                cursor.execute("""
-                    INSERT INTO food_items (container_id, food_name, price, is_ordered)
-                    VALUES (%s, %s, %s, %s)
-                """, (container_id, item['food_name'], item['Price'], True))
-        
+        order_id = new_order_id()
+        body = {"message": "Order submitted successfully", "order_id": order_id}
+        if idempotency is not None:
+            prepared['idempotency'] = idempotency_store.claim(*idempotency, 201, body)
+        try:
+            write_order(order_id, prepared)
+        except DuplicateOrderId:
+            logger.warning("Order id collision, retrying", extra={'fields': {'order_id': order_id}})
+            continue
+        except IdempotencyKeyTaken:
+            return stored_order_response(*idempotency)
+        except (QueueFull, OrderNotWritten) as e:
+            return IdempotentResponse(503, {"error": str(e)}, False)
+        except Exception as e:
+            return IdempotentResponse(500, {"error": str(e)}, False)
+        return IdempotentResponse(201, body, False)
+    return IdempotentResponse(500, {"error": "Could not allocate an order id"}, False)
+
+def write_order(order_id, prepared):
+    if current_app.config['ORDER_GROUP_COMMIT']:
+        # Returns once the background writer has committed this order
+        order_writer.submit(order_id, prepared)
+        return
+    conn = get_db()
+    try:
+        # psycopg2 opens the transaction implicitly on the first statement,
+        # so the whole order is written with a few INSERTs regardless of size.
+        write_orders(conn, [(order_id, prepared)])
         conn.commit()
-        return jsonify({"message": "Order submitted successfully", "order_id": order_id}), 201
-        
+    except Exception:
+        conn.rollback()
+        raise
+
+def stored_order_response(scope, key, request_hash):
+    """Replay the response committed under a key by another request.
+
+    If that request is still writing, wait for it here, where only this
+    duplicate is held up.
+    """
+    conn = get_db()
+    try:
+        with conn.cursor() as cursor:
+            if not wait_for_key(cursor, scope, key):
+                raise IdempotencyInProgress("A request with this Idempotency-Key is still in progress")
+            stored = stored_response(cursor, scope, key)
+    finally:
+        conn.rollback()
+    if stored is None:
+        # Expired, or the first request rolled back; a retry will take it over
+        raise IdempotencyInProgress("Idempotency-Key is being reused, please retry")
+    stored_hash, status, body = stored
+    if stored_hash != request_hash:
+        raise IdempotencyConflict("Idempotency-Key was used for a different request")
+    return IdempotentResponse(status, body, True)
+
+@bp.route('/api/orders/<order_id>/status', methods=['POST'])
+@login_required
+def update_order_status(order_id):
+    """Move an order along pending -> paid -> fulfilled.
+
+    Paying takes an optional ``payment`` method, 'paid' by default.
+    """
+    data = request.get_json() or {}
+    status = data.get('status')
+    if status not in ORDER_STATUS_PREVIOUS:
+        return jsonify({"error": f"status must be one of: {', '.join(ORDER_STATUS_PREVIOUS)}"}), 400
+    payment = data.get('payment', 'paid') if status == 'paid' else None
+    if status == 'paid' and (not isinstance(payment, str) or payment == 'pending' or len(payment) > 20):
+        return jsonify({"error": "payment must be a method other than 'pending'"}), 400
+
+    conn = get_db()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute(UPDATE_ORDER_STATUS_SQL,
+                       (status, payment, order_id, ORDER_STATUS_PREVIOUS[status]))
+        order = cursor.fetchone()
+        if order is None:
+            cursor.execute(ORDER_STATUS_SQL, (order_id,))
+            current = cursor.fetchone()
+            conn.rollback()
+            if current is None:
+                return jsonify({"error": "Order not found"}), 404
+            return jsonify({"error": f"Cannot change status from {current['status']} to {status}"}), 409
+        conn.commit()
+        return jsonify(order)
+
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
-        
     finally:
         cursor.close()
 
-@app.route('/auth/login', methods=['POST'])
-def login():
+def report_params():
+    """Read start, end and bucket for a report; defaults to the last day by hour."""
+    def parse_time(name, default):
+        value = request.args.get(name)
+        if value is None:
+            return default
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"{name} must be an ISO 8601 date or time")
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+    end = parse_time('end', datetime.now(timezone.utc))
+    start = parse_time('start', end - timedelta(days=1))
+    unit = request.args.get('bucket', 'hour')
+    if unit not in REPORT_BUCKETS:
+        raise ValueError(f"bucket must be one of: {', '.join(REPORT_BUCKETS)}")
+    return start, end, unit
+
+def report_response(run):
+    try:
+        start, end, unit = report_params()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = get_read_db()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     try:
-        data = request.get_json()
-        username = data.get('username')
-        password = data.get('password')
+        rows = run(cursor, start, end, unit)
+        # Orders committed after this are not in the rollups yet
+        through = reports.watermark(cursor)
+        return jsonify({"through": through, "bucket": unit, "rows": rows})
+    except Exception as e:
+        logger.exception("Error running report")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        cursor.close()
 
-        print(f"Login attempt for user: {username}")
-        print(f"Password received: {password}")  # Debug print
+@bp.route('/api/reports/revenue', methods=['GET'])
+@login_required
+def revenue_report():
+    return report_response(reports.revenue_report)
+
+@bp.route('/api/reports/orders', methods=['GET'])
+@login_required
+def orders_report():
+    """Order counts and revenue by order_type and location."""
+    return report_response(reports.orders_report)
+
+@bp.route('/api/reports/items', methods=['GET'])
+@login_required
+def items_report():
+    limit = request.args.get('limit', '10')
+    if not limit.isdigit() or int(limit) < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    return report_response(
+        lambda cursor, start, end, unit: reports.items_report(cursor, start, end, unit, int(limit))
+    )
+
+@bp.route('/auth/login', methods=['POST'])
+def login():
+    data = request.get_json() or {}
+    username = data.get('username')
+    password = data.get('password')
+
+    # Reject excess attempts before any database or hashing work
+    retry_after = login_throttle.hit(username, request.remote_addr)
+    if retry_after:
+        response = jsonify({'error': 'Too many login attempts'})
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+        return response, 429
+
+    conn = get_db()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        logger.debug("Login attempt", extra={'fields': {'username': username}})
 
-        cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
+        cursor.execute(USER_BY_USERNAME_SQL, (username,))
         user = cursor.fetchone()
         
         if not user:
-            print(f"No user found with username: {username}")
+            logger.info("Login failed: unknown user", extra={'fields': {'username': username}})
             return jsonify({'error': 'Invalid credentials'}), 401
 
-        print(f"Found user: {user['username']}")
-        print(f"Stored hash: {user['password_hash'][:50]}...")
+        # Return the connection to the pool while the KDF runs
+        cursor.close()
+        release_db(None)
 
         # Try password verificationy
-        is_valid = check_password_hash(user['password_hash'], password)
-        print(f"Password verification result: {is_valid}")
+        is_valid = password_hasher.verify(user['password_hash'], password)
 
         if is_valid:
+            login_throttle.reset(username)
             token = jwt.encode({
                 'user_id': user['id'],
                 'username': user['username'],
                 'exp': datetime.utcnow() + timedelta(hours=24)
-            }, app.config['SECRET_KEY'])
+            }, current_app.config['SECRET_KEY'])
 
             return jsonify({
                 'token': token,
@@ -264,101 +695,141 @@ def login():
                 }
             }), 200
         else:
-            print("Password verification failed")
+            logger.info("Login failed: bad password", extra={'fields': {'username': username}})
             return jsonify({'error': 'Invalid credentials'}), 401
 
+    except HashingBusy as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
-        print(f"Login error details: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Login error", extra={'fields': {'username': username}})
         return jsonify({'error': str(e)}), 500
     finally:
         cursor.close()
 
-@app.route('/auth/verify', methods=['GET'])
+@bp.route('/auth/verify', methods=['GET'])
+@login_required
 def verify_token():
-    token = request.headers.get('Authorization')
-    if not token:
-        return jsonify({'message': 'Token is missing'}), 401
+    return jsonify({
+        'user': {
+            'username': g.user['username']
+        }
+    }), 200
+
+@bp.route('/auth/logout', methods=['POST'])
+@login_required
+def logout():
+    token_cache.revoke(bearer_token(), expires_at=g.user.get('exp'))
+    return jsonify({'message': 'Logged out'}), 200
+
+@bp.route('/auth/token-cache', methods=['GET'])
+@login_required
+def token_cache_stats():
+    return jsonify(token_cache.stats()), 200
+
+@bp.route('/cards', methods=['GET'])
+@login_required
+def get_cards():
+    try:
+        filters = pending_orders_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    conn = get_read_db()
     try:
-        token = token.split(' ')[1]  # Remove 'Bearer ' prefix
-        data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        return jsonify({
-            'user': {
-                'username': data['username']
-            }
-        }), 200
-    except jwt.ExpiredSignatureError:
-        return jsonify({'message': 'Token has expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'message': 'Invalid token'}), 401
+        return pending_orders_response(conn, filters)
+            
+    except Exception as e:
+        logger.exception("Error fetching cards")
+        return jsonify({"error": str(e)}), 500
 
-@app.route('/cards', methods=['GET'])
-def get_cards():
+@bp.route('/cards/stream', methods=['GET'])
+@login_required(allow_query_token=True)
+def stream_cards():
+    # Subscribe before the snapshot so no change falls between the two
+    subscription = kitchen_feed.subscribe()
+    # Primary, not a replica: a lagging snapshot could miss orders whose
+    # notifications were sent before this client subscribed
+    conn = get_db()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     try:
-        cursor.execute("""
-            SELECT o.*, 
-                   json_object_agg(
-                       c.container_id,
-                       json_build_object(
-                           'container_number', c.container_number,
-                           'packaging_type', c.packaging_type,
-                           'message', c.message,
-                           'FoodItems', (
-                               SELECT json_agg(
-                                   json_build_object(
-                                       'food_name', f.food_name,
-                                       'Price', f.price
-                                   )
-                               )
-                               FROM food_items f
-                               WHERE f.container_id = c.container_id
-                           )
-                       )
-                   ) as containers
-            FROM orders o
-            JOIN containers c ON o.user_id = c.order_id
-            WHERE o.payment = 'pending' 
-            GROUP BY o.user_id, o.order_type, o.location, o.payment
-        """)
-        orders = cursor.fetchall()
-        return jsonify(orders)
-            
+        statements.execute(cursor, 'pending_orders',
+                           *pending_orders_query(since=kitchen_board_since()))
+        snapshot = format_event('snapshot', cursor.fetchall())
     except Exception as e:
-        print(f"Error fetching cards: {str(e)}")  # Debug print
+        kitchen_feed.unsubscribe(subscription)
         return jsonify({"error": str(e)}), 500
-            
     finally:
         cursor.close()
+        # Don't hold a pooled connection for the lifetime of the stream
+        release_db(None)
 
-@app.route('/auth/signup', methods=['POST'])
-def signup():
-    cursor = conn.cursor()
-    try:
-        data = request.get_json()
-        username = data.get('username')
-        password = data.get('password')
-        email = data.get('email')
+    def generate():
+        try:
+            yield snapshot
+            while True:
+                try:
+                    event = subscription.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    # Fell behind or the feed lost events; client reconnects
+                    return
+                yield event
+        finally:
+            kitchen_feed.unsubscribe(subscription)
 
-        print(f"Attempting signup with data: {username}, {email}")  # Debug print
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
-        # Check if username exists
-        cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
-        if cursor.fetchone():
-            return jsonify({'error': 'Username already exists'}), 400
+@bp.route('/auth/signup', methods=['POST'])
+def signup():
+    data = request.get_json() or {}
+    username = data.get('username')
+    password = data.get('password')
+    email = data.get('email')
+
+    logger.debug("Signup attempt", extra={'fields': {'username': username, 'email': email}})
+
+    # Signups share the per-IP login budget, so they can't monopolize hashing
+    retry_after = login_throttle.hit_ip(request.remote_addr)
+    if retry_after:
+        response = jsonify({'error': 'Too many signup attempts'})
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+        return response, 429
+
+    # Check if username exists, then return the connection before the KDF runs
+    conn = get_db()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(USERNAME_EXISTS_SQL, (username,))
+            taken = cursor.fetchone() is not None
+    finally:
+        conn.rollback()
+        release_db(None)
+    if taken:
+        return jsonify({'error': 'Username already exists'}), 400
 
-        # Hash password
-        password_hash = generate_password_hash(password)
+    try:
+        password_hash = password_hasher.hash(password)
+    except HashingBusy as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
 
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
         # Insert user
-        cursor.execute("""
-            INSERT INTO users (username, email, password_hash)
-            VALUES (%s, %s, %s)
-            RETURNING id, username, email
-        """, (username, email, password_hash))
-        
+        try:
+            cursor.execute(INSERT_USER_SQL, (username, email, password_hash))
+        except UniqueViolation:
+            # Taken by a concurrent signup while the password was hashed
+            conn.rollback()
+            return jsonify({'error': 'Username or email already exists'}), 400
+
         user_id, username, email = cursor.fetchone()
         conn.commit()
 
@@ -367,7 +838,7 @@ def signup():
             'user_id': user_id,
             'username': username,
             'exp': datetime.utcnow() + timedelta(hours=24)
-        }, app.config['SECRET_KEY'])
+        }, current_app.config['SECRET_KEY'])
 
         return jsonify({
             'token': token,
@@ -379,13 +850,45 @@ def signup():
         }), 201
 
     except Exception as e:
-        print(f"Signup error: {str(e)}")  # Debug print
-        import traceback
-        print(traceback.format_exc())  # Print full stack trace
+        logger.exception("Signup error", extra={'fields': {'username': username}})
         conn.rollback()
         return jsonify({'error': str(e)}), 500
     finally:
         cursor.close()
 
+def create_app(config=None):
+    """Build the Flask app; ``config`` overrides settings from config.APP_CONFIG.
+
+    Opens no database connections: pools connect on first use, in whichever
+    process serves the request.
+    """
+    configure_logging(LOG_LEVEL)
+    app = Flask(__name__)
+    app.config.update(APP_CONFIG)
+    app.config.update(config or {})
+    if not app.config['SECRET_KEY']:
+        logger.warning("POS_SECRET_KEY is not set, using the development key")
+        app.config['SECRET_KEY'] = DEV_SECRET_KEY
+    CORS(app, resources={
+        r"/*": {
+            "origins": app.config['CORS_ORIGINS'],
+            "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+            "allow_headers": ["Content-Type", "Authorization", "X-Read-From"],
+            "supports_credentials": True
+        }
+    })
+    app.register_blueprint(bp)
+    return app
+
+def __getattr__(name):
+    # "app:app" for servers is built on first access rather than at import,
+    # so importing this module in a pre-fork master does no app setup
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    global app
+    app = create_app()
+    return app
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,149 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+import jwt
+from flask import current_app, g, jsonify, request
+
+TOKEN_CACHE_SIZE = 4096
+# Upper bound on how long a verified token is trusted without re-checking,
+# for tokens that carry no exp claim.
+TOKEN_CACHE_MAX_TTL = 300.0  # seconds
+
+
+class TokenCache:
+    """Bounded LRU of verified JWT claims keyed by the token's SHA-256 digest.
+
+    Entries expire with the token's own exp claim. Revoked tokens are kept
+    in a deny list until they would have expired anyway; both the cache and
+    the deny list are per worker process.
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, max_ttl=TOKEN_CACHE_MAX_TTL):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self._entries = OrderedDict()  # digest -> (claims, expires_at)
+        self._revoked = {}  # digest -> expires_at
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.verifications = 0
+        self.verify_seconds = 0.0
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def verify(self, token, secret_key):
+        """Return the token's claims, raising jwt.InvalidTokenError subclasses."""
+        key = self.digest(token)
+        now = time.time()
+        with self._lock:
+            if key in self._revoked:
+                raise jwt.InvalidTokenError("Token has been revoked")
+            entry = self._entries.get(key)
+            if entry is not None:
+                claims, expires_at = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return claims
+                del self._entries[key]
+            self.misses += 1
+
+        start = time.perf_counter()
+        try:
+            claims = jwt.decode(token, secret_key, algorithms=['HS256'])
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.verifications += 1
+                self.verify_seconds += elapsed
+
+        expires_at = min(claims.get('exp', float('inf')), now + self.max_ttl)
+        with self._lock:
+            if key not in self._revoked:
+                self._entries[key] = (claims, expires_at)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return claims
+
+    def revoke(self, token, expires_at=None):
+        key = self.digest(token)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if expires_at is None:
+                expires_at = entry[1] if entry else time.time() + self.max_ttl
+            self._revoked[key] = expires_at
+            self._prune_revoked(time.time())
+
+    def _prune_revoked(self, now):
+        expired = [key for key, expires_at in self._revoked.items() if expires_at <= now]
+        for key in expired:
+            del self._revoked[key]
+
+    def _after_fork(self):
+        # Cached claims and revocations stay valid; only the lock is stale
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'revoked': len(self._revoked),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'verifications': self.verifications,
+                'avg_verify_ms': (self.verify_seconds / self.verifications * 1000
+                                  if self.verifications else 0.0)
+            }
+
+
+token_cache = TokenCache()
+
+
+def bearer_token(allow_query_token=False):
+    header = request.headers.get('Authorization', '')
+    parts = header.split(' ')
+    if len(parts) == 2 and parts[0].lower() == 'bearer':
+        return parts[1]
+    if allow_query_token:
+        # EventSource can't send headers, so streams may pass ?token=
+        return request.args.get('token')
+    return None
+
+
+def authenticate(allow_query_token=False):
+    """Verify the request's token and store its claims on g.user.
+
+    Returns None on success, otherwise an error response.
+    """
+    token = bearer_token(allow_query_token)
+    if not token:
+        return jsonify({'message': 'Token is missing'}), 401
+    try:
+        g.user = token_cache.verify(token, current_app.config['SECRET_KEY'])
+    except jwt.ExpiredSignatureError:
+        return jsonify({'message': 'Token has expired'}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({'message': 'Invalid token'}), 401
+    return None
+
+
+def login_required(view=None, allow_query_token=False):
+    """Require a valid bearer token; usable as @login_required or with options."""
+    if view is None:
+        return lambda v: login_required(v, allow_query_token=allow_query_token)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        error = authenticate(allow_query_token)
+        if error is not None:
+            return error
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,966 @@
+"""Benchmarks for the hot POS endpoints.
+
+Runs against the database configured in database.py through Flask's test
+client, so the numbers include routing and JSON serialization. Rows created
+by a benchmark are removed again when it finishes.
+
+    python benchmark.py submit-order --sizes 1 2 4 6 8 --items 4 --repeat 20
+    python benchmark.py cards --orders 10000 --containers 3 --items 3
+    python benchmark.py login-storm --logins 32 --orders 200
+    python benchmark.py group-commit --clients 32 --orders 50
+    python benchmark.py prepared --orders 500 --repeat 200
+    python benchmark.py partitions --history-days 30 --orders-per-day 2000
+    python benchmark.py reports --history-days 7 30 90 --orders-per-day 1000
+    python benchmark.py menu-bulk --items 500
+    python benchmark.py idempotency --clients 16 --rounds 10
+    python benchmark.py startup --repeat 10
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+import jwt
+from werkzeug.security import generate_password_hash
+
+from psycopg2.extras import RealDictCursor
+
+import app as pos_app
+from partitions import ORDER_PARTITION_TABLES, partition_name
+from prepared import PreparedStatements
+import reports
+from queries import MENU_ITEMS_SQL, pending_orders_query
+from tests.support import LEGACY_CARDS_SQL, PerRequestStore
+
+SEED_PREFIX = 'BENCH_'
+BENCH_USER = 'bench_storm'
+BENCH_PASSWORD = 'bench-password'
+
+def auth_headers():
+    token = jwt.encode({
+        'user_id': 0,
+        'username': 'benchmark',
+        'exp': datetime.utcnow() + timedelta(hours=1)
+    }, pos_app.app.config['SECRET_KEY'])
+    return {'Authorization': f'Bearer {token}'}
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class _CountingCursor:
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, query, vars=None):
+        self._counter['statements'] += 1
+        return self._cursor.execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        self._counter['statements'] += 1
+        return self._cursor.executemany(query, vars_list)
+
+    def copy_expert(self, sql, file):
+        self._counter['statements'] += 1
+        return self._cursor.copy_expert(sql, file)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _CountingConnection:
+    def __init__(self, conn, counter):
+        self._conn = conn
+        self._counter = counter
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(self._conn.cursor(*args, **kwargs), self._counter)
+
+    def commit(self):
+        self._counter['statements'] += 1
+        return self._conn.commit()
+
+    def rollback(self):
+        self._counter['statements'] += 1
+        return self._conn.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def count_statements(counter):
+    """Route get_db() through a connection proxy that counts round trips."""
+    original = pos_app.get_db
+
+    def counting_get_db():
+        return _CountingConnection(original(), counter)
+
+    pos_app.get_db = counting_get_db
+    return original
+
+
+def make_order(containers, items_per_container):
+    return {
+        "order_type": "benchmark",
+        "location": "bench",
+        "payment": "pending",
+        "containers": [
+            {
+                "container_number": n + 1,
+                "packaging_type": "box",
+                "message": "",
+                "FoodItems": [
+                    {"food_name": f"bench item {i}", "Price": 1.5}
+                    for i in range(items_per_container)
+                ]
+            }
+            for n in range(containers)
+        ]
+    }
+
+
+def cleanup_orders(order_ids):
+    if not order_ids:
+        return
+    conn = pos_app.pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                DELETE FROM order_items WHERE container_id IN (
+                    SELECT container_id FROM order_containers WHERE order_id = ANY(%s)
+                )
+            """, (order_ids,))
+            cursor.execute("DELETE FROM order_containers WHERE order_id = ANY(%s)", (order_ids,))
+            cursor.execute("DELETE FROM orders WHERE user_id = ANY(%s)", (order_ids,))
+            cursor.execute("DELETE FROM order_ids WHERE user_id = ANY(%s)", (order_ids,))
+        conn.commit()
+    finally:
+        pos_app.pool.putconn(conn)
+
+
+def seed_pending_orders(orders, containers, items):
+    """Bulk-load a pending backlog whose order ids start with SEED_PREFIX."""
+    conn = pos_app.pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO orders (user_id, order_type, location, payment, status)
+                SELECT %s || lpad(g::text, 7, '0'),
+                       CASE WHEN g %% 2 = 0 THEN 'customer_online' ELSE 'walk_in' END,
+                       'branch_' || (g %% 5), 'pending', 'pending'
+                FROM generate_series(1, %s) g
+            """, (SEED_PREFIX, orders))
+            cursor.execute("""
+                INSERT INTO order_containers (order_id, container_number, packaging_type, message)
+                SELECT o.user_id, n, 'box', ''
+                FROM orders o, generate_series(1, %s) n
+                WHERE o.user_id LIKE %s AND o.created_at = now()
+            """, (containers, SEED_PREFIX + '%'))
+            cursor.execute("""
+                INSERT INTO order_items (container_id, food_name, price)
+                SELECT c.container_id, 'bench item ' || i, 1.50
+                FROM order_containers c, generate_series(1, %s) i
+                WHERE c.order_id LIKE %s AND c.created_at = now()
+            """, (items, SEED_PREFIX + '%'))
+            cursor.execute("ANALYZE orders; ANALYZE order_containers; ANALYZE order_items")
+        conn.commit()
+    finally:
+        pos_app.pool.putconn(conn)
+
+
+def delete_seeded_orders():
+    conn = pos_app.pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                DELETE FROM order_items WHERE container_id IN (
+                    SELECT container_id FROM order_containers WHERE order_id LIKE %s
+                )
+            """, (SEED_PREFIX + '%',))
+            cursor.execute("DELETE FROM order_containers WHERE order_id LIKE %s", (SEED_PREFIX + '%',))
+            cursor.execute("DELETE FROM orders WHERE user_id LIKE %s", (SEED_PREFIX + '%',))
+            cursor.execute("DELETE FROM order_ids WHERE user_id LIKE %s", (SEED_PREFIX + '%',))
+        conn.commit()
+    finally:
+        pos_app.pool.putconn(conn)
+
+
+def _time_query(cursor, sql, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return rows, timings
+
+
+def bench_cards(args):
+    delete_seeded_orders()
+    seed_pending_orders(args.orders, args.containers, args.items)
+    conn = pos_app.pool.getconn()
+    try:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        _, legacy = _time_query(cursor, LEGACY_CARDS_SQL, None, args.repeat)
+        sql, params = pending_orders_query()
+        rows, current = _time_query(cursor, sql, params, args.repeat)
+        page_sql, page_params = pending_orders_query(limit=args.page_size)
+        _, paged = _time_query(cursor, page_sql, page_params, args.repeat)
+        cursor.close()
+        conn.rollback()
+    finally:
+        pos_app.pool.putconn(conn)
+        delete_seeded_orders()
+
+    print(f"{len(rows)} pending orders")
+    print(f"{'query':>24} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, timings in (('legacy correlated', legacy),
+                          ('pre-aggregated', current),
+                          (f'first page ({args.page_size})', paged)):
+        print(f"{name:>24} {statistics.median(timings):>9.2f} {percentile(timings, 95):>9.2f}")
+
+
+def bench_submit_order(args):
+    client = pos_app.app.test_client()
+    counter = {'statements': 0}
+    original = count_statements(counter)
+    created = []
+    print(f"{'containers':>10} {'items':>6} {'stmts/order':>12} {'p50 ms':>8} {'p95 ms':>8}")
+    try:
+        for size in args.sizes:
+            payload = make_order(size, args.items)
+            latencies = []
+            counter['statements'] = 0
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                response = client.post('/api/submit-order', json=payload, headers=auth_headers())
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 201:
+                    raise SystemExit(f"submit-order failed: {response.get_json()}")
+                created.append(response.get_json()['order_id'])
+            print(f"{size:>10} {size * args.items:>6} "
+                  f"{counter['statements'] / args.repeat:>12.1f} "
+                  f"{statistics.median(latencies):>8.2f} {percentile(latencies, 95):>8.2f}")
+    finally:
+        pos_app.get_db = original
+        cleanup_orders(created)
+
+
+def _submit_latencies(client, orders, created):
+    payload = make_order(3, 3)
+    latencies = []
+    for _ in range(orders):
+        start = time.perf_counter()
+        response = client.post('/api/submit-order', json=payload, headers=auth_headers())
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code == 201:
+            created.append(response.get_json()['order_id'])
+    return latencies
+
+
+def bench_login_storm(args):
+    conn = pos_app.pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM users WHERE username = %s", (BENCH_USER,))
+            cursor.execute(
+                "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s)",
+                (BENCH_USER, 'bench@example.com', generate_password_hash(BENCH_PASSWORD))
+            )
+        conn.commit()
+    finally:
+        pos_app.pool.putconn(conn)
+
+    # Measure hashing isolation, not the throttle
+    throttle = pos_app.login_throttle
+    throttle.max_per_username = throttle.max_per_ip = float('inf')
+
+    client = pos_app.app.test_client()
+    created = []
+    stop = threading.Event()
+    login_statuses = []
+
+    def storm():
+        storm_client = pos_app.app.test_client()
+        while not stop.is_set():
+            response = storm_client.post('/auth/login', json={
+                'username': BENCH_USER, 'password': BENCH_PASSWORD
+            })
+            login_statuses.append(response.status_code)
+
+    try:
+        # Warm up the hashing pool so process spawn isn't counted
+        client.post('/auth/login', json={'username': BENCH_USER, 'password': BENCH_PASSWORD})
+        baseline = _submit_latencies(client, args.orders, created)
+
+        threads = [threading.Thread(target=storm, daemon=True) for _ in range(args.logins)]
+        storm_start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        during = _submit_latencies(client, args.orders, created)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        storm_seconds = time.perf_counter() - storm_start
+    finally:
+        stop.set()
+        cleanup_orders(created)
+        conn = pos_app.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM users WHERE username = %s", (BENCH_USER,))
+            conn.commit()
+        finally:
+            pos_app.pool.putconn(conn)
+
+    print(f"{'submit-order':>14} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, latencies in (('baseline', baseline), ('login storm', during)):
+        print(f"{name:>14} {statistics.median(latencies):>8.2f} {percentile(latencies, 99):>8.2f}")
+    ok = login_statuses.count(200)
+    busy = login_statuses.count(503)
+    print(f"{len(login_statuses)} logins from {args.logins} threads in {storm_seconds:.1f}s: "
+          f"{ok} ok, {busy} shed with 503")
+
+
+def bench_group_commit(args):
+    payload = make_order(2, 3)
+    headers = auth_headers()
+    created = []
+    lock = threading.Lock()
+
+    def run_mode(group_commit):
+        pos_app.app.config['ORDER_GROUP_COMMIT'] = group_commit
+        latencies = []
+
+        def client_thread():
+            client = pos_app.app.test_client()
+            local_latencies, local_created = [], []
+            for _ in range(args.orders):
+                start = time.perf_counter()
+                response = client.post('/api/submit-order', json=payload, headers=headers)
+                local_latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code == 201:
+                    local_created.append(response.get_json()['order_id'])
+            with lock:
+                latencies.extend(local_latencies)
+                created.extend(local_created)
+
+        threads = [threading.Thread(target=client_thread) for _ in range(args.clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, time.perf_counter() - start
+
+    original = pos_app.app.config['ORDER_GROUP_COMMIT']
+    try:
+        results = [('per-request', run_mode(False)), ('group commit', run_mode(True))]
+    finally:
+        pos_app.app.config['ORDER_GROUP_COMMIT'] = original
+        cleanup_orders(created)
+
+    writer = pos_app.order_writer
+    print(f"{args.clients} clients x {args.orders} orders")
+    print(f"{'mode':>14} {'orders/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, (latencies, seconds) in results:
+        print(f"{name:>14} {len(latencies) / seconds:>9.1f} "
+              f"{statistics.median(latencies):>8.2f} {percentile(latencies, 99):>8.2f}")
+    if writer.batches:
+        print(f"group commit wrote {writer.orders} orders in {writer.batches} transactions "
+              f"(avg batch {writer.orders / writer.batches:.1f})")
+
+def _planning_ms(cursor, sql, params):
+    cursor.execute("EXPLAIN (ANALYZE, SUMMARY) " + sql, params)
+    for row in cursor.fetchall():
+        line = next(iter(row.values()))
+        if line.startswith('Planning Time:'):
+            return float(line.split()[2])
+    return 0.0
+
+
+def bench_prepared(args):
+    """Plain vs prepared execution of the hot read queries on one connection.
+
+    Also checks that both return the same rows, and that a statement
+    Postgres refuses to prepare still runs unprepared.
+    """
+    delete_seeded_orders()
+    seed_pending_orders(args.orders, args.containers, args.items)
+    registry = PreparedStatements()
+    queries = [
+        ('menu_items', MENU_ITEMS_SQL, ()),
+        ('cards_page', *pending_orders_query(limit=args.page_size)),
+        ('cards_by_location', *pending_orders_query(location='branch_1', limit=args.page_size)),
+    ]
+    results = []
+    conn = pos_app.pool.getconn()
+    try:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        for name, sql, params in queries:
+            plain_rows, plain = _time_query(cursor, sql, params, args.repeat)
+            plain_planning = statistics.median(
+                _planning_ms(cursor, sql, params) for _ in range(args.explain_repeat))
+
+            prepared = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                registry.execute(cursor, name, sql, params)
+                rows = cursor.fetchall()
+                prepared.append((time.perf_counter() - start) * 1000)
+            if rows != plain_rows:
+                raise SystemExit(f"{name}: prepared execution returned different rows")
+            statement = registry.statement_name(name, sql)
+            placeholders = ', '.join(['%s'] * len(params))
+            execute_sql = f"EXECUTE {statement}" + (f" ({placeholders})" if params else "")
+            prepared_planning = statistics.median(
+                _planning_ms(cursor, execute_sql, params) for _ in range(args.explain_repeat))
+            results.append((name, plain, prepared, plain_planning, prepared_planning))
+
+        # Untyped parameters can't be prepared; the registry must fall back
+        registry.execute(cursor, 'untyped', "SELECT %s AS value", ('ok',))
+        if cursor.fetchone()['value'] != 'ok':
+            raise SystemExit("fallback execution returned the wrong value")
+        fallback = registry.stats()['untyped']
+        cursor.close()
+        conn.rollback()
+    finally:
+        pos_app.pool.putconn(conn)
+        delete_seeded_orders()
+
+    print(f"{'query':>18} {'plain p50':>10} {'prep p50':>10} {'plan ms':>9} {'prep plan':>10}")
+    for name, plain, prepared, plain_planning, prepared_planning in results:
+        print(f"{name:>18} {statistics.median(plain):>10.3f} {statistics.median(prepared):>10.3f} "
+              f"{plain_planning:>9.3f} {prepared_planning:>10.3f}")
+    print(f"fallback: {fallback['unprepared']} of {fallback['executions']} untyped executions ran unprepared")
+
+
+def seed_order_history(cursor, days, orders_per_day):
+    """Fulfilled orders spread over the previous ``days`` days, in their own partitions.
+
+    Runs in the caller's transaction on a plain cursor. Returns the days
+    whose partitions were created here, for dropping later.
+    """
+    created = []
+    cursor.execute("SELECT current_date")
+    today = cursor.fetchone()[0]
+    for offset in range(1, days + 1):
+        day = today - timedelta(days=offset)
+        cursor.execute("SELECT create_order_partitions(%s)", (day,))
+        if cursor.fetchone()[0]:
+            created.append(day)
+    cursor.execute("""
+        INSERT INTO orders (user_id, order_type, location, payment, status, created_at)
+        SELECT %s || 'H' || lpad(d::text, 3, '0') || lpad(g::text, 6, '0'),
+               CASE WHEN g %% 2 = 0 THEN 'customer_online' ELSE 'walk_in' END,
+               'branch_' || (g %% 5), 'paid', 'fulfilled',
+               (current_date - d) + (g * 86399 / %s) * interval '1 second'
+        FROM generate_series(1, %s) d, generate_series(1, %s) g
+    """, (SEED_PREFIX, orders_per_day, days, orders_per_day))
+    cursor.execute("""
+        INSERT INTO order_containers
+            (order_id, created_at, container_number, packaging_type, message)
+        SELECT o.user_id, o.created_at, n, 'box', ''
+        FROM orders o, generate_series(1, 2) n
+        WHERE o.user_id LIKE %s AND o.created_at < current_date
+    """, (SEED_PREFIX + 'H%',))
+    cursor.execute("""
+        INSERT INTO order_items (container_id, created_at, food_name, price)
+        SELECT c.container_id, c.created_at, 'bench item ' || ((c.container_id + i) %% 7),
+               1.50 + i
+        FROM order_containers c, generate_series(1, 2) i
+        WHERE c.order_id LIKE %s AND c.created_at < current_date
+    """, (SEED_PREFIX + 'H%',))
+    cursor.execute("ANALYZE orders; ANALYZE order_containers; ANALYZE order_items")
+    return created
+
+
+def drop_partitions(days):
+    conn = pos_app.pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            for day in days:
+                for table in ORDER_PARTITION_TABLES:
+                    cursor.execute(f"DROP TABLE IF EXISTS {partition_name(table, day)}")
+        conn.commit()
+    finally:
+        pos_app.pool.putconn(conn)
+
+
+def bench_partitions(args):
+    """Kitchen-board and menu cost with a long order history behind today's backlog."""
+    delete_seeded_orders()
+    conn = pos_app.pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            created = seed_order_history(cursor, args.history_days, args.orders_per_day)
+        conn.commit()
+    finally:
+        pos_app.pool.putconn(conn)
+    seed_pending_orders(args.pending, 2, 2)
+    since = datetime.now(timezone.utc) - timedelta(hours=args.window_hours)
+    conn = pos_app.pool.getconn()
+    try:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        timings = []
+        for name, (sql, params) in (
+            ('board, all partitions', pending_orders_query()),
+            ('board, since window', pending_orders_query(since=since)),
+            ('page, since window', pending_orders_query(since=since, limit=args.page_size)),
+            ('menu', (MENU_ITEMS_SQL, None)),
+        ):
+            rows, samples = _time_query(cursor, sql, params, args.repeat)
+            timings.append((name, len(rows), samples))
+        cursor.close()
+        conn.rollback()
+    finally:
+        pos_app.pool.putconn(conn)
+        delete_seeded_orders()
+        drop_partitions(created)
+
+    print(f"{args.history_days} days x {args.orders_per_day} fulfilled orders, "
+          f"{args.pending} pending today")
+    print(f"{'query':>24} {'rows':>6} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, count, samples in timings:
+        print(f"{name:>24} {count:>6} {statistics.median(samples):>9.2f} {percentile(samples, 95):>9.2f}")
+
+
+# The ad-hoc report the rollups replace: the same aggregation, over raw rows
+RAW_REVENUE_SQL = f"""
+    WITH source AS (
+        SELECT * FROM orders WHERE created_at >= %(start)s AND created_at < %(end)s
+    ),
+    {reports.ORDER_TOTALS_SQL}
+    SELECT date_trunc(%(unit)s, raw.bucket) AS bucket,
+           sum(raw.orders) AS orders,
+           sum(raw.revenue) AS revenue
+    FROM ({reports.SALES_AGGREGATE_SQL}) raw
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+
+def bench_reports(args):
+    """Report latency from rollups vs raw rows as history grows, plus reconciliation.
+
+    Each history size runs in one transaction that is rolled back, so the
+    real rollups, queue and order tables are left as they were. The rollups
+    are rebuilt from the existing orders first and the seeded history is
+    added by a second refresh, to exercise the incremental path.
+    """
+    results = []
+    for days in args.history_days:
+        conn = pos_app.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM sales_hourly; DELETE FROM item_sales_hourly; "
+                               "DELETE FROM report_watermark; DELETE FROM report_queue")
+                cursor.execute("INSERT INTO report_queue (order_id, created_at) "
+                               "SELECT user_id, created_at FROM orders")
+                reports.refresh_rollups(cursor)
+                seed_order_history(cursor, days, args.orders_per_day)
+                reports.refresh_rollups(cursor)
+                through, mismatches = reports.reconcile(cursor, None)
+                if mismatches:
+                    for table, row in mismatches[:10]:
+                        print(f"MISMATCH {table}: {row}")
+                    raise SystemExit(f"{len(mismatches)} rollup rows differ from recomputation")
+
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            last_day = {'unit': 'hour', 'start': through - timedelta(days=1), 'end': through}
+            everything = {'unit': 'day', 'start': through - timedelta(days=days + 1), 'end': through}
+            timings = []
+            for name, sql, params in (
+                ('revenue last day (rollup)', reports.REVENUE_REPORT_SQL, last_day),
+                ('revenue last day (raw)', RAW_REVENUE_SQL, last_day),
+                ('revenue all days (rollup)', reports.REVENUE_REPORT_SQL, everything),
+                ('revenue all days (raw)', RAW_REVENUE_SQL, everything),
+                ('top items by day (rollup)', reports.ITEMS_REPORT_SQL, dict(everything, limit=5)),
+            ):
+                _, samples = _time_query(cursor, sql, params, args.repeat)
+                timings.append((name, samples))
+            cursor.close()
+            results.append((days, timings))
+        finally:
+            conn.rollback()
+            pos_app.pool.putconn(conn)
+
+    print(f"{args.orders_per_day} orders per day; rollups match recomputation for every size")
+    print(f"{'days':>5} {'query':>28} {'p50 ms':>9} {'p95 ms':>9}")
+    for days, timings in results:
+        for name, samples in timings:
+            print(f"{days:>5} {name:>28} {statistics.median(samples):>9.2f} "
+                  f"{percentile(samples, 95):>9.2f}")
+
+
+def _menu_csv(rows):
+    lines = ['action,item_id,food_name,price,packaging_type,image_url']
+    lines.extend(','.join('' if value is None else str(value) for value in row) for row in rows)
+    return '\n'.join(lines).encode()
+
+
+def _bench_menu_items(client):
+    response = client.get('/api/menu-items', headers={'X-Read-From': 'primary'})
+    return {item['food_name']: item['item_id'] for item in response.get_json()
+            if item['food_name'].startswith(SEED_PREFIX)}
+
+
+def bench_menu_bulk(args):
+    """Add, reprice and remove ``--items`` menu items one request at a time vs one upload each.
+
+    Both paths end with the seeded items deleted again. Statement counts
+    include the menu-version bump and commit.
+    """
+    client = pos_app.app.test_client()
+    headers = auth_headers()
+    names = [f"{SEED_PREFIX}menu_{n}" for n in range(args.items)]
+    counter = {'statements': 0}
+    original = count_statements(counter)
+    results = []
+
+    def timed(label, requests):
+        counter['statements'] = 0
+        start = time.perf_counter()
+        for send in requests:
+            response = send()
+            if response.status_code not in (200, 201):
+                raise SystemExit(f"{label} failed: {response.get_json()}")
+        results.append((label, (time.perf_counter() - start) * 1000, counter['statements']))
+
+    def post(name, price):
+        return lambda: client.post('/api/menu-items', headers=headers, json={
+            'food_name': name, 'price': price, 'packaging_type': 'box', 'image_url': ''
+        })
+
+    def delete(item_id):
+        return lambda: client.delete(f'/api/menu-items/{item_id}', headers=headers)
+
+    def upload(rows):
+        return [lambda: client.post('/api/menu-items/bulk', data=_menu_csv(rows),
+                                    headers=dict(headers, **{'Content-Type': 'text/csv'}))]
+
+    try:
+        # The single-item API has no update, so a reprice is a delete and re-add
+        timed('per-item insert', [post(name, '5.00') for name in names])
+        ids = _bench_menu_items(client)
+        timed('per-item reprice', [send for name in names
+                                   for send in (delete(ids[name]), post(name, '6.00'))])
+        ids = _bench_menu_items(client)
+        timed('per-item delete', [delete(ids[name]) for name in names])
+
+        timed('bulk insert', upload([('upsert', None, name, '5.00', 'box', None) for name in names]))
+        timed('bulk reprice', upload([('upsert', None, name, '6.00', None, None) for name in names]))
+        prices = {item['food_name']: item['price'] for item in
+                  client.get('/api/menu-items', headers={'X-Read-From': 'primary'}).get_json()
+                  if item['food_name'].startswith(SEED_PREFIX)}
+        if len(prices) != len(names) or any(float(price) != 6.0 for price in prices.values()):
+            raise SystemExit("bulk reprice did not update every item")
+        timed('bulk delete', upload([('delete', None, name, None, None, None) for name in names]))
+    finally:
+        pos_app.get_db = original
+        leftover = _bench_menu_items(client)
+        if leftover:
+            client.post('/api/menu-items/bulk', headers=dict(headers, **{'Content-Type': 'text/csv'}),
+                        data=_menu_csv([('delete', item_id, None, None, None, None)
+                                        for item_id in leftover.values()]))
+
+    print(f"{args.items} menu items")
+    print(f"{'operation':>18} {'total ms':>10} {'ms/item':>8} {'statements':>11}")
+    for label, elapsed, statements in results:
+        print(f"{label:>18} {elapsed:>10.1f} {elapsed / args.items:>8.3f} {statements:>11}")
+
+
+def _duplicate_burst(key, payload, clients):
+    """Send ``clients`` identical keyed submissions at once; returns the responses."""
+    headers = dict(auth_headers(), **{'Idempotency-Key': key})
+    barrier = threading.Barrier(clients)
+    responses = [None] * clients
+
+    def client_thread(n):
+        client = pos_app.app.test_client()
+        barrier.wait()
+        response = client.post('/api/submit-order', json=payload, headers=headers)
+        responses[n] = (response.status_code, response.get_json(),
+                        response.headers.get('Idempotent-Replayed') == 'true')
+
+    threads = [threading.Thread(target=client_thread, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def _orders_at(location):
+    conn = pos_app.pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT user_id FROM orders WHERE location = %s", (location,))
+            return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.rollback()
+        pos_app.pool.putconn(conn)
+
+
+def bench_idempotency(args):
+    """How concurrent duplicate submissions are answered, and what a replay costs.
+
+    Each round fires ``--clients`` identical requests under one key, once
+    collapsing in this worker and once with every request acting as its
+    own worker (so duplicates meet on the idempotency_keys row), for both
+    commit modes. Then times a first submission against its replays.
+    tests/test_idempotency.py checks that each burst creates one order.
+    """
+    created = []
+    rounds = []
+    original_store = pos_app.idempotency_store
+    original_mode = pos_app.app.config['ORDER_GROUP_COMMIT']
+    run_id = f"{SEED_PREFIX}{int(time.time())}"
+    try:
+        for group_commit in (False, True):
+            pos_app.app.config['ORDER_GROUP_COMMIT'] = group_commit
+            for sharing in ('one worker', 'many workers'):
+                pos_app.idempotency_store = (original_store if sharing == 'one worker'
+                                              else PerRequestStore(original_store))
+                for n in range(args.rounds):
+                    location = f"{run_id}_{int(group_commit)}_{sharing[0]}_{n}"
+                    payload = dict(make_order(2, 2), location=location)
+                    responses = _duplicate_burst(f"{location}_key", payload, args.clients)
+                    created.extend(_orders_at(location))
+                    rounds.append((group_commit, sharing, sum(replayed for _, _, replayed in responses)))
+        pos_app.idempotency_store = original_store
+        pos_app.app.config['ORDER_GROUP_COMMIT'] = False
+
+        # First submission, replay from this worker's cache, replay from the table
+        client = pos_app.app.test_client()
+        payload = dict(make_order(2, 2), location=f"{run_id}_latency")
+        timings = {'first': [], 'replay (memory)': [], 'replay (table)': []}
+        for n in range(args.repeat):
+            headers = dict(auth_headers(), **{'Idempotency-Key': f"{run_id}_latency_{n}"})
+            for name in timings:
+                if name == 'replay (table)':
+                    original_store.clear()
+                start = time.perf_counter()
+                client.post('/api/submit-order', json=payload, headers=headers)
+                timings[name].append((time.perf_counter() - start) * 1000)
+        created.extend(_orders_at(f"{run_id}_latency"))
+    finally:
+        pos_app.idempotency_store = original_store
+        pos_app.app.config['ORDER_GROUP_COMMIT'] = original_mode
+        cleanup_orders(created)
+        conn = pos_app.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM idempotency_keys WHERE key LIKE %s", (f"{run_id}%",))
+            conn.commit()
+        finally:
+            pos_app.pool.putconn(conn)
+
+    print(f"{args.clients} concurrent duplicates per round, {args.rounds} rounds per case")
+    print(f"{'commit mode':>12} {'requests':>13} {'replayed/round':>15}")
+    for group_commit in (False, True):
+        for sharing in ('one worker', 'many workers'):
+            replayed = [r for g, s, r in rounds if g == group_commit and s == sharing]
+            print(f"{'group' if group_commit else 'per-request':>12} {sharing:>13} "
+                  f"{statistics.mean(replayed):>15.1f}")
+    print(f"{'submission':>22} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, samples in timings.items():
+        print(f"{name:>22} {statistics.median(samples):>8.2f} {percentile(samples, 95):>8.2f}")
+
+
+IMPORT_TIMER = (
+    "import threading, time; start = time.perf_counter(); import app; imported = time.perf_counter(); "
+    "threads = threading.active_count(); app.create_app(); "
+    "print(threads, imported - start, time.perf_counter() - imported)"
+)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _time_to_ready(env, timeout=30.0):
+    """Seconds from spawning an app server until /health/ready answers 200."""
+    port = _free_port()
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    server = subprocess.Popen([
+        sys.executable, '-c',
+        f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"
+    ], cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/health/ready', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            time.sleep(0.01)
+        raise SystemExit("App server did not become ready")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _check_fork_safety():
+    """A forked child must get its own connection, not the parent's socket."""
+    conn = pos_app.pool.getconn()
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid()")
+        parent_pid = cursor.fetchone()[0]
+    conn.rollback()
+    pos_app.pool.putconn(conn)
+
+    child = os.fork()
+    if child == 0:
+        code = 1
+        try:
+            child_conn = pos_app.pool.getconn()
+            with child_conn.cursor() as cursor:
+                cursor.execute("SELECT pg_backend_pid()")
+                code = 0 if cursor.fetchone()[0] != parent_pid else 2
+            pos_app.pool.putconn(child_conn, close=True)
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(child, 0)
+
+    # The parent's pooled connection must still work after the child exits
+    conn = pos_app.pool.getconn()
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid()")
+        still_same = cursor.fetchone()[0] == parent_pid
+    conn.rollback()
+    pos_app.pool.putconn(conn)
+    return os.waitstatus_to_exitcode(status) == 0 and still_same
+
+
+def bench_startup(args):
+    """Worker startup cost: import and app creation, time to ready, fork safety."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    # Point the app at a port nothing listens on: import must not care
+    offline_env = dict(os.environ, PGHOST='127.0.0.1', PGPORT=str(_free_port()))
+    imports, creates = [], []
+    for _ in range(args.repeat):
+        output = subprocess.run([sys.executable, '-c', IMPORT_TIMER], cwd=here, env=offline_env,
+                                capture_output=True, text=True, check=True).stdout.split()
+        if int(output[-3]) != 1:
+            # A pre-fork master would fork with these threads' locks in any state
+            raise SystemExit(f"import app started {int(output[-3]) - 1} background threads")
+        imports.append(float(output[-2]) * 1000)
+        creates.append(float(output[-1]) * 1000)
+
+    ready = [_time_to_ready(dict(os.environ)) * 1000 for _ in range(args.ready_repeat)]
+    fork_ok = _check_fork_safety() if hasattr(os, 'fork') else None
+
+    print(f"{'phase':>34} {'p50 ms':>9} {'max ms':>9}")
+    for name, samples in (('import app (database unreachable)', imports),
+                          ('create_app()', creates),
+                          ('spawn to /health/ready', ready)):
+        print(f"{name:>34} {statistics.median(samples):>9.2f} {max(samples):>9.2f}")
+    if fork_ok is None:
+        print("fork check skipped: os.fork is not available")
+    elif not fork_ok:
+        raise SystemExit("fork check failed: child reused the parent's connection")
+    else:
+        print("fork check passed: child opened its own connection, parent's still works")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    submit = subparsers.add_parser('submit-order', help='statements and latency per order by size')
+    submit.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 4, 6, 8, 12])
+    submit.add_argument('--items', type=int, default=4, help='food items per container')
+    submit.add_argument('--repeat', type=int, default=20)
+    submit.set_defaults(func=bench_submit_order)
+
+    cards = subparsers.add_parser('cards', help='kitchen-board aggregation over a seeded backlog')
+    cards.add_argument('--orders', type=int, default=10000)
+    cards.add_argument('--containers', type=int, default=3, help='containers per order')
+    cards.add_argument('--items', type=int, default=3, help='food items per container')
+    cards.add_argument('--page-size', type=int, default=50)
+    cards.add_argument('--repeat', type=int, default=10)
+    cards.set_defaults(func=bench_cards)
+
+    storm = subparsers.add_parser('login-storm', help='submit-order latency while logins saturate hashing')
+    storm.add_argument('--logins', type=int, default=32, help='concurrent login threads')
+    storm.add_argument('--orders', type=int, default=200, help='orders submitted per phase')
+    storm.set_defaults(func=bench_login_storm)
+
+    group = subparsers.add_parser('group-commit', help='order throughput, per-request vs group commit')
+    group.add_argument('--clients', type=int, default=32, help='concurrent submitting threads')
+    group.add_argument('--orders', type=int, default=50, help='orders per client per mode')
+    group.set_defaults(func=bench_group_commit)
+
+    prepared = subparsers.add_parser('prepared', help='parse/plan time, plain vs prepared statements')
+    prepared.add_argument('--orders', type=int, default=500)
+    prepared.add_argument('--containers', type=int, default=3, help='containers per order')
+    prepared.add_argument('--items', type=int, default=3, help='food items per container')
+    prepared.add_argument('--page-size', type=int, default=50)
+    prepared.add_argument('--repeat', type=int, default=200)
+    prepared.add_argument('--explain-repeat', type=int, default=10)
+    prepared.set_defaults(func=bench_prepared)
+
+    history = subparsers.add_parser('partitions', help='board and menu cost over a long order history')
+    history.add_argument('--history-days', type=int, default=30)
+    history.add_argument('--orders-per-day', type=int, default=2000)
+    history.add_argument('--pending', type=int, default=500, help='pending orders seeded today')
+    history.add_argument('--page-size', type=int, default=50)
+    history.add_argument('--window-hours', type=int, default=48,
+                         help='kitchen board window (POS_KITCHEN_BOARD_HOURS) to compare')
+    history.add_argument('--repeat', type=int, default=10)
+    history.set_defaults(func=bench_partitions)
+
+    rollups = subparsers.add_parser('reports', help='report latency from rollups vs raw rows')
+    rollups.add_argument('--history-days', type=int, nargs='+', default=[7, 30, 90])
+    rollups.add_argument('--orders-per-day', type=int, default=1000)
+    rollups.add_argument('--repeat', type=int, default=10)
+    rollups.set_defaults(func=bench_reports)
+
+    menu = subparsers.add_parser('menu-bulk', help='menu admin cost, per-item requests vs bulk upload')
+    menu.add_argument('--items', type=int, default=500)
+    menu.set_defaults(func=bench_menu_bulk)
+
+    idem = subparsers.add_parser('idempotency', help='concurrent duplicate submissions under one key')
+    idem.add_argument('--clients', type=int, default=16, help='duplicates sent at once')
+    idem.add_argument('--rounds', type=int, default=10)
+    idem.add_argument('--repeat', type=int, default=20, help='keys for the replay latency test')
+    idem.set_defaults(func=bench_idempotency)
+
+    startup = subparsers.add_parser('startup', help='import, app creation and time-to-ready')
+    startup.add_argument('--repeat', type=int, default=10, help='cold imports to time')
+    startup.add_argument('--ready-repeat', type=int, default=3, help='server starts to time')
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Settings, read from the environment with defaults for local development.
+
+Database connection settings use the standard libpq variables (PGHOST,
+PGPORT, PGDATABASE, PGUSER); the password is never stored here, libpq reads
+PGPASSWORD or ~/.pgpass itself. Application settings use a POS_ prefix.
+Importing this module only reads os.environ.
+"""
+import json
+import os
+from datetime import timedelta
+
+
+def _env(name, default=None):
+    value = os.environ.get(name)
+    return default if value in (None, '') else value
+
+
+def _env_int(name, default):
+    return int(_env(name, default))
+
+
+def _env_bool(name, default):
+    value = _env(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+DB_CONFIG = {
+    "dbname": _env('PGDATABASE', 'pos_system'),
+    "user": _env('PGUSER', 'jkorm'),
+    "host": _env('PGHOST', 'localhost')
+}
+if _env('PGPORT'):
+    DB_CONFIG['port'] = _env('PGPORT')
+
+# SQLAlchemy URL for models.py; built from DB_CONFIG unless given outright
+DATABASE_URL = _env('POS_DATABASE_URL') or (
+    f"postgresql+psycopg2://{DB_CONFIG['user']}@{DB_CONFIG['host']}"
+    f"{':' + DB_CONFIG['port'] if 'port' in DB_CONFIG else ''}/{DB_CONFIG['dbname']}"
+)
+
+# Optional streaming replicas for read-heavy endpoints: libpq DSNs separated
+# by semicolons, e.g. "host=replica1 dbname=pos_system;host=replica2 dbname=pos_system"
+REPLICA_DSNS = [dsn.strip() for dsn in _env('POS_REPLICA_DSNS', '').split(';') if dsn.strip()]
+
+POOL_MIN_SIZE = _env_int('POS_POOL_MIN_SIZE', 2)
+POOL_MAX_SIZE = _env_int('POS_POOL_MAX_SIZE', 20)
+
+LOG_LEVEL = _env('POS_LOG_LEVEL', 'INFO')
+
+# Login and signup attempts allowed per minute (passwords.LoginThrottle);
+# load tests raise them so logins exercise the KDF, not the 429 path
+LOGIN_MAX_PER_USERNAME = _env_int('POS_LOGIN_MAX_PER_USERNAME', 10)
+LOGIN_MAX_PER_IP = _env_int('POS_LOGIN_MAX_PER_IP', 30)
+
+# Flask settings applied by app.create_app()
+APP_CONFIG = {
+    # Signs JWTs; every worker must share the same key
+    'SECRET_KEY': _env('POS_SECRET_KEY'),
+    # Rows fetched per round trip when streaming large result sets
+    'STREAM_FETCH_SIZE': _env_int('POS_STREAM_FETCH_SIZE', 500),
+    # Commit submitted orders in batches from a background writer (order_queue)
+    'ORDER_GROUP_COMMIT': _env_bool('POS_ORDER_GROUP_COMMIT', False),
+    # Opt-in: pending orders older than this many hours drop off the kitchen
+    # board, so its queries only touch the most recent day partitions. Unset,
+    # the board shows every unfinished order however old.
+    'KITCHEN_BOARD_WINDOW': (timedelta(hours=_env_int('POS_KITCHEN_BOARD_HOURS', 0))
+                             if _env('POS_KITCHEN_BOARD_HOURS') else None),
+    # Create and archive order partitions from a background thread in each
+    # worker; turn off when main.py maintain-partitions runs from cron instead
+    'PARTITION_MAINTENANCE': _env_bool('POS_PARTITION_MAINTENANCE', True),
+    # Roll new orders into the reporting tables from a background thread
+    'REPORT_REFRESH': _env_bool('POS_REPORT_REFRESH', True),
+    'CORS_ORIGINS': json.loads(_env('POS_CORS_ORIGINS', json.dumps([
+        "http://localhost:5173",
+        "http://localhost:5174",
+        "http://127.0.0.1:5173",
+        "http://127.0.0.1:5174"
+    ])))
+}
@@ -0,0 +1,198 @@
+"""Idempotency-Key support for order submission.
+
+A client that retries /api/submit-order after losing the response sends the
+same Idempotency-Key header again and gets the first attempt's response
+instead of a second order. Keys are scoped to the authenticated user and
+remembered for IDEMPOTENCY_KEY_TTL. A repeated key is answered by, in order:
+
+* a per-worker LRU of recent responses, without touching the database;
+* the request already running in this worker under that key: duplicates
+  wait for it and share its result instead of executing again;
+* the idempotency_keys table. write_orders() claims the key in the order's
+  own transaction, so a key is stored exactly when its order is. A
+  duplicate in another worker finds the key taken or locked, waits for the
+  first transaction to end (in its own request, never inside a
+  group-commit batch), then replays the stored response.
+
+Only 2xx responses are remembered; after an error the client may retry
+under the same key. Reusing a key for a different request is refused.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+from psycopg2 import errors
+from psycopg2.extras import Json
+from queries import IDEMPOTENCY_KEY_SQL, PURGE_IDEMPOTENCY_KEYS_SQL, WAIT_IDEMPOTENCY_KEY_SQL
+
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+IDEMPOTENCY_CACHE_SIZE = 4096
+# Longer than a group-commit caller waits for its order, so a duplicate
+# normally sees the first request finish
+IDEMPOTENCY_WAIT_TIMEOUT = 35.0  # seconds
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+IdempotentResponse = namedtuple("IdempotentResponse", ["status", "body", "replayed"])
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different request."""
+
+
+class IdempotencyInProgress(Exception):
+    """The first request with this key hasn't finished yet."""
+
+
+def request_fingerprint(path, body):
+    """SHA-256 of the endpoint and the raw request body; retries resend the same bytes."""
+    return hashlib.sha256(path.encode() + b'\n' + body).hexdigest()
+
+
+def stored_response(cursor, scope, key):
+    """``(request_hash, status, body)`` stored for a live key, or None."""
+    cursor.execute(IDEMPOTENCY_KEY_SQL, (scope, key))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return row['request_hash'], row['response_status'], row['response_body']
+    return tuple(row)
+
+
+def wait_for_key(cursor, scope, key, timeout=IDEMPOTENCY_WAIT_TIMEOUT):
+    """Wait until no other transaction is writing the key; False after ``timeout`` seconds.
+
+    The key stays locked until the caller's transaction ends, which must be
+    rolled back after a timeout.
+    """
+    cursor.execute("SELECT set_config('lock_timeout', %s, true)", (f"{int(timeout * 1000)}ms",))
+    try:
+        cursor.execute(WAIT_IDEMPOTENCY_KEY_SQL, (scope, key))
+    except errors.LockNotAvailable:
+        return False
+    return True
+
+
+def purge_expired(conn):
+    """Delete expired keys; returns how many were removed."""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(PURGE_IDEMPOTENCY_KEYS_SQL)
+            purged = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return purged
+
+
+class _InFlight:
+    __slots__ = ('request_hash', 'done', 'result', 'error')
+
+    def __init__(self, request_hash):
+        self.request_hash = request_hash
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class IdempotencyStore:
+    """Per-worker front for the idempotency_keys table.
+
+    run() executes a keyed request at most once per worker at a time and
+    serves repeats from memory while the key is live.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_KEY_TTL, maxsize=IDEMPOTENCY_CACHE_SIZE,
+                 wait_timeout=IDEMPOTENCY_WAIT_TIMEOUT):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.wait_timeout = wait_timeout
+        self._completed = OrderedDict()  # (scope, key) -> (request_hash, status, body, expires_at)
+        self._in_flight = {}  # (scope, key) -> _InFlight
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.cache_replays = 0
+        self.collapsed = 0
+
+    def claim(self, scope, key, request_hash, status, body):
+        """Row for write_orders() that records ``body`` as the key's response."""
+        return (scope, key, request_hash, status, Json(body), self.ttl)
+
+    def run(self, scope, key, request_hash, execute):
+        """Answer a keyed request, calling ``execute()`` only if nothing has yet.
+
+        ``execute()`` returns an IdempotentResponse; it sets ``replayed`` when
+        it found the key already stored. Raises IdempotencyConflict if the
+        key belongs to a different request and IdempotencyInProgress if the
+        first request is still running after ``wait_timeout`` seconds.
+        Exceptions from ``execute()`` reach every request waiting on it.
+        """
+        entry_key = (scope, key)
+        with self._lock:
+            entry = self._completed.get(entry_key)
+            if entry is not None:
+                stored_hash, status, body, expires_at = entry
+                if time.monotonic() < expires_at:
+                    if stored_hash != request_hash:
+                        raise IdempotencyConflict("Idempotency-Key was used for a different request")
+                    self._completed.move_to_end(entry_key)
+                    self.cache_replays += 1
+                    return IdempotentResponse(status, body, True)
+                del self._completed[entry_key]
+
+            flight = self._in_flight.get(entry_key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[entry_key] = _InFlight(request_hash)
+                self.executions += 1
+            elif flight.request_hash != request_hash:
+                raise IdempotencyConflict("Idempotency-Key was used for a different request")
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            if not flight.done.wait(self.wait_timeout):
+                raise IdempotencyInProgress("A request with this Idempotency-Key is still in progress")
+            if flight.error is not None:
+                raise flight.error
+            result = flight.result
+            return result._replace(replayed=True) if 200 <= result.status < 300 else result
+
+        try:
+            flight.result = execute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[entry_key]
+                result = flight.result
+                if result is not None and 200 <= result.status < 300:
+                    expires_at = time.monotonic() + self.ttl.total_seconds()
+                    self._completed[entry_key] = (request_hash, result.status, result.body, expires_at)
+                    self._completed.move_to_end(entry_key)
+                    while len(self._completed) > self.maxsize:
+                        self._completed.popitem(last=False)
+            flight.done.set()
+        return flight.result
+
+    def clear(self):
+        with self._lock:
+            self._completed.clear()
+
+    def _after_fork(self):
+        # Requests in flight belong to the parent's threads
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._completed),
+                'in_flight': len(self._in_flight),
+                'executions': self.executions,
+                'cache_replays': self.cache_replays,
+                'collapsed': self.collapsed
+            }
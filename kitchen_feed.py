@@ -0,0 +1,170 @@
+import json
+import queue
+import select
+import threading
+import time
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from logs import get_logger
+from prepared import statements
+from queries import pending_orders_query
+
+logger = get_logger('kitchen_feed')
+
+KITCHEN_CHANNEL = "kitchen_orders"
+SUBSCRIBER_QUEUE_SIZE = 1000
+LISTEN_POLL_INTERVAL = 5.0  # seconds between liveness checks on the LISTEN socket
+RECONNECT_DELAY = 2.0
+LISTEN_READY_TIMEOUT = 5.0
+SSE_KEEPALIVE_INTERVAL = 15.0  # comment line sent to idle streams so proxies keep them open
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class Subscription:
+    def __init__(self, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+
+class KitchenFeed:
+    """Fans out order notifications from one LISTEN connection to SSE clients.
+
+    The orders_kitchen_notify trigger sends NOTIFY on every order insert and
+    status change. A single listener thread per worker process drains those
+    notifications, fetches the affected cards once and hands the same
+    pre-formatted event to every subscriber, so database load does not grow
+    with the number of kitchen screens.
+
+    A ``None`` on a subscriber's queue means it must reconnect: either it fell
+    too far behind or the listener lost its connection and may have missed
+    events. Browsers' EventSource reconnects and receives a fresh snapshot.
+    """
+
+    def __init__(self, pool, connect_kwargs):
+        self._pool = pool
+        self._connect_kwargs = connect_kwargs
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._listening = threading.Event()
+
+    def subscribe(self):
+        """Register a subscriber once the listener is receiving notifications.
+
+        Take the initial snapshot after subscribing so no change can fall
+        between the snapshot and the first event.
+        """
+        subscription = Subscription()
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="kitchen-feed", daemon=True)
+                self._thread.start()
+        self._listening.wait(LISTEN_READY_TIMEOUT)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                self._drop(subscription)
+
+    def _after_fork(self):
+        # The parent's subscribers and listener thread don't exist here
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._listening = threading.Event()
+
+    def _drop(self, subscription):
+        self.unsubscribe(subscription)
+        try:
+            while True:
+                subscription.queue.get_nowait()
+        except queue.Empty:
+            pass
+        subscription.queue.put_nowait(None)
+
+    def _drop_all(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            self._drop(subscription)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            listen_conn = None
+            try:
+                listen_conn = psycopg2.connect(**self._connect_kwargs)
+                listen_conn.autocommit = True
+                with listen_conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {KITCHEN_CHANNEL}")
+                self._listening.set()
+                self._listen(listen_conn)
+            except Exception:
+                logger.exception("Kitchen feed listener error")
+                # Events may have been missed; make clients resync
+                self._drop_all()
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                self._listening.clear()
+                if listen_conn is not None:
+                    listen_conn.close()
+
+    def _listen(self, listen_conn):
+        while self.subscriber_count():
+            ready, _, _ = select.select([listen_conn], [], [], LISTEN_POLL_INTERVAL)
+            if ready:
+                listen_conn.poll()
+            else:
+                # Surfaces a dead connection as psycopg2.OperationalError
+                with listen_conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            changes = {}
+            while listen_conn.notifies:
+                notify = listen_conn.notifies.pop(0)
+                try:
+                    payload = json.loads(notify.payload)
+                except ValueError:
+                    continue
+                changes[payload['order_id']] = payload['status']
+            if changes:
+                self._dispatch(changes)
+
+    def _dispatch(self, changes):
+        pending = [order_id for order_id, status in changes.items() if status == 'pending']
+        for order_id, status in changes.items():
+            if status != 'pending':
+                self.publish(format_event('order_removed', {'order_id': order_id, 'status': status}))
+        if not pending:
+            return
+
+        conn = self._pool.getconn()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                statements.execute(cursor, 'pending_orders', *pending_orders_query(order_ids=pending))
+                cards = cursor.fetchall()
+        finally:
+            self._pool.putconn(conn)
+        for card in cards:
+            self.publish(format_event('order_added', card))
@@ -0,0 +1,477 @@
+"""Load test and replay harness for the POS API.
+
+Generates a seeded request mix (menu GETs, submit-order bursts, /cards
+polling and logins) or replays a recorded trace against a running server,
+then reports throughput and per-endpoint latency percentiles.
+
+    # throwaway Postgres + app server, seeded, 5000 requests, saved report
+    python loadtest.py run --throwaway --requests 5000 --concurrency 16 --output before.json
+
+    # against an already running server and database
+    python loadtest.py run --url http://127.0.0.1:5000 --record trace.jsonl
+    python loadtest.py run --url http://127.0.0.1:5000 --replay trace.jsonl
+
+    python loadtest.py compare before.json after.json
+
+A trace is JSON lines of {"op", "method", "path", "body"}; --record writes
+the generated mix so later runs can replay exactly the same requests.
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import psycopg2
+from config import DB_CONFIG
+from queries import BUMP_MENU_VERSION_SQL
+
+SEED_PREFIX = 'LOAD_'
+SEED_PATTERN = 'LOAD\\_%'  # LIKE pattern; _ is a wildcard otherwise
+SEED_MENU_PATTERN = 'LOAD\\_menu %'
+LOAD_USER_COUNT = 8
+LOAD_PASSWORD = 'load-password'
+# For servers this harness starts: the default throttle allows ~30 logins a
+# minute per IP, far fewer than a run sends, and would answer most with 429
+LOAD_LOGIN_LIMITS = {'POS_LOGIN_MAX_PER_IP': '1000000', 'POS_LOGIN_MAX_PER_USERNAME': '1000000'}
+
+DEFAULT_MIX = {'menu': 40, 'cards': 30, 'submit_order': 25, 'login': 5}
+PACKAGING = ['box', 'bag', 'bowl', 'cup']
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ThrowawayPostgres:
+    """Temporary Postgres cluster with the role and database app.py expects.
+
+    Child processes started with ``env`` see PGPORT, which config.py reads,
+    so they connect to this cluster.
+    """
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.port = free_port()
+        self.root = tempfile.mkdtemp(prefix='pos-loadtest-')
+        self.data_dir = os.path.join(self.root, 'data')
+        self.env = dict(os.environ, PGPORT=str(self.port), **LOAD_LOGIN_LIMITS)
+
+    def start(self):
+        for tool in ('initdb', 'pg_ctl', 'psql'):
+            if shutil.which(tool) is None:
+                raise SystemExit(f"{tool} not found on PATH; install Postgres or drop --throwaway")
+        subprocess.run(['initdb', '-D', self.data_dir, '-U', 'postgres', '--auth=trust'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([
+            'pg_ctl', '-D', self.data_dir, '-w', '-l', os.path.join(self.root, 'postgres.log'),
+            '-o', f"-p {self.port} -k {self.root} -c listen_addresses=localhost -c fsync=off",
+            'start'
+        ], check=True, stdout=subprocess.DEVNULL)
+        user = self.db_config['user']
+        # Trust authentication, so the role needs no password
+        self.psql(f"CREATE ROLE {user} LOGIN")
+        self.psql(f"CREATE DATABASE {self.db_config['dbname']} OWNER {user}")
+
+    def psql(self, sql):
+        subprocess.run(['psql', '-h', 'localhost', '-U', 'postgres', '-d', 'postgres',
+                        '-v', 'ON_ERROR_STOP=1', '-c', sql],
+                       check=True, env=self.env, stdout=subprocess.DEVNULL)
+
+    def stop(self):
+        subprocess.run(['pg_ctl', '-D', self.data_dir, '-m', 'fast', 'stop'],
+                       stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def start_app_server(port, env):
+    server = subprocess.Popen([
+        sys.executable, '-c',
+        f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"
+    ], cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return server
+        except OSError:
+            if server.poll() is not None:
+                raise SystemExit("App server exited during startup")
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("App server did not start listening")
+
+
+def seed(conn, menu_items, backlog_orders):
+    """Load a menu and a pending backlog tagged with SEED_PREFIX."""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            WITH new_containers AS (
+                INSERT INTO containers (packaging_type)
+                SELECT (ARRAY['box', 'bag', 'bowl', 'cup'])[1 + g %% 4]
+                FROM generate_series(1, %s) g
+                RETURNING container_id
+            )
+            INSERT INTO food_items (container_id, food_name, price, is_ordered, image_url)
+            SELECT container_id, %s || 'menu ' || container_id, 2.50 + (container_id %% 10), FALSE, ''
+            FROM new_containers
+        """, (menu_items, SEED_PREFIX))
+        cursor.execute(BUMP_MENU_VERSION_SQL)
+        cursor.execute("""
+            INSERT INTO orders (user_id, order_type, location, payment, status)
+            SELECT %s || lpad(g::text, 7, '0'),
+                   CASE WHEN g %% 2 = 0 THEN 'customer_online' ELSE 'walk_in' END,
+                   'branch_' || (g %% 5), 'pending', 'pending'
+            FROM generate_series(1, %s) g
+        """, (SEED_PREFIX, backlog_orders))
+        cursor.execute("""
+            INSERT INTO order_containers (order_id, container_number, packaging_type, message)
+            SELECT o.user_id, n, 'box', ''
+            FROM orders o, generate_series(1, 2) n
+            WHERE o.user_id LIKE %s
+        """, (SEED_PATTERN,))
+        cursor.execute("""
+            INSERT INTO order_items (container_id, food_name, price)
+            SELECT c.container_id, 'load item ' || i, 3.00
+            FROM order_containers c, generate_series(1, 2) i
+            WHERE c.order_id LIKE %s
+        """, (SEED_PATTERN,))
+        cursor.execute("ANALYZE orders; ANALYZE order_containers; ANALYZE order_items; "
+                       "ANALYZE containers; ANALYZE food_items")
+    conn.commit()
+
+
+def unseed(conn):
+    with conn.cursor() as cursor:
+        # Seeded backlog plus any orders the run submitted
+        cursor.execute("""
+            SELECT user_id FROM orders
+            WHERE user_id LIKE %s OR location = 'loadtest'
+        """, (SEED_PATTERN,))
+        order_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""
+            SELECT container_id FROM food_items WHERE food_name LIKE %s AND NOT is_ordered
+        """, (SEED_MENU_PATTERN,))
+        menu_container_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("DELETE FROM food_items WHERE container_id = ANY(%s)", (menu_container_ids,))
+        cursor.execute("DELETE FROM containers WHERE container_id = ANY(%s)", (menu_container_ids,))
+        cursor.execute("""
+            DELETE FROM order_items
+            WHERE container_id IN (SELECT container_id FROM order_containers WHERE order_id = ANY(%s))
+        """, (order_ids,))
+        cursor.execute("DELETE FROM order_containers WHERE order_id = ANY(%s)", (order_ids,))
+        cursor.execute("DELETE FROM orders WHERE user_id = ANY(%s)", (order_ids,))
+        cursor.execute("DELETE FROM order_ids WHERE user_id = ANY(%s)", (order_ids,))
+        cursor.execute("DELETE FROM report_queue WHERE order_id = ANY(%s)", (order_ids,))
+        # Idempotency keys are scoped to the user id that sent them
+        cursor.execute("""
+            DELETE FROM idempotency_keys
+            WHERE scope IN (SELECT id::text FROM users WHERE username LIKE %s)
+        """, ('loadtest\\_%',))
+        cursor.execute("DELETE FROM users WHERE username LIKE %s", ('loadtest\\_%',))
+        cursor.execute(BUMP_MENU_VERSION_SQL)
+    conn.commit()
+
+
+class Client:
+    def __init__(self, base_url, timeout=30.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, method, path, body=None, token=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        if token:
+            req.add_header('Authorization', f'Bearer {token}')
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            return 0, b''
+
+
+def ensure_users(client):
+    """Sign up (or log in) the load-test users and return their tokens."""
+    tokens = []
+    for i in range(LOAD_USER_COUNT):
+        credentials = {
+            'username': f'loadtest_{i}',
+            'password': LOAD_PASSWORD,
+            'email': f'loadtest_{i}@example.com'
+        }
+        status, body = client.request('POST', '/auth/signup', credentials)
+        if status != 201:
+            status, body = client.request('POST', '/auth/login', credentials)
+        if status not in (200, 201):
+            raise SystemExit(f"Could not authenticate load-test user: {status} {body[:200]!r}")
+        tokens.append(json.loads(body)['token'])
+    return tokens
+
+
+def generate_mix(count, mix, max_containers, max_items, rng):
+    ops = list(mix)
+    weights = [mix[op] for op in ops]
+    trace = []
+    for _ in range(count):
+        op = rng.choices(ops, weights)[0]
+        if op == 'menu':
+            trace.append({'op': op, 'method': 'GET', 'path': '/api/menu-items', 'body': None})
+        elif op == 'cards':
+            trace.append({'op': op, 'method': 'GET', 'path': '/cards', 'body': None})
+        elif op == 'login':
+            trace.append({'op': op, 'method': 'POST', 'path': '/auth/login', 'body': {
+                'username': f'loadtest_{rng.randrange(LOAD_USER_COUNT)}',
+                'password': LOAD_PASSWORD
+            }})
+        else:
+            containers = rng.randint(1, max_containers)
+            trace.append({'op': op, 'method': 'POST', 'path': '/api/submit-order', 'body': {
+                'order_type': rng.choice(['customer_online', 'walk_in']),
+                'location': 'loadtest',
+                'payment': 'pending',
+                'containers': [
+                    {
+                        'container_number': n + 1,
+                        'packaging_type': rng.choice(PACKAGING),
+                        'message': '',
+                        'FoodItems': [
+                            {'food_name': f'load item {rng.randrange(50)}', 'Price': 3.0}
+                            for _ in range(rng.randint(1, max_items))
+                        ]
+                    }
+                    for n in range(containers)
+                ]
+            }})
+    return trace
+
+
+def execute(client, trace, concurrency, tokens):
+    work = queue.Queue()
+    for index, entry in enumerate(trace):
+        work.put((index, entry))
+    results = []
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        token = tokens[worker_id % len(tokens)] if tokens else None
+        local = []
+        while True:
+            try:
+                _, entry = work.get_nowait()
+            except queue.Empty:
+                break
+            start = time.perf_counter()
+            status, _ = client.request(entry['method'], entry['path'], entry.get('body'), token)
+            local.append((entry['op'], status, (time.perf_counter() - start) * 1000))
+        with lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed, meta):
+    """Throughput and latency percentiles per op.
+
+    429s are counted as ``throttled`` and left out of the percentiles:
+    they time the rate limiter, not the endpoint.
+    """
+    endpoints = {}
+    for op, status, ms in results:
+        entry = endpoints.setdefault(op, {'latencies': [], 'statuses': {}})
+        if status != 429:
+            entry['latencies'].append(ms)
+        entry['statuses'][str(status)] = entry['statuses'].get(str(status), 0) + 1
+    report = {
+        'meta': meta,
+        'requests': len(results),
+        'seconds': elapsed,
+        'throughput_rps': len(results) / elapsed if elapsed else 0.0,
+        'throttled': sum(1 for _, status, _ in results if status == 429),
+        'endpoints': {}
+    }
+    for op, entry in sorted(endpoints.items()):
+        latencies = entry['latencies']
+        report['endpoints'][op] = {
+            'count': len(latencies),
+            'throttled': entry['statuses'].get('429', 0),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': max(latencies),
+            'statuses': entry['statuses']
+        }
+    return report
+
+
+def print_report(report):
+    print(f"{report['requests']} requests in {report['seconds']:.2f}s "
+          f"= {report['throughput_rps']:.1f} req/s")
+    print(f"{'endpoint':>14} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  statuses")
+    for op, stats in report['endpoints'].items():
+        statuses = ' '.join(f"{code}:{n}" for code, n in sorted(stats['statuses'].items()))
+        print(f"{op:>14} {stats['count']:>7} {stats['p50_ms']:>9.2f} "
+              f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}  {statuses}")
+    if report.get('throttled'):
+        print(f"WARNING: {report['throttled']} requests were throttled (429) and are not in the "
+              f"percentiles; raise POS_LOGIN_MAX_PER_IP and POS_LOGIN_MAX_PER_USERNAME on the server")
+
+
+def load_trace(path):
+    with open(path) as trace_file:
+        return [json.loads(line) for line in trace_file if line.strip()]
+
+
+def run(args):
+    throwaway = None
+    server = None
+    try:
+        connect_kwargs = dict(DB_CONFIG)
+        if args.throwaway:
+            throwaway = ThrowawayPostgres(DB_CONFIG)
+            throwaway.start()
+            connect_kwargs['port'] = throwaway.port
+            here = os.path.dirname(os.path.abspath(__file__))
+            subprocess.run([sys.executable, 'main.py', 'migrate'], cwd=here,
+                           env=throwaway.env, check=True)
+            port = free_port()
+            server = start_app_server(port, throwaway.env)
+            base_url = f'http://127.0.0.1:{port}'
+        else:
+            base_url = args.url
+
+        conn = psycopg2.connect(**connect_kwargs)
+        try:
+            if not args.no_seed:
+                unseed(conn)
+                seed(conn, args.menu_items, args.backlog)
+
+            client = Client(base_url)
+            tokens = ensure_users(client)
+
+            if args.replay:
+                trace = load_trace(args.replay)
+            else:
+                rng = random.Random(args.seed)
+                trace = generate_mix(args.requests, DEFAULT_MIX, args.max_containers,
+                                     args.max_items, rng)
+            if args.record:
+                with open(args.record, 'w') as trace_file:
+                    for entry in trace:
+                        trace_file.write(json.dumps(entry) + '\n')
+
+            results, elapsed = execute(client, trace, args.concurrency, tokens)
+            report = summarize(results, elapsed, {
+                'url': base_url,
+                'concurrency': args.concurrency,
+                'replay': args.replay,
+                'seed': args.seed,
+                'menu_items': args.menu_items,
+                'backlog': args.backlog,
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+            })
+            print_report(report)
+            if args.output:
+                with open(args.output, 'w') as output:
+                    json.dump(report, output, indent=2)
+
+            if not args.no_seed and not args.keep:
+                unseed(conn)
+        finally:
+            conn.close()
+        if report['throttled']:
+            raise SystemExit("Run was throttled; its login numbers don't measure the KDF path")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if throwaway is not None:
+            throwaway.stop()
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    def delta(before, after):
+        if not before:
+            return '    n/a'
+        return f"{(after - before) / before * 100:+6.1f}%"
+
+    print(f"throughput: {baseline['throughput_rps']:.1f} -> {candidate['throughput_rps']:.1f} req/s "
+          f"({delta(baseline['throughput_rps'], candidate['throughput_rps'])})")
+    print(f"{'endpoint':>14} {'metric':>7} {'baseline':>10} {'candidate':>10} {'change':>8}")
+    for op in sorted(set(baseline['endpoints']) | set(candidate['endpoints'])):
+        before = baseline['endpoints'].get(op)
+        after = candidate['endpoints'].get(op)
+        if before is None or after is None:
+            print(f"{op:>14} only in {'candidate' if before is None else 'baseline'}")
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            print(f"{op:>14} {metric[:3]:>7} {before[metric]:>10.2f} {after[metric]:>10.2f} "
+                  f"{delta(before[metric], after[metric]):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run a generated or replayed request mix')
+    target = run_parser.add_mutually_exclusive_group()
+    target.add_argument('--url', default='http://127.0.0.1:5000', help='running app server')
+    target.add_argument('--throwaway', action='store_true',
+                        help='start a temporary Postgres and app server for this run')
+    run_parser.add_argument('--requests', type=int, default=2000)
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--seed', type=int, default=1, help='random seed for the generated mix')
+    run_parser.add_argument('--max-containers', type=int, default=6)
+    run_parser.add_argument('--max-items', type=int, default=4)
+    run_parser.add_argument('--menu-items', type=int, default=200)
+    run_parser.add_argument('--backlog', type=int, default=500, help='pending orders to seed')
+    run_parser.add_argument('--no-seed', action='store_true', help='use the database as is')
+    run_parser.add_argument('--keep', action='store_true', help='leave seeded rows in place')
+    run_parser.add_argument('--replay', help='replay a recorded JSONL trace')
+    run_parser.add_argument('--record', help='write the request mix to a JSONL trace')
+    run_parser.add_argument('--output', help='write the report as JSON')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser('compare', help='compare two saved reports')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
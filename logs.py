@@ -0,0 +1,85 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+LOG_LEVEL = "INFO"
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; pass structured fields as extra={'fields': {...}}."""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=LOG_LEVEL):
+    """Route the 'pos' loggers through a queue so request threads never block on stdout.
+
+    The listener thread starts with the first record each process logs, so
+    a pre-fork server's master doesn't fork while holding one.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, handler)
+    atexit.register(_stop_listener)
+    if hasattr(os, 'register_at_fork'):
+        # Drain and stop the thread around fork; each process restarts its own
+        os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent,
+                            after_in_child=_after_fork_in_child)
+
+    root = logging.getLogger('pos')
+    root.setLevel(level)
+    root.addHandler(_LazyQueueHandler(log_queue))
+    root.propagate = False
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    def emit(self, record):
+        if _listener._thread is None:
+            with _listener_lock:
+                if _listener._thread is None:
+                    _listener.start()
+        super().emit(record)
+
+
+def _stop_listener():
+    if _listener._thread is not None:
+        _listener.stop()
+
+
+def _before_fork():
+    _listener_lock.acquire()
+    _stop_listener()
+
+
+def _after_fork_in_parent():
+    _listener_lock.release()
+
+
+def _after_fork_in_child():
+    global _listener_lock
+    _listener_lock = threading.Lock()
+
+
+def get_logger(name):
+    return logging.getLogger(f'pos.{name}')
@@ -1,4 +1,211 @@
-from database import Base, engine
-from models import Order, Container, FoodItem, User
+import argparse
+import sys
+import psycopg2
+from psycopg2.extras import execute_values
+from config import DB_CONFIG
+from idempotency import IdempotencyStore, purge_expired
+from migrations import MIGRATIONS, migrate, pending_migrations
+from partitions import (
+    PARTITIONS_AHEAD, ORDER_RETENTION_DAYS, ensure_partitions, maintain_partitions, partition_days
+)
+import reports
+from queries import (
+    MENU_ITEMS_SQL, MENU_VERSION_SQL, BUMP_MENU_VERSION_SQL,
+    INSERT_MENU_CONTAINER_SQL, INSERT_MENU_ITEM_SQL, MENU_ITEM_CONTAINER_SQL,
+    DELETE_FOOD_ITEM_SQL, DELETE_CONTAINER_SQL, INSERT_ORDERS_SQL,
+    LOCK_IDEMPOTENCY_KEYS_SQL, TRY_LOCK_IDEMPOTENCY_KEYS_SQL, WAIT_IDEMPOTENCY_KEY_SQL,
+    CLAIM_IDEMPOTENCY_KEYS_SQL, CLAIM_IDEMPOTENCY_KEYS_TEMPLATE, IDEMPOTENCY_KEY_SQL,
+    CLAIM_ORDER_IDS_SQL, CLAIM_ORDER_IDS_TEMPLATE,
+    INSERT_ORDER_CONTAINERS_SQL, INSERT_ORDER_ITEMS_SQL, USER_BY_USERNAME_SQL,
+    USERNAME_EXISTS_SQL, INSERT_USER_SQL, UPDATE_ORDER_STATUS_SQL, pending_orders_query
+)
+from datetime import datetime, timedelta, timezone
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+
+def run_migrate(conn, args):
+    applied = migrate(conn, target=args.target)
+    if applied:
+        print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        print("Schema is up to date")
+    if not pending_migrations(conn):
+        created = ensure_partitions(conn)
+        if created:
+            print(f"Created order partitions for: {', '.join(d.isoformat() for d in created)}")
+
+
+def run_status(conn, args):
+    pending = {m[0] for m in pending_migrations(conn)}
+    for version, description, _ in MIGRATIONS:
+        state = "pending" if version in pending else "applied"
+        print(f"{version:>4}  {state:<8} {description}")
+
+
+def run_explain(conn, args):
+    """Print EXPLAIN ANALYZE for every query app.py runs.
+
+    Write statements execute against sample rows inside one transaction that
+    is rolled back at the end, so the database is left untouched.
+    """
+    cursor = conn.cursor()
+
+    def explain(name, sql, params=None, rows=None, template=None):
+        cursor.execute("SAVEPOINT explain")
+        if rows is not None:
+            plan = execute_values(cursor, "EXPLAIN ANALYZE " + sql, rows,
+                                  template=template, fetch=True)
+        else:
+            cursor.execute("EXPLAIN ANALYZE " + sql, params)
+            plan = cursor.fetchall()
+        cursor.execute("ROLLBACK TO SAVEPOINT explain")
+        print(f"== {name} ==")
+        for (line,) in plan:
+            print(line)
+        print()
+
+    try:
+        explain("menu items", MENU_ITEMS_SQL)
+        explain("menu version", MENU_VERSION_SQL)
+        explain("bump menu version", BUMP_MENU_VERSION_SQL)
+        since = datetime.now(timezone.utc) - timedelta(days=2)
+        explain("cards", *pending_orders_query(since=since))
+        explain("orders (customer_online, first page)",
+                *pending_orders_query(order_type='customer_online', limit=50, since=since))
+        day = {'unit': 'hour', 'start': since, 'end': since + timedelta(days=1), 'limit': 10}
+        explain("revenue report", reports.REVENUE_REPORT_SQL, day)
+        explain("orders report", reports.ORDERS_REPORT_SQL, day)
+        explain("items report", reports.ITEMS_REPORT_SQL, day)
+        explain("roll up queued orders", reports.ROLLUP_SQL)
+        explain("user by username", USER_BY_USERNAME_SQL, ('explain_user',))
+        explain("username exists", USERNAME_EXISTS_SQL, ('explain_user',))
+        explain("insert user", INSERT_USER_SQL,
+                ('explain_user', 'explain@example.com', 'x'))
+
+        # Submit-order path as write_orders() runs it: key locks and claims,
+        # the order id claim, then real parent rows for the child inserts
+        keys = [('explain', 'explain-key')]
+        explain("lock idempotency keys", LOCK_IDEMPOTENCY_KEYS_SQL, rows=keys)
+        explain("try-lock idempotency keys", TRY_LOCK_IDEMPOTENCY_KEYS_SQL, rows=keys)
+        explain("wait for idempotency key", WAIT_IDEMPOTENCY_KEY_SQL, keys[0])
+        claim = IdempotencyStore().claim(*keys[0], '0' * 64, 201, {})
+        explain("claim idempotency keys", CLAIM_IDEMPOTENCY_KEYS_SQL, rows=[claim],
+                template=CLAIM_IDEMPOTENCY_KEYS_TEMPLATE)
+        explain("stored idempotency key", IDEMPOTENCY_KEY_SQL, keys[0])
+        explain("claim order ids", CLAIM_ORDER_IDS_SQL, rows=[('EXPLAIN_ORDER',)],
+                template=CLAIM_ORDER_IDS_TEMPLATE)
+        orders = [('EXPLAIN_ORDER', 'customer_online', 'explain', 'pending', 'pending')]
+        explain("insert orders", INSERT_ORDERS_SQL, rows=orders)
+        execute_values(cursor, INSERT_ORDERS_SQL, orders)
+        order_containers = [('EXPLAIN_ORDER', 1, 'box', '')]
+        explain("insert order containers", INSERT_ORDER_CONTAINERS_SQL, rows=order_containers)
+        container_id = execute_values(cursor, INSERT_ORDER_CONTAINERS_SQL,
+                                      order_containers, fetch=True)[0][0]
+        explain("insert order items", INSERT_ORDER_ITEMS_SQL,
+                rows=[(container_id, 'explain item', 1)])
+        explain("update order status", UPDATE_ORDER_STATUS_SQL,
+                ('paid', 'card', 'EXPLAIN_ORDER', 'pending'))
+
+        # Menu administration path
+        explain("insert menu container", INSERT_MENU_CONTAINER_SQL, ('box',))
+        cursor.execute(INSERT_MENU_CONTAINER_SQL, ('box',))
+        menu_container_id = cursor.fetchone()[0]
+        menu_item = (menu_container_id, 'explain item', 1, False, '')
+        explain("insert menu item", INSERT_MENU_ITEM_SQL, menu_item)
+        cursor.execute(INSERT_MENU_ITEM_SQL, menu_item)
+        item_id = cursor.fetchone()[0]
+        explain("menu item container", MENU_ITEM_CONTAINER_SQL, (item_id,))
+        explain("delete food item", DELETE_FOOD_ITEM_SQL, (item_id,))
+        cursor.execute(DELETE_FOOD_ITEM_SQL, (item_id,))
+        explain("delete container", DELETE_CONTAINER_SQL, (menu_container_id,))
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def run_maintain_partitions(conn, args):
+    print(f"Purged {purge_expired(conn)} expired idempotency keys")
+    result = maintain_partitions(conn, days_ahead=args.days_ahead,
+                                 retention_days=args.retention_days, drop=args.drop)
+    if result is None:
+        print("Partition maintenance is already running elsewhere")
+        return
+    created, archived, skipped = result
+    for label, days in (("Created", created), ("Archived", archived), ("Kept (pending orders)", skipped)):
+        if days:
+            print(f"{label}: {', '.join(d.isoformat() for d in days)}")
+    attached = partition_days(conn)
+    if attached:
+        print(f"Attached days: {attached[0].isoformat()} .. {attached[-1].isoformat()} ({len(attached)})")
+
+
+def run_refresh_reports(conn, args):
+    result = reports.refresh_reports(conn)
+    if result is None:
+        print("A refresh is already running")
+        return
+    orders, through = result
+    print(f"Rolled up {orders} orders committed before {through.isoformat()}")
+
+
+def run_reconcile_reports(conn, args):
+    """Exit non-zero if the rollups differ from a recomputation over attached partitions."""
+    days = partition_days(conn)
+    start = days[0] if days else None
+    with conn.cursor() as cursor:
+        through, mismatches = reports.reconcile(cursor, start)
+    conn.rollback()
+    if through is None:
+        print("Reports have not been refreshed yet")
+        return
+    print(f"Checked {start.isoformat() if start else 'all orders'} on, "
+          f"last refreshed {through.isoformat()}")
+    for table, row in mismatches:
+        print(f"MISMATCH {table}: {row}")
+    if mismatches:
+        sys.exit(1)
+    print("Rollups match the order tables")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POS database management")
+    subparsers = parser.add_subparsers(dest='command')
+
+    upgrade = subparsers.add_parser('migrate', help='apply pending schema migrations (default)')
+    upgrade.add_argument('--target', type=int, help='stop after this migration version')
+    upgrade.set_defaults(func=run_migrate)
+
+    status = subparsers.add_parser('status', help='list migrations and whether they are applied')
+    status.set_defaults(func=run_status)
+
+    explain = subparsers.add_parser('explain', help='print EXPLAIN ANALYZE for the queries in app.py')
+    explain.set_defaults(func=run_explain)
+
+    partitions = subparsers.add_parser('maintain-partitions',
+                                       help='create upcoming order partitions, archive old ones '
+                                            'and purge expired idempotency keys')
+    partitions.add_argument('--days-ahead', type=int, default=PARTITIONS_AHEAD)
+    partitions.add_argument('--retention-days', type=int, default=ORDER_RETENTION_DAYS)
+    partitions.add_argument('--drop', action='store_true',
+                            help='drop old partitions instead of moving them to the archive schema')
+    partitions.set_defaults(func=run_maintain_partitions)
+
+    refresh = subparsers.add_parser('refresh-reports', help='roll new orders into the reporting tables')
+    refresh.set_defaults(func=run_refresh_reports)
+
+    reconcile = subparsers.add_parser('reconcile-reports',
+                                      help='check the reporting rollups against the order tables')
+    reconcile.set_defaults(func=run_reconcile_reports)
+
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(['migrate'])
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        args.func(conn, args)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
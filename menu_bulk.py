@@ -0,0 +1,317 @@
+"""Bulk menu changes uploaded as CSV or NDJSON.
+
+Rows are validated in Python, COPYed into a temporary staging table and
+applied with a fixed number of set-based statements in one transaction, so
+replacing a whole menu costs about a dozen round trips however many items it
+has. Each row either upserts or deletes one menu item:
+
+* ``action`` -- ``upsert`` (the default) or ``delete``
+* ``item_id`` -- the item to change; without it the row matches the single
+  menu item with the same ``food_name``, or adds a new one if there is none
+* ``food_name``, ``price``, ``packaging_type``, ``image_url`` -- new values;
+  blank fields are left unchanged on update. New items need ``food_name``,
+  ``price`` and ``packaging_type``.
+
+Like the single-item endpoints, every menu item has a container of its own.
+"""
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from menu_cache import bump_menu_version
+
+BULK_ACTIONS = ('upsert', 'delete')
+BULK_FIELDS = ('action', 'item_id', 'food_name', 'price', 'packaging_type', 'image_url')
+BULK_MAX_ROWS = 10000
+# Column widths from the containers and food_items tables
+FIELD_LIMITS = {'food_name': 200, 'packaging_type': 50, 'image_url': 500}
+MAX_PRICE = Decimal('99999999.99')  # NUMERIC(10, 2)
+
+CSV_TYPES = ('text/csv',)
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonlines')
+
+CREATE_STAGE_SQL = """
+    CREATE TEMPORARY TABLE menu_bulk_stage (
+        row_number INTEGER PRIMARY KEY,
+        action TEXT NOT NULL,
+        item_id INTEGER,
+        food_name TEXT,
+        price NUMERIC(10, 2),
+        packaging_type TEXT,
+        image_url TEXT,
+        target_item_id INTEGER,
+        target_container_id INTEGER,
+        name_matches INTEGER
+    ) ON COMMIT DROP
+"""
+
+COPY_STAGE_SQL = f"""
+    COPY menu_bulk_stage (row_number, {', '.join(BULK_FIELDS)})
+    FROM STDIN WITH (FORMAT csv)
+"""
+
+MATCH_BY_ID_SQL = """
+    UPDATE menu_bulk_stage s
+    SET target_item_id = f.item_id, target_container_id = f.container_id
+    FROM food_items f
+    WHERE s.item_id IS NOT NULL AND f.item_id = s.item_id AND f.is_ordered = FALSE
+"""
+
+MATCH_BY_NAME_SQL = """
+    UPDATE menu_bulk_stage s
+    SET target_item_id = m.item_id, target_container_id = m.container_id,
+        name_matches = m.matches
+    FROM (
+        SELECT DISTINCT ON (food_name) food_name, item_id, container_id,
+               count(*) OVER (PARTITION BY food_name) AS matches
+        FROM food_items
+        WHERE is_ordered = FALSE
+        ORDER BY food_name, item_id
+    ) m
+    WHERE s.item_id IS NULL AND s.food_name = m.food_name
+"""
+
+STAGE_ERRORS_SQL = """
+    SELECT row_number,
+           CASE
+               WHEN item_id IS NOT NULL AND target_item_id IS NULL
+                   THEN 'no menu item with item_id ' || item_id
+               WHEN name_matches > 1
+                   THEN 'food_name matches ' || name_matches || ' menu items; give item_id'
+               WHEN action = 'delete' AND target_item_id IS NULL
+                   THEN 'no menu item named ' || food_name
+               WHEN target_item_id IS NULL AND (price IS NULL OR packaging_type IS NULL)
+                   THEN 'new menu items need price and packaging_type'
+               ELSE 'menu item appears in more than one row'
+           END
+    FROM (
+        SELECT s.*,
+               count(*) OVER (
+                   PARTITION BY COALESCE(target_item_id::text, 'new:' || food_name)
+               ) AS copies
+        FROM menu_bulk_stage s
+    ) s
+    WHERE (item_id IS NOT NULL AND target_item_id IS NULL)
+       OR name_matches > 1
+       OR (action = 'delete' AND target_item_id IS NULL)
+       OR (target_item_id IS NULL AND (price IS NULL OR packaging_type IS NULL))
+       OR copies > 1
+    ORDER BY row_number
+"""
+
+DISCARD_ROWS_SQL = "DELETE FROM menu_bulk_stage WHERE row_number = ANY(%s)"
+
+DELETE_ITEMS_SQL = """
+    WITH deleted AS (
+        DELETE FROM food_items f
+        USING menu_bulk_stage s
+        WHERE s.action = 'delete' AND f.item_id = s.target_item_id
+        RETURNING f.container_id
+    ), containers_deleted AS (
+        DELETE FROM containers c
+        USING deleted d
+        WHERE c.container_id = d.container_id
+    )
+    SELECT count(*) FROM deleted
+"""
+
+UPDATE_ITEMS_SQL = """
+    UPDATE food_items f
+    SET food_name = COALESCE(s.food_name, f.food_name),
+        price = COALESCE(s.price, f.price),
+        image_url = COALESCE(s.image_url, f.image_url)
+    FROM menu_bulk_stage s
+    WHERE s.action = 'upsert' AND f.item_id = s.target_item_id
+"""
+
+UPDATE_CONTAINERS_SQL = """
+    UPDATE containers c
+    SET packaging_type = s.packaging_type
+    FROM menu_bulk_stage s
+    WHERE s.action = 'upsert' AND c.container_id = s.target_container_id
+      AND s.packaging_type IS NOT NULL
+"""
+
+# INSERT ... SELECT can't return the staging row a new container came from,
+# so new rows draw their container ids from the sequence up front.
+ALLOCATE_CONTAINERS_SQL = """
+    UPDATE menu_bulk_stage
+    SET target_container_id = nextval(pg_get_serial_sequence('containers', 'container_id'))
+    WHERE action = 'upsert' AND target_item_id IS NULL
+"""
+
+INSERT_CONTAINERS_SQL = """
+    INSERT INTO containers (container_id, packaging_type)
+    SELECT target_container_id, packaging_type
+    FROM menu_bulk_stage
+    WHERE action = 'upsert' AND target_item_id IS NULL
+"""
+
+INSERT_ITEMS_SQL = """
+    INSERT INTO food_items (container_id, food_name, price, is_ordered, image_url)
+    SELECT target_container_id, food_name, price, FALSE, COALESCE(image_url, '')
+    FROM menu_bulk_stage
+    WHERE action = 'upsert' AND target_item_id IS NULL
+    ORDER BY row_number
+"""
+
+
+class InvalidUpload(ValueError):
+    """The upload as a whole can't be read; nothing was applied."""
+
+
+def parse_upload(body, content_type):
+    """Split an upload into ``(row_number, fields)`` pairs.
+
+    CSV rows are numbered from 1 after the header, NDJSON rows by line. A line
+    that isn't a JSON object comes back as a string, the reason it was
+    rejected, so it is reported with the other row errors.
+    """
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    try:
+        text = body.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise InvalidUpload("Upload must be UTF-8")
+
+    if mimetype in CSV_TYPES:
+        reader = csv.DictReader(io.StringIO(text, newline=''))
+        if not reader.fieldnames or not {'item_id', 'food_name'} & set(reader.fieldnames):
+            raise InvalidUpload("CSV header must name an item_id or food_name column")
+        try:
+            rows = [(number, row) for number, row in enumerate(reader, 1)]
+        except csv.Error as e:
+            raise InvalidUpload(f"Malformed CSV: {e}")
+    elif mimetype in NDJSON_TYPES:
+        rows = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    row = "each line must be a JSON object"
+            except ValueError:
+                row = "invalid JSON"
+            rows.append((number, row))
+    else:
+        raise InvalidUpload("Upload must be text/csv or application/x-ndjson")
+
+    if not rows:
+        raise InvalidUpload("Upload has no rows")
+    if len(rows) > BULK_MAX_ROWS:
+        raise InvalidUpload(f"Upload has more than {BULK_MAX_ROWS} rows")
+    return rows
+
+
+def _text(row, field):
+    value = row.get(field)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{field} must be a string")
+    value = value.strip()
+    if len(value) > FIELD_LIMITS[field]:
+        raise ValueError(f"{field} is longer than {FIELD_LIMITS[field]} characters")
+    return value or None
+
+
+def validate_row(row):
+    """Normalise one upload row into staging values; raises ValueError with the reason."""
+    if isinstance(row, str):
+        raise ValueError(row)
+
+    action = row.get('action') or 'upsert'
+    if isinstance(action, str):
+        action = action.strip().lower()
+    if action not in BULK_ACTIONS:
+        raise ValueError(f"action must be one of {', '.join(BULK_ACTIONS)}")
+
+    item_id = row.get('item_id')
+    if item_id in (None, ''):
+        item_id = None
+    else:
+        if isinstance(item_id, str) and item_id.strip().isdigit():
+            item_id = int(item_id)
+        if isinstance(item_id, bool) or not isinstance(item_id, int) or not 0 < item_id < 2 ** 31:
+            raise ValueError("item_id must be a positive integer")
+
+    price = row.get('price')
+    if price in (None, ''):
+        price = None
+    else:
+        try:
+            if isinstance(price, bool) or not isinstance(price, (int, float, str)):
+                raise InvalidOperation
+            price = Decimal(str(price).strip())
+            if not price.is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            raise ValueError("price must be a number")
+        if price < 0 or price > MAX_PRICE:
+            raise ValueError("Invalid price")
+        price = price.quantize(Decimal('0.01'))
+
+    food_name = _text(row, 'food_name')
+    if item_id is None and food_name is None:
+        raise ValueError("row needs an item_id or food_name")
+    return (action, item_id, food_name, price, _text(row, 'packaging_type'), _text(row, 'image_url'))
+
+
+def _copy_rows(cursor, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for number, values in rows:
+        # Unquoted empty fields load as NULL; validate_row() turned blanks into None
+        writer.writerow((number,) + values)
+    buffer.seek(0)
+    cursor.copy_expert(COPY_STAGE_SQL, buffer)
+
+
+def apply_menu_upload(conn, rows, skip_invalid=False):
+    """Validate and apply parsed upload rows in one transaction.
+
+    Invalid rows abort the whole upload unless ``skip_invalid`` is set, in
+    which case the other rows are applied. Returns a summary dict with the
+    row ``errors`` and the number of rows ``applied``; nothing is applied
+    when it has errors and ``skip_invalid`` is off. The caller commits and
+    invalidates the menu cache when anything was applied.
+    """
+    staged, errors = [], []
+    for number, row in rows:
+        try:
+            staged.append((number, validate_row(row)))
+        except ValueError as e:
+            errors.append({'row': number, 'error': str(e)})
+
+    summary = {'applied': 0, 'inserted': 0, 'updated': 0, 'deleted': 0, 'errors': errors}
+    if (errors and not skip_invalid) or not staged:
+        return summary
+
+    with conn.cursor() as cursor:
+        cursor.execute(CREATE_STAGE_SQL)
+        _copy_rows(cursor, staged)
+        cursor.execute(MATCH_BY_ID_SQL)
+        cursor.execute(MATCH_BY_NAME_SQL)
+        cursor.execute(STAGE_ERRORS_SQL)
+        rejected = cursor.fetchall()
+        if rejected:
+            errors.extend({'row': row[0], 'error': row[1]} for row in rejected)
+            errors.sort(key=lambda error: error['row'])
+            if not skip_invalid:
+                return summary
+            cursor.execute(DISCARD_ROWS_SQL, ([row[0] for row in rejected],))
+            if len(rejected) == len(staged):
+                return summary
+
+        cursor.execute(DELETE_ITEMS_SQL)
+        summary['deleted'] = cursor.fetchone()[0]
+        cursor.execute(UPDATE_ITEMS_SQL)
+        summary['updated'] = cursor.rowcount
+        cursor.execute(UPDATE_CONTAINERS_SQL)
+        cursor.execute(ALLOCATE_CONTAINERS_SQL)
+        cursor.execute(INSERT_CONTAINERS_SQL)
+        cursor.execute(INSERT_ITEMS_SQL)
+        summary['inserted'] = cursor.rowcount
+        summary['applied'] = summary['deleted'] + summary['updated'] + summary['inserted']
+        bump_menu_version(cursor)
+    return summary
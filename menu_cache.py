@@ -0,0 +1,66 @@
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from queries import MENU_VERSION_SQL, BUMP_MENU_VERSION_SQL
+
+# How long a worker trusts its snapshot before re-reading menu_version.
+MENU_VERSION_CHECK_INTERVAL = 1.0  # seconds
+
+MenuSnapshot = namedtuple("MenuSnapshot", ["version", "etag", "body"])
+
+
+def current_menu_version(cursor):
+    cursor.execute(MENU_VERSION_SQL)
+    row = cursor.fetchone()
+    if not row:
+        return 0
+    return row['version'] if isinstance(row, dict) else row[0]
+
+
+def bump_menu_version(cursor):
+    """Increment the shared menu version inside the caller's transaction."""
+    cursor.execute(BUMP_MENU_VERSION_SQL)
+
+
+class MenuCache:
+    """Pre-serialized menu snapshot shared by all threads of a worker.
+
+    ``build`` takes a cursor and returns the serialized menu as bytes. The
+    snapshot is tagged with the menu_version row, which every menu write
+    bumps in its own transaction, so other worker processes notice the
+    change on their next version check.
+    """
+
+    def __init__(self, build, check_interval=MENU_VERSION_CHECK_INTERVAL):
+        self._build = build
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, cursor):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return snapshot
+
+        # Read the version before the menu so a concurrent write can only
+        # make the snapshot look older than it is, never newer.
+        version = current_menu_version(cursor)
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                body = self._build(cursor)
+                digest = hashlib.sha256(body).hexdigest()[:32]
+                snapshot = MenuSnapshot(version, f"menu-{version}-{digest}", body)
+                self._snapshot = snapshot
+            self._checked_at = time.monotonic()
+        return snapshot
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._checked_at = 0.0
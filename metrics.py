@@ -0,0 +1,223 @@
+import threading
+import time
+from collections import deque
+from flask import g, has_app_context
+from psycopg2 import extensions
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+RESERVOIR_SIZE = 1024  # recent samples per endpoint used for quantiles
+# Log requests slower than this many milliseconds with their SQL; None disables.
+SLOW_REQUEST_MS = None
+
+
+class SQLStats:
+    """Statements executed during one request."""
+
+    __slots__ = ('count', 'seconds', 'statements')
+
+    def __init__(self, keep_statements=False):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = [] if keep_statements else None
+
+
+def start_request_sql():
+    g.sql_stats = SQLStats(keep_statements=SLOW_REQUEST_MS is not None)
+    return g.sql_stats
+
+
+def record_sql(query, seconds):
+    if not has_app_context():
+        return
+    stats = g.get('sql_stats')
+    if stats is None:
+        return
+    stats.count += 1
+    stats.seconds += seconds
+    if stats.statements is not None:
+        if isinstance(query, bytes):
+            query = query.decode('utf-8', 'replace')
+        stats.statements.append((' '.join(str(query).split())[:500], seconds))
+
+
+_timed_cursor_classes = {}
+
+
+def timed_cursor_class(cursor_class):
+    """Subclass ``cursor_class`` so every execute is counted and timed."""
+    timed = _timed_cursor_classes.get(cursor_class)
+    if timed is None:
+        class TimedCursor(cursor_class):
+            def execute(self, query, vars=None):
+                start = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    record_sql(query, time.perf_counter() - start)
+
+            def executemany(self, query, vars_list):
+                start = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    record_sql(query, time.perf_counter() - start)
+
+            # Fetching from a named (server-side) cursor is a round trip too
+            def fetchone(self):
+                return self._timed_fetch(super().fetchone)
+
+            def fetchmany(self, size=None):
+                return self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+            def fetchall(self):
+                return self._timed_fetch(super().fetchall)
+
+            def _timed_fetch(self, fetch, *args):
+                if self.name is None:
+                    return fetch(*args)
+                start = time.perf_counter()
+                try:
+                    return fetch(*args)
+                finally:
+                    record_sql(f"FETCH FROM {self.name}", time.perf_counter() - start)
+
+        TimedCursor.__name__ = f"Timed{cursor_class.__name__}"
+        timed = _timed_cursor_classes.setdefault(cursor_class, TimedCursor)
+    return timed
+
+
+class InstrumentedConnection(extensions.connection):
+    """psycopg2 connection whose cursors, whatever their factory, are timed."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+        kwargs['cursor_factory'] = timed_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS, reservoir_size=RESERVOIR_SIZE):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=reservoir_size)
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantile(self, q):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.statuses = {}
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class RequestMetrics:
+    """Per-endpoint latency histograms and SQL totals, rendered as Prometheus text."""
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, method, status, seconds, sql_stats):
+        key = (endpoint, method)
+        with self._lock:
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = self._endpoints[key] = EndpointStats()
+            stats.latency.observe(seconds)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            if sql_stats is not None:
+                stats.sql_statements += sql_stats.count
+                stats.sql_seconds += sql_stats.seconds
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """Per-endpoint p50/p95/p99 in milliseconds, for ad-hoc inspection."""
+        with self._lock:
+            return {
+                f"{method} {endpoint}": {
+                    f"p{int(q * 100)}": stats.latency.quantile(q) * 1000 for q in QUANTILES
+                }
+                for (endpoint, method), stats in self._endpoints.items()
+            }
+
+    def render(self, gauges=None):
+        lines = [
+            "# HELP pos_request_duration_seconds Request latency by endpoint.",
+            "# TYPE pos_request_duration_seconds histogram"
+        ]
+        with self._lock:
+            items = sorted(self._endpoints.items())
+            for (endpoint, method), stats in items:
+                labels = _labels(endpoint=endpoint, method=method)
+                cumulative = 0
+                for bound, count in zip(stats.latency.buckets, stats.latency.counts):
+                    cumulative += count
+                    lines.append(f'pos_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'pos_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.latency.count}')
+                lines.append(f'pos_request_duration_seconds_sum{{{labels}}} {stats.latency.sum}')
+                lines.append(f'pos_request_duration_seconds_count{{{labels}}} {stats.latency.count}')
+
+            lines += [
+                "# HELP pos_request_latency_seconds Recent request latency quantiles by endpoint.",
+                "# TYPE pos_request_latency_seconds gauge"
+            ]
+            for (endpoint, method), stats in items:
+                for q in QUANTILES:
+                    labels = _labels(endpoint=endpoint, method=method, quantile=q)
+                    lines.append(f'pos_request_latency_seconds{{{labels}}} {stats.latency.quantile(q)}')
+
+            lines += [
+                "# HELP pos_requests_total Requests by endpoint and status.",
+                "# TYPE pos_requests_total counter"
+            ]
+            for (endpoint, method), stats in items:
+                for status, count in sorted(stats.statuses.items()):
+                    labels = _labels(endpoint=endpoint, method=method, status=status)
+                    lines.append(f'pos_requests_total{{{labels}}} {count}')
+
+            lines += [
+                "# HELP pos_sql_statements_total SQL statements executed by endpoint.",
+                "# TYPE pos_sql_statements_total counter"
+            ]
+            for (endpoint, method), stats in items:
+                labels = _labels(endpoint=endpoint, method=method)
+                lines.append(f'pos_sql_statements_total{{{labels}}} {stats.sql_statements}')
+
+            lines += [
+                "# HELP pos_sql_seconds_total Time spent executing SQL by endpoint.",
+                "# TYPE pos_sql_seconds_total counter"
+            ]
+            for (endpoint, method), stats in items:
+                labels = _labels(endpoint=endpoint, method=method)
+                lines.append(f'pos_sql_seconds_total{{{labels}}} {stats.sql_seconds}')
+
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE pos_{name} gauge")
+            lines.append(f"pos_{name} {value}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,311 @@
+"""Versioned schema migrations.
+
+Each migration is applied once, in order, inside its own transaction and
+recorded in schema_migrations. Add new migrations to the end of MIGRATIONS;
+never edit one that has already shipped.
+"""
+
+# Arbitrary key for pg_advisory_xact_lock so concurrent deploys serialize
+MIGRATION_LOCK_ID = 7243001
+
+MIGRATIONS = [
+    (1, "baseline schema", """
+        CREATE TABLE IF NOT EXISTS orders (
+            user_id VARCHAR(50) PRIMARY KEY,
+            order_type VARCHAR(50),
+            location VARCHAR(100),
+            payment VARCHAR(20)
+        );
+        CREATE TABLE IF NOT EXISTS containers (
+            container_id SERIAL PRIMARY KEY,
+            order_id VARCHAR(50) REFERENCES orders (user_id),
+            container_number INTEGER,
+            packaging_type VARCHAR(50),
+            message VARCHAR(500)
+        );
+        CREATE TABLE IF NOT EXISTS food_items (
+            item_id SERIAL PRIMARY KEY,
+            container_id INTEGER REFERENCES containers (container_id),
+            food_name VARCHAR(200),
+            price NUMERIC(10, 2)
+        );
+        CREATE TABLE IF NOT EXISTS menu_version (
+            id INTEGER PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(80) UNIQUE NOT NULL,
+            email VARCHAR(120) UNIQUE NOT NULL,
+            password_hash VARCHAR(256)
+        );
+    """),
+    (2, "food_items menu columns", """
+        ALTER TABLE food_items ADD COLUMN IF NOT EXISTS is_ordered BOOLEAN NOT NULL DEFAULT FALSE;
+        ALTER TABLE food_items ADD COLUMN IF NOT EXISTS image_url VARCHAR(500);
+    """),
+    (3, "indexes for kitchen-board and menu queries", """
+        CREATE INDEX IF NOT EXISTS ix_containers_order_id ON containers (order_id);
+        CREATE INDEX IF NOT EXISTS ix_food_items_container_id ON food_items (container_id);
+        CREATE INDEX IF NOT EXISTS ix_orders_pending
+            ON orders (user_id) WHERE payment = 'pending';
+        CREATE INDEX IF NOT EXISTS ix_orders_pending_type_location
+            ON orders (order_type, location, user_id) WHERE payment = 'pending';
+        CREATE INDEX IF NOT EXISTS ix_food_items_menu
+            ON food_items (food_name) WHERE is_ordered = FALSE;
+    """),
+    (4, "kitchen feed notifications", """
+        CREATE OR REPLACE FUNCTION notify_kitchen_orders() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('kitchen_orders', json_build_object(
+                'order_id', NEW.user_id,
+                'payment', NEW.payment
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS orders_kitchen_notify ON orders;
+        CREATE TRIGGER orders_kitchen_notify
+            AFTER INSERT OR UPDATE OF payment ON orders
+            FOR EACH ROW EXECUTE PROCEDURE notify_kitchen_orders();
+    """),
+    (5, "partition order data by day and give orders a status lifecycle", """
+        -- Orders move to tables range-partitioned on created_at; their
+        -- containers and lines leave the menu's containers/food_items.
+        -- Partition keys must be part of every unique key, so there are no
+        -- foreign keys between the order tables; write_orders() inserts all
+        -- three in one transaction and now() stamps them identically.
+        ALTER TABLE orders RENAME TO orders_unpartitioned;
+        DROP TRIGGER IF EXISTS orders_kitchen_notify ON orders_unpartitioned;
+
+        CREATE TABLE orders (
+            user_id VARCHAR(50) NOT NULL,
+            order_type VARCHAR(50),
+            location VARCHAR(100),
+            payment VARCHAR(20),
+            status VARCHAR(20) NOT NULL DEFAULT 'pending'
+                CHECK (status IN ('pending', 'paid', 'fulfilled')),
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            status_changed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (created_at, user_id)
+        ) PARTITION BY RANGE (created_at);
+        CREATE TABLE order_containers (
+            container_id BIGSERIAL,
+            order_id VARCHAR(50) NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            container_number INTEGER,
+            packaging_type VARCHAR(50),
+            message VARCHAR(500),
+            PRIMARY KEY (created_at, container_id)
+        ) PARTITION BY RANGE (created_at);
+        CREATE TABLE order_items (
+            item_id BIGSERIAL,
+            container_id BIGINT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            food_name VARCHAR(200),
+            price NUMERIC(10, 2),
+            PRIMARY KEY (created_at, item_id)
+        ) PARTITION BY RANGE (created_at);
+
+        -- Safety net only: partitions.ensure_partitions() creates day
+        -- partitions ahead of time, and a day can't be added while the
+        -- default partition holds rows for it.
+        CREATE TABLE orders_default PARTITION OF orders DEFAULT;
+        CREATE TABLE order_containers_default PARTITION OF order_containers DEFAULT;
+        CREATE TABLE order_items_default PARTITION OF order_items DEFAULT;
+
+        CREATE OR REPLACE FUNCTION create_order_partitions(day DATE) RETURNS INTEGER AS $$
+        DECLARE
+            parent TEXT;
+            created INTEGER := 0;
+        BEGIN
+            FOREACH parent IN ARRAY ARRAY['orders', 'order_containers', 'order_items'] LOOP
+                IF to_regclass(format('%I_p%s', parent, to_char(day, 'YYYYMMDD'))) IS NULL THEN
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                        format('%s_p%s', parent, to_char(day, 'YYYYMMDD')), parent,
+                        day::timestamptz, (day + 1)::timestamptz
+                    );
+                    created := created + 1;
+                END IF;
+            END LOOP;
+            RETURN created;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        SELECT create_order_partitions(current_date);
+
+        -- Existing orders are stamped with the migration time
+        INSERT INTO orders (user_id, order_type, location, payment, status)
+        SELECT user_id, order_type, location, payment,
+               CASE WHEN payment = 'pending' THEN 'pending' ELSE 'paid' END
+        FROM orders_unpartitioned;
+        INSERT INTO order_containers (container_id, order_id, container_number, packaging_type, message)
+        SELECT container_id, order_id, container_number, packaging_type, message
+        FROM containers
+        WHERE order_id IS NOT NULL;
+        INSERT INTO order_items (item_id, container_id, food_name, price)
+        SELECT f.item_id, f.container_id, f.food_name, f.price
+        FROM food_items f
+        JOIN containers c ON c.container_id = f.container_id
+        WHERE c.order_id IS NOT NULL;
+        SELECT setval(pg_get_serial_sequence('order_containers', 'container_id'),
+                      COALESCE((SELECT max(container_id) FROM order_containers), 0) + 1, false);
+        SELECT setval(pg_get_serial_sequence('order_items', 'item_id'),
+                      COALESCE((SELECT max(item_id) FROM order_items), 0) + 1, false);
+
+        DELETE FROM food_items
+        WHERE container_id IN (SELECT container_id FROM containers WHERE order_id IS NOT NULL);
+        DELETE FROM containers WHERE order_id IS NOT NULL;
+        ALTER TABLE containers DROP COLUMN order_id;
+        ALTER TABLE containers DROP COLUMN container_number;
+        ALTER TABLE containers DROP COLUMN message;
+        DROP TABLE orders_unpartitioned;
+
+        CREATE INDEX ix_orders_user_id ON orders (user_id);
+        CREATE INDEX ix_orders_pending ON orders (user_id) WHERE status = 'pending';
+        CREATE INDEX ix_orders_pending_type_location
+            ON orders (order_type, location, user_id) WHERE status = 'pending';
+        CREATE INDEX ix_order_containers_order_id ON order_containers (order_id);
+        CREATE INDEX ix_order_items_container_id ON order_items (container_id);
+
+        CREATE SCHEMA IF NOT EXISTS archive;
+
+        CREATE OR REPLACE FUNCTION notify_kitchen_orders() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('kitchen_orders', json_build_object(
+                'order_id', NEW.user_id,
+                'status', NEW.status
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER orders_kitchen_notify
+            AFTER INSERT OR UPDATE OF status ON orders
+            FOR EACH ROW EXECUTE PROCEDURE notify_kitchen_orders();
+    """),
+    (6, "hourly sales and item rollups for reporting", """
+        CREATE TABLE sales_hourly (
+            bucket TIMESTAMPTZ NOT NULL,
+            order_type VARCHAR(50) NOT NULL,
+            location VARCHAR(100) NOT NULL,
+            orders INTEGER NOT NULL,
+            revenue NUMERIC(14, 2) NOT NULL,
+            PRIMARY KEY (bucket, order_type, location)
+        );
+        CREATE TABLE item_sales_hourly (
+            bucket TIMESTAMPTZ NOT NULL,
+            food_name VARCHAR(200) NOT NULL,
+            quantity INTEGER NOT NULL,
+            revenue NUMERIC(14, 2) NOT NULL,
+            PRIMARY KEY (bucket, food_name)
+        );
+        -- Orders created before ``through`` are already in the rollups
+        CREATE TABLE report_watermark (
+            name VARCHAR(50) PRIMARY KEY,
+            through TIMESTAMPTZ NOT NULL
+        );
+    """),
+    (7, "idempotency keys for order submission", """
+        -- One row per Idempotency-Key a user has sent, written in the same
+        -- transaction as the order it created
+        CREATE TABLE idempotency_keys (
+            scope VARCHAR(100) NOT NULL,
+            key VARCHAR(255) NOT NULL,
+            request_hash CHAR(64) NOT NULL,
+            response_status SMALLINT NOT NULL,
+            response_body JSONB NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            expires_at TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (scope, key)
+        );
+        CREATE INDEX ix_idempotency_keys_expires_at ON idempotency_keys (expires_at);
+    """),
+    (8, "globally unique order ids", """
+        -- The partitioned orders table can only enforce (created_at, user_id);
+        -- write_orders() claims each order id here in the same transaction.
+        -- Rows outlive archived partitions, so ids are never reused.
+        CREATE TABLE order_ids (
+            user_id VARCHAR(50) PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL
+        );
+        INSERT INTO order_ids (user_id, created_at)
+        SELECT user_id, min(created_at) FROM orders GROUP BY user_id;
+    """),
+    (9, "queue new orders for the report rollups", """
+        -- Written by a trigger in each order's transaction and drained by
+        -- reports.refresh_rollups(); replaces the created_at watermark,
+        -- which missed orders that committed after the watermark passed them
+        CREATE TABLE report_queue (
+            order_id VARCHAR(50) NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL
+        );
+        CREATE OR REPLACE FUNCTION queue_order_for_reports() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO report_queue (order_id, created_at) VALUES (NEW.user_id, NEW.created_at);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        CREATE TRIGGER orders_report_queue
+            AFTER INSERT ON orders
+            FOR EACH ROW EXECUTE PROCEDURE queue_order_for_reports();
+        -- Orders the watermark hasn't reached yet
+        INSERT INTO report_queue (order_id, created_at)
+        SELECT user_id, created_at FROM orders
+        WHERE created_at >= COALESCE(
+            (SELECT through FROM report_watermark WHERE name = 'sales'), '-infinity');
+    """),
+]
+
+
+def _ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR(200) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def applied_versions(conn):
+    with conn.cursor() as cursor:
+        _ensure_migrations_table(cursor)
+        cursor.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cursor.fetchall()}
+    conn.commit()
+    return versions
+
+
+def pending_migrations(conn):
+    applied = applied_versions(conn)
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations up to ``target`` and return their versions."""
+    applied = []
+    for version, description, sql in pending_migrations(conn):
+        if target is not None and version > target:
+            break
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+                # Another process may have applied it while we waited
+                cursor.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+                if cursor.fetchone():
+                    conn.rollback()
+                    continue
+                cursor.execute(sql)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
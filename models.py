@@ -1,4 +1,8 @@
-from sqlalchemy import Column, String, Integer, Numeric, ForeignKey
+from sqlalchemy import (
+    Column, String, CHAR, Integer, SmallInteger, BigInteger, Boolean, Numeric, DateTime,
+    ForeignKey, Index, CheckConstraint, func, text
+)
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from database import Base
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -10,31 +14,85 @@ class Order(Base):
     order_type = Column(String(50))
     location = Column(String(100))
     payment = Column(String(20))
-    
-    containers = relationship("Container", back_populates="order")
+    status = Column(String(20), nullable=False, default='pending', server_default=text("'pending'"))
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
+    status_changed_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        CheckConstraint("status IN ('pending', 'paid', 'fulfilled')"),
+        Index("ix_orders_user_id", "user_id"),
+        Index("ix_orders_pending", "user_id", postgresql_where=text("status = 'pending'")),
+        Index("ix_orders_pending_type_location", "order_type", "location", "user_id",
+              postgresql_where=text("status = 'pending'")),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+# Order containers and items are partitioned alongside orders, so they have
+# no foreign keys; they share the order's created_at.
+class OrderContainer(Base):
+    __tablename__ = "order_containers"
+
+    container_id = Column(BigInteger, primary_key=True)
+    order_id = Column(String(50), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
+    container_number = Column(Integer)
+    packaging_type = Column(String(50))
+    message = Column(String(500))
+
+    __table_args__ = (
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+class OrderItem(Base):
+    __tablename__ = "order_items"
+
+    item_id = Column(BigInteger, primary_key=True)
+    container_id = Column(BigInteger, nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
+    food_name = Column(String(200))
+    price = Column(Numeric(10, 2))
+
+    __table_args__ = (
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+# Every order id ever used, so ids stay unique across day partitions
+class OrderId(Base):
+    __tablename__ = "order_ids"
+
+    user_id = Column(String(50), primary_key=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
 
 class Container(Base):
     __tablename__ = "containers"
 
     container_id = Column(Integer, primary_key=True)
-    order_id = Column(String(50), ForeignKey("orders.user_id"))
-    container_number = Column(Integer)
     packaging_type = Column(String(50))
-    message = Column(String(500))
     
-    order = relationship("Order", back_populates="containers")
     food_items = relationship("FoodItem", back_populates="container")
 
 class FoodItem(Base):
     __tablename__ = "food_items"
 
     item_id = Column(Integer, primary_key=True)
-    container_id = Column(Integer, ForeignKey("containers.container_id"))
+    container_id = Column(Integer, ForeignKey("containers.container_id"), index=True)
     food_name = Column(String(200))
     price = Column(Numeric(10, 2))
+    is_ordered = Column(Boolean, nullable=False, default=False, server_default=text("FALSE"))
+    image_url = Column(String(500))
     
     container = relationship("Container", back_populates="food_items")
 
+    __table_args__ = (
+        Index("ix_food_items_menu", "food_name", postgresql_where=text("is_ordered = FALSE")),
+    )
+
+class MenuVersion(Base):
+    __tablename__ = "menu_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -47,4 +105,47 @@ class User(Base):
         self.password_hash = generate_password_hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
\ No newline at end of file
+        return check_password_hash(self.password_hash, password)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    scope = Column(String(100), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(CHAR(64), nullable=False)
+    response_status = Column(SmallInteger, nullable=False)
+    response_body = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+# Hourly rollups maintained by reports.refresh_rollups()
+class SalesHourly(Base):
+    __tablename__ = "sales_hourly"
+
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    order_type = Column(String(50), primary_key=True)
+    location = Column(String(100), primary_key=True)
+    orders = Column(Integer, nullable=False)
+    revenue = Column(Numeric(14, 2), nullable=False)
+
+class ItemSalesHourly(Base):
+    __tablename__ = "item_sales_hourly"
+
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    food_name = Column(String(200), primary_key=True)
+    quantity = Column(Integer, nullable=False)
+    revenue = Column(Numeric(14, 2), nullable=False)
+
+class ReportWatermark(Base):
+    __tablename__ = "report_watermark"
+
+    name = Column(String(50), primary_key=True)
+    through = Column(DateTime(timezone=True), nullable=False)
+
+# Filled by the orders_report_queue trigger and drained by the rollup. The
+# table has no primary key; the mapper needs one, so it uses both columns.
+class ReportQueue(Base):
+    __tablename__ = "report_queue"
+
+    order_id = Column(String(50), primary_key=True)
+    created_at = Column(DateTime(timezone=True), primary_key=True)
@@ -0,0 +1,207 @@
+import queue
+import threading
+import time
+from logs import get_logger
+from orders import DuplicateOrderId, IdempotencyKeyTaken, write_orders
+
+logger = get_logger('order_queue')
+
+GROUP_COMMIT_MAX_BATCH = 64  # orders per transaction
+GROUP_COMMIT_MAX_WAIT = 0.005  # seconds to wait for a batch to fill
+GROUP_COMMIT_QUEUE_SIZE = 1024
+GROUP_COMMIT_ENQUEUE_TIMEOUT = 1.0  # seconds a caller waits for queue space
+GROUP_COMMIT_RESULT_TIMEOUT = 30.0  # seconds a caller waits for its commit
+
+
+class QueueFull(Exception):
+    """Raised when the ingestion queue stays full past the enqueue timeout."""
+
+
+class OrderNotWritten(TimeoutError):
+    """The order waited too long in the queue and was withdrawn unwritten."""
+
+
+# _PendingOrder states; a queued order either gets written or, when its
+# caller gives up first, abandoned, never both
+QUEUED, WRITING, ABANDONED = 'queued', 'writing', 'abandoned'
+
+
+class _PendingOrder:
+    __slots__ = ('order_id', 'prepared', 'done', 'error', 'state')
+
+    def __init__(self, order_id, prepared):
+        self.order_id = order_id
+        self.prepared = prepared
+        self.done = threading.Event()
+        self.error = None
+        self.state = QUEUED
+
+
+class OrderBatchWriter:
+    """Group-commit writer for submitted orders.
+
+    Callers enqueue a prepared order and block until it is durably
+    committed. One background thread drains the queue and writes up to
+    ``max_batch`` orders, or whatever arrived within ``max_wait`` seconds,
+    in a single transaction, so many orders share one commit fsync. If a
+    batch fails, its orders are retried one per transaction so that one
+    bad order cannot fail the others.
+    """
+
+    def __init__(self, pool, max_batch=GROUP_COMMIT_MAX_BATCH, max_wait=GROUP_COMMIT_MAX_WAIT,
+                 queue_size=GROUP_COMMIT_QUEUE_SIZE, enqueue_timeout=GROUP_COMMIT_ENQUEUE_TIMEOUT,
+                 result_timeout=GROUP_COMMIT_RESULT_TIMEOUT):
+        self._pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.enqueue_timeout = enqueue_timeout
+        self.result_timeout = result_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self.batches = 0
+        self.orders = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="order-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, order_id, prepared):
+        """Enqueue an order and wait until it is committed or has failed.
+
+        Raises OrderNotWritten if the writer hasn't picked the order up
+        within ``result_timeout``; the order is then withdrawn and will not
+        be written. Once its batch has started, this waits for the outcome.
+        """
+        self._ensure_started()
+        pending = _PendingOrder(order_id, prepared)
+        try:
+            self._queue.put(pending, timeout=self.enqueue_timeout)
+        except queue.Full:
+            raise QueueFull("Order queue is full, please retry")
+        if not pending.done.wait(self.result_timeout):
+            with self._state_lock:
+                if pending.state == QUEUED:
+                    pending.state = ABANDONED
+            if pending.state == ABANDONED:
+                raise OrderNotWritten(f"Order {order_id} was not written within "
+                                      f"{self.result_timeout:.0f}s, please retry")
+            pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return order_id
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _after_fork(self):
+        # Orders queued in the parent belong to its request threads
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _claim(self, batch):
+        """Mark the orders of ``batch`` as being written, dropping abandoned ones."""
+        with self._state_lock:
+            claimed = [pending for pending in batch if pending.state == QUEUED]
+            for pending in claimed:
+                pending.state = WRITING
+        return claimed
+
+    def _run(self):
+        while True:
+            batch = self._claim(self._next_batch())
+            if not batch:
+                continue
+            try:
+                self._write_batch(batch)
+            except Exception:
+                logger.exception("Group commit failed, retrying orders individually",
+                                 extra={'fields': {'batch_size': len(batch)}})
+                for pending in batch:
+                    if pending.error is not None:
+                        continue
+                    try:
+                        self._write([pending])
+                    except Exception as e:
+                        pending.error = e
+            for pending in batch:
+                pending.done.set()
+
+    def _write_batch(self, batch):
+        """Commit ``batch``, leaving out orders whose idempotency key or id is taken.
+
+        Keys another transaction is still writing count as taken, so one
+        contended key never stalls the rest of the batch, and so do repeats
+        of a key earlier in the batch. Those orders get IdempotencyKeyTaken
+        and their callers replay the stored response; orders whose id is
+        already used get DuplicateOrderId and their callers retry with a
+        new one.
+        """
+        keys = set()
+        order_ids = set()
+        for pending in batch:
+            if pending.order_id in order_ids:
+                pending.error = DuplicateOrderId([pending.order_id])
+            order_ids.add(pending.order_id)
+            claim = pending.prepared.get('idempotency')
+            if claim is None or pending.error is not None:
+                continue
+            if claim[:2] in keys:
+                pending.error = IdempotencyKeyTaken([claim[:2]])
+            keys.add(claim[:2])
+        while True:
+            remaining = [pending for pending in batch if pending.error is None]
+            if not remaining:
+                return
+            try:
+                self._write(remaining)
+                return
+            except IdempotencyKeyTaken as e:
+                taken = set(e.keys)
+                held = [pending for pending in remaining
+                        if pending.prepared.get('idempotency')
+                        and pending.prepared['idempotency'][:2] in taken]
+                if not held:
+                    raise
+                for pending in held:
+                    pending.error = IdempotencyKeyTaken([pending.prepared['idempotency'][:2]])
+            except DuplicateOrderId as e:
+                taken = set(e.order_ids)
+                held = [pending for pending in remaining if pending.order_id in taken]
+                if not held:
+                    raise
+                for pending in held:
+                    pending.error = DuplicateOrderId([pending.order_id])
+
+    def _write(self, batch):
+        conn = self._pool.getconn()
+        try:
+            write_orders(conn, [(pending.order_id, pending.prepared) for pending in batch],
+                         wait_for_keys=False)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.putconn(conn)
+        self.batches += 1
+        self.orders += len(batch)
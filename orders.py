@@ -0,0 +1,126 @@
+import secrets
+from psycopg2.extras import execute_values
+from queries import (
+    INSERT_ORDERS_SQL, INSERT_ORDER_CONTAINERS_SQL, INSERT_ORDER_ITEMS_SQL,
+    CLAIM_IDEMPOTENCY_KEYS_SQL, CLAIM_IDEMPOTENCY_KEYS_TEMPLATE,
+    LOCK_IDEMPOTENCY_KEYS_SQL, TRY_LOCK_IDEMPOTENCY_KEYS_SQL,
+    CLAIM_ORDER_IDS_SQL, CLAIM_ORDER_IDS_TEMPLATE
+)
+
+# new_order_id() has 32 random bits; a collision just means drawing again
+ORDER_ID_ATTEMPTS = 3
+
+
+class InvalidOrder(ValueError):
+    """The submitted order can't be written as given."""
+
+
+class DuplicateOrderId(Exception):
+    """Order ids already taken by earlier orders; retry with new ids."""
+
+    def __init__(self, order_ids):
+        super().__init__(f"Order id already used: {', '.join(order_ids)}")
+        self.order_ids = order_ids
+
+
+class IdempotencyKeyTaken(Exception):
+    """Another request has committed, or is writing, an order under these idempotency keys."""
+
+    def __init__(self, keys):
+        super().__init__(f"Idempotency key already used: {', '.join(key for _, key in keys)}")
+        self.keys = keys
+
+
+def new_order_id():
+    return f"CUST_{secrets.token_hex(4).upper()}"
+
+
+def prepare_order(data):
+    """Validate a submit-order payload and flatten it into insert rows.
+
+    Missing keys raise KeyError/TypeError as the request body is read, so
+    they never reach the database.
+    """
+    containers = []
+    for container in data['containers']:
+        containers.append((
+            int(container['container_number']),
+            container['packaging_type'],
+            container['message'],
+            [(item['food_name'], item['Price']) for item in container['FoodItems']]
+        ))
+    numbers = [container[0] for container in containers]
+    if len(set(numbers)) != len(numbers):
+        raise InvalidOrder("Duplicate container_number in order")
+    # Orders paid at the counter skip the pending stage
+    status = 'pending' if data['payment'] == 'pending' else 'paid'
+    return {
+        'order': (data['order_type'], data['location'], data['payment'], status),
+        'containers': containers
+    }
+
+
+def write_orders(conn, orders, wait_for_keys=True):
+    """Insert ``[(order_id, prepared_order), ...]`` with a fixed number of statements.
+
+    Runs in the caller's transaction; committing is up to the caller. All
+    rows take ``created_at`` from the transaction's now(), which keeps each
+    order in the same day partition as its containers and items.
+
+    Before any order row is written, orders carrying an ``idempotency``
+    claim (see idempotency.py) record their key, and every order id is
+    claimed in order_ids. A key already taken raises IdempotencyKeyTaken
+    and an id already taken raises DuplicateOrderId; the caller must roll
+    back. A key that another transaction is still writing is waited for,
+    or with ``wait_for_keys=False`` counts as taken, so a batch of orders
+    never queues behind one contended key.
+    """
+    with conn.cursor() as cursor:
+        claims = [prepared['idempotency'] for _, prepared in orders if prepared.get('idempotency')]
+        if claims:
+            keys = [claim[:2] for claim in claims]
+            if wait_for_keys:
+                execute_values(cursor, LOCK_IDEMPOTENCY_KEYS_SQL, keys, page_size=len(keys))
+            else:
+                busy = execute_values(cursor, TRY_LOCK_IDEMPOTENCY_KEYS_SQL, keys,
+                                      page_size=len(keys), fetch=True)
+                if busy:
+                    raise IdempotencyKeyTaken([tuple(row) for row in busy])
+            claimed = execute_values(cursor, CLAIM_IDEMPOTENCY_KEYS_SQL, claims,
+                                     template=CLAIM_IDEMPOTENCY_KEYS_TEMPLATE,
+                                     page_size=len(claims), fetch=True)
+            if len(claimed) < len(claims):
+                claimed = {tuple(row) for row in claimed}
+                raise IdempotencyKeyTaken([claim[:2] for claim in claims if claim[:2] not in claimed])
+
+        order_ids = [order_id for order_id, _ in orders]
+        claimed = execute_values(cursor, CLAIM_ORDER_IDS_SQL, [(order_id,) for order_id in order_ids],
+                                 template=CLAIM_ORDER_IDS_TEMPLATE, page_size=len(order_ids),
+                                 fetch=True)
+        if len(claimed) < len(order_ids):
+            claimed = {row[0] for row in claimed}
+            raise DuplicateOrderId([order_id for order_id in order_ids if order_id not in claimed])
+
+        execute_values(cursor, INSERT_ORDERS_SQL, [
+            (order_id, *prepared['order']) for order_id, prepared in orders
+        ], page_size=len(orders))
+
+        container_rows = [
+            (order_id, number, packaging_type, message)
+            for order_id, prepared in orders
+            for number, packaging_type, message, _ in prepared['containers']
+        ]
+        if not container_rows:
+            return
+        rows = execute_values(cursor, INSERT_ORDER_CONTAINERS_SQL, container_rows,
+                              page_size=len(container_rows), fetch=True)
+        container_ids = {(order_id, number): container_id for container_id, order_id, number in rows}
+
+        food_rows = [
+            (container_ids[(order_id, number)], food_name, price)
+            for order_id, prepared in orders
+            for number, _, _, items in prepared['containers']
+            for food_name, price in items
+        ]
+        if food_rows:
+            execute_values(cursor, INSERT_ORDER_ITEMS_SQL, food_rows, page_size=len(food_rows))
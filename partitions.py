@@ -0,0 +1,173 @@
+"""Day partitions for orders, order_containers and order_items.
+
+Migration 5 range-partitions the three order tables on created_at. Each day
+gets one partition per table, created a few days ahead; days older than the
+retention period are detached and moved to the archive schema (or dropped),
+so the live tables only hold recent orders.
+"""
+import threading
+from datetime import date, timedelta
+from idempotency import purge_expired
+from logs import get_logger
+
+logger = get_logger('partitions')
+
+ORDER_PARTITION_TABLES = ('orders', 'order_containers', 'order_items')
+PARTITIONS_AHEAD = 7  # days of partitions created in advance
+ORDER_RETENTION_DAYS = 30
+ARCHIVE_SCHEMA = 'archive'
+MAINTENANCE_INTERVAL = 3600.0  # seconds between runs of the background job
+# Arbitrary key for pg_try_advisory_lock so only one worker maintains at a time
+MAINTENANCE_LOCK_ID = 7243002
+
+
+def partition_name(table, day):
+    return f"{table}_p{day:%Y%m%d}"
+
+
+def ensure_partitions(conn, days_ahead=PARTITIONS_AHEAD):
+    """Create partitions from today through ``days_ahead``; returns days that were added."""
+    created = []
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT current_date")
+        today = cursor.fetchone()[0]
+        for offset in range(days_ahead + 1):
+            day = today + timedelta(days=offset)
+            cursor.execute("SELECT create_order_partitions(%s)", (day,))
+            if cursor.fetchone()[0]:
+                created.append(day)
+    conn.commit()
+    return created
+
+
+def partition_days(conn):
+    """Days with an attached orders partition, oldest first."""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname
+            FROM pg_inherits i
+            JOIN pg_class parent ON parent.oid = i.inhparent
+            JOIN pg_class child ON child.oid = i.inhrelid
+            WHERE parent.relname = 'orders' AND child.relname ~ '^orders_p[0-9]{8}$'
+        """)
+        names = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    return sorted(_parse_day(name[len('orders_p'):]) for name in names)
+
+
+def _parse_day(digits):
+    return date(int(digits[:4]), int(digits[4:6]), int(digits[6:]))
+
+
+def archive_partitions(conn, retention_days=ORDER_RETENTION_DAYS, drop=False):
+    """Detach day partitions older than ``retention_days``.
+
+    Detached tables move to the archive schema, or are dropped when ``drop``
+    is set. A day that still has unpaid ('pending') orders is left attached
+    so they stay reachable by the status endpoint; paid and fulfilled
+    orders are archived with their day. Each day is
+    handled in its own transaction. Returns ``(archived, skipped)`` days.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT current_date")
+        cutoff = cursor.fetchone()[0] - timedelta(days=retention_days)
+    conn.commit()
+
+    archived, skipped = [], []
+    for day in partition_days(conn):
+        if day >= cutoff:
+            break
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT count(*) FROM {partition_name('orders', day)} WHERE status = 'pending'"
+                )
+                pending_orders = cursor.fetchone()[0]
+                if pending_orders:
+                    conn.rollback()
+                    logger.warning("Not archiving a day with pending orders",
+                                   extra={'fields': {'day': day.isoformat(), 'pending_orders': pending_orders}})
+                    skipped.append(day)
+                    continue
+                for table in ORDER_PARTITION_TABLES:
+                    name = partition_name(table, day)
+                    cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                    if drop:
+                        cursor.execute(f"DROP TABLE {name}")
+                    else:
+                        cursor.execute(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("Archived order partitions",
+                    extra={'fields': {'day': day.isoformat(), 'dropped': drop}})
+        archived.append(day)
+    return archived, skipped
+
+
+def maintain_partitions(conn, days_ahead=PARTITIONS_AHEAD, retention_days=ORDER_RETENTION_DAYS,
+                        drop=False):
+    """Create upcoming partitions and archive old ones, unless another process is already at it.
+
+    Returns ``(created, archived, skipped)``, or ``None`` if the lock was busy.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (MAINTENANCE_LOCK_ID,))
+        locked = cursor.fetchone()[0]
+    conn.commit()
+    if not locked:
+        return None
+    try:
+        created = ensure_partitions(conn, days_ahead)
+        archived, skipped = archive_partitions(conn, retention_days, drop)
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MAINTENANCE_LOCK_ID,))
+        conn.commit()
+    return created, archived, skipped
+
+
+class PartitionMaintainer:
+    """Background thread that runs maintain_partitions() every ``interval`` seconds.
+
+    It also purges expired idempotency keys, the other order data with a
+    retention period.
+    """
+
+    def __init__(self, pool, interval=MAINTENANCE_INTERVAL, **options):
+        self._pool = pool
+        self.interval = interval
+        self._options = options
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="partition-maintainer",
+                                                daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _after_fork(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                conn = self._pool.getconn()
+                try:
+                    maintain_partitions(conn, **self._options)
+                    purge_expired(conn)
+                finally:
+                    self._pool.putconn(conn)
+            except Exception:
+                logger.exception("Partition maintenance failed")
+            self._stop.wait(self.interval)
@@ -0,0 +1,118 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from config import LOGIN_MAX_PER_IP, LOGIN_MAX_PER_USERNAME
+
+# KDF work runs in separate processes so it neither holds the GIL nor ties
+# up request threads beyond the wait for its result.
+HASH_WORKERS = 2
+HASH_MAX_PENDING = 16  # hashes running or queued before new ones are refused
+HASH_QUEUE_TIMEOUT = 2.0  # seconds to wait for a free slot
+
+# Login attempts allowed per window, checked before any database or KDF
+# work; the limits come from config.py
+LOGIN_WINDOW = 60.0  # seconds
+
+
+class HashingBusy(Exception):
+    """Raised when the password hashing pool is saturated."""
+
+
+class PasswordHasher:
+    """Bounded process pool for password hashing and verification."""
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING,
+                 queue_timeout=HASH_QUEUE_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the web process is multi-threaded
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HashingBusy("Password hashing is overloaded, please retry")
+        try:
+            return self._get_executor().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _after_fork(self):
+        # The parent's hashing processes can't be used from here
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+
+
+class LoginThrottle:
+    """Fixed-window attempt counters per username and per client IP."""
+
+    def __init__(self, window=LOGIN_WINDOW, max_per_username=LOGIN_MAX_PER_USERNAME,
+                 max_per_ip=LOGIN_MAX_PER_IP):
+        self.window = window
+        self.max_per_username = max_per_username
+        self.max_per_ip = max_per_ip
+        self._counters = {}  # key -> (window_start, count)
+        self._lock = threading.Lock()
+
+    def hit(self, username, ip):
+        """Record an attempt; return seconds to wait if it must be rejected."""
+        return self._hit((('user', username), self.max_per_username), (('ip', ip), self.max_per_ip))
+
+    def hit_ip(self, ip):
+        """Record an attempt counted only against the client IP, e.g. a signup."""
+        return self._hit((('ip', ip), self.max_per_ip))
+
+    def _hit(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._counters) > 10000:
+                self._prune(now)
+            retry_after = 0
+            for key, limit in keys:
+                start, count = self._counters.get(key, (now, 0))
+                if now - start >= self.window:
+                    start, count = now, 0
+                count += 1
+                self._counters[key] = (start, count)
+                if count > limit:
+                    retry_after = max(retry_after, self.window - (now - start))
+            return retry_after
+
+    def reset(self, username):
+        with self._lock:
+            self._counters.pop(('user', username), None)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        expired = [key for key, (start, _) in self._counters.items()
+                   if now - start >= self.window]
+        for key in expired:
+            del self._counters[key]
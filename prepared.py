@@ -0,0 +1,125 @@
+import hashlib
+import re
+import threading
+import time
+import weakref
+import psycopg2
+from logs import get_logger
+
+logger = get_logger('prepared')
+
+_PLACEHOLDER = re.compile(r'%(%|s)')
+
+
+def to_server_placeholders(sql):
+    """Rewrite psycopg2 ``%s`` placeholders as PREPARE-style ``$1, $2, ...``."""
+    counter = [0]
+
+    def replace(match):
+        if match.group(1) == '%':
+            return '%'
+        counter[0] += 1
+        return f'${counter[0]}'
+
+    return _PLACEHOLDER.sub(replace, sql)
+
+
+class StatementStats:
+    __slots__ = ('executions', 'seconds', 'prepares', 'fallbacks')
+
+    def __init__(self):
+        self.executions = 0
+        self.seconds = 0.0
+        self.prepares = 0
+        self.fallbacks = 0
+
+
+class PreparedStatements:
+    """Registry of hot queries executed as server-side prepared statements.
+
+    Each query is prepared on a connection the first time that connection
+    runs it, then executed by name, so Postgres skips re-parsing and can
+    reuse the plan. Queries built with different filters get distinct
+    statement names. If PREPARE fails the statement falls back to plain
+    execution from then on. Server-side (named) cursors can't DECLARE
+    over an EXECUTE, so those always run the plain text.
+    """
+
+    def __init__(self):
+        self._prepared = weakref.WeakKeyDictionary()  # connection -> set of names
+        self._failed = set()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def statement_name(name, sql):
+        return f"{name}_{hashlib.sha1(sql.encode()).hexdigest()[:10]}"
+
+    def execute(self, cursor, name, sql, params=()):
+        params = tuple(params or ())
+        statement = self.statement_name(name, sql)
+        start = time.perf_counter()
+        prepared = False
+        try:
+            if cursor.name is None and statement not in self._failed:
+                prepared = self._ensure_prepared(cursor, name, statement, sql)
+            if prepared:
+                placeholders = ', '.join(['%s'] * len(params))
+                cursor.execute(f"EXECUTE {statement}" + (f" ({placeholders})" if params else ""),
+                               params)
+            else:
+                cursor.execute(sql, params)
+        finally:
+            self._record(name, time.perf_counter() - start, fallback=not prepared)
+
+    def _ensure_prepared(self, cursor, name, statement, sql):
+        conn = cursor.connection
+        with self._lock:
+            names = self._prepared.setdefault(conn, set())
+        if statement in names:
+            return True
+
+        server_sql = to_server_placeholders(sql)
+        # A failed PREPARE would abort the caller's transaction; the savepoint
+        # lets us recover and fall back to plain execution.
+        try:
+            cursor.execute(f"SAVEPOINT prepare_statement; "
+                           f"PREPARE {statement} AS {server_sql}; "
+                           f"RELEASE SAVEPOINT prepare_statement")
+        except psycopg2.Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+            with self._lock:
+                self._failed.add(statement)
+            logger.warning("Could not prepare statement, executing it unprepared",
+                           extra={'fields': {'statement': statement, 'error': str(e)}})
+            return False
+        with self._lock:
+            names.add(statement)
+            self._stats.setdefault(name, StatementStats()).prepares += 1
+        return True
+
+    def _record(self, name, seconds, fallback):
+        with self._lock:
+            stats = self._stats.setdefault(name, StatementStats())
+            stats.executions += 1
+            stats.seconds += seconds
+            if fallback:
+                stats.fallbacks += 1
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {
+                    'executions': s.executions,
+                    'avg_ms': s.seconds / s.executions * 1000 if s.executions else 0.0,
+                    'prepares': s.prepares,
+                    'unprepared': s.fallbacks
+                }
+                for name, s in self._stats.items()
+            }
+
+
+statements = PreparedStatements()
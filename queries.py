@@ -0,0 +1,237 @@
+"""SQL used by app.py, kept in one place so it can be explained and reused."""
+
+MENU_ITEMS_SQL = """
+    SELECT f.item_id, f.food_name, f.price, c.packaging_type, f.is_ordered, f.image_url
+    FROM food_items f
+    JOIN containers c ON f.container_id = c.container_id
+    WHERE f.is_ordered = FALSE
+    ORDER BY f.food_name
+"""
+
+MENU_VERSION_SQL = "SELECT version FROM menu_version WHERE id = 1"
+
+BUMP_MENU_VERSION_SQL = """
+    INSERT INTO menu_version (id, version) VALUES (1, 1)
+    ON CONFLICT (id) DO UPDATE SET version = menu_version.version + 1
+"""
+
+INSERT_MENU_CONTAINER_SQL = """
+    INSERT INTO containers (packaging_type) VALUES (%s) RETURNING container_id
+"""
+
+INSERT_MENU_ITEM_SQL = """
+    INSERT INTO food_items (container_id, food_name, price, is_ordered, image_url)
+    VALUES (%s, %s, %s, %s, %s)
+    RETURNING item_id, food_name, price, is_ordered, image_url
+"""
+
+MENU_ITEM_CONTAINER_SQL = "SELECT container_id FROM food_items WHERE item_id = %s"
+
+DELETE_FOOD_ITEM_SQL = "DELETE FROM food_items WHERE item_id = %s"
+
+DELETE_CONTAINER_SQL = "DELETE FROM containers WHERE container_id = %s"
+
+# Multi-row inserts, expanded by psycopg2.extras.execute_values
+# created_at defaults to now(), the transaction start, so an order and its
+# containers and items always land in the same day partitions.
+INSERT_ORDERS_SQL = """
+    INSERT INTO orders (user_id, order_type, location, payment, status)
+    VALUES %s
+"""
+
+# An expired key is taken over; a live one is left alone and missing from
+# the RETURNING rows. A key another transaction is still writing would
+# block this statement, so writers lock the keys first (below).
+CLAIM_IDEMPOTENCY_KEYS_SQL = """
+    INSERT INTO idempotency_keys
+        (scope, key, request_hash, response_status, response_body, expires_at)
+    VALUES %s
+    ON CONFLICT (scope, key) DO UPDATE
+    SET request_hash = EXCLUDED.request_hash,
+        response_status = EXCLUDED.response_status,
+        response_body = EXCLUDED.response_body,
+        created_at = now(),
+        expires_at = EXCLUDED.expires_at
+    WHERE idempotency_keys.expires_at <= now()
+    RETURNING scope, key
+"""
+CLAIM_IDEMPOTENCY_KEYS_TEMPLATE = "(%s, %s, %s, %s, %s, now() + %s)"
+
+# Transaction-level advisory locks on (scope, key) hashes, taken before the
+# claim. Every writer of a key holds its lock, so one that must not wait can
+# see the key is busy without queueing on the row. The class id keeps the
+# hashes apart from other advisory locks; a hash collision costs a retry.
+IDEMPOTENCY_LOCK_CLASS = 7243019
+_IDEMPOTENCY_LOCK_KEY = f"{IDEMPOTENCY_LOCK_CLASS}, hashtext(claim.scope || ':' || claim.key)"
+
+LOCK_IDEMPOTENCY_KEYS_SQL = f"""
+    SELECT pg_advisory_xact_lock({_IDEMPOTENCY_LOCK_KEY})
+    FROM (VALUES %s) AS claim (scope, key)
+    ORDER BY hashtext(claim.scope || ':' || claim.key)
+"""
+
+# Returns the keys another transaction holds, locking the rest
+TRY_LOCK_IDEMPOTENCY_KEYS_SQL = f"""
+    SELECT claim.scope, claim.key
+    FROM (VALUES %s) AS claim (scope, key)
+    WHERE NOT pg_try_advisory_xact_lock({_IDEMPOTENCY_LOCK_KEY})
+"""
+
+WAIT_IDEMPOTENCY_KEY_SQL = f"""
+    SELECT pg_advisory_xact_lock({_IDEMPOTENCY_LOCK_KEY})
+    FROM (VALUES (%s, %s)) AS claim (scope, key)
+"""
+
+IDEMPOTENCY_KEY_SQL = """
+    SELECT request_hash, response_status, response_body
+    FROM idempotency_keys
+    WHERE scope = %s AND key = %s AND expires_at > now()
+"""
+
+PURGE_IDEMPOTENCY_KEYS_SQL = "DELETE FROM idempotency_keys WHERE expires_at <= now()"
+
+CLAIM_ORDER_IDS_SQL = """
+    INSERT INTO order_ids (user_id, created_at) VALUES %s
+    ON CONFLICT (user_id) DO NOTHING
+    RETURNING user_id
+"""
+CLAIM_ORDER_IDS_TEMPLATE = "(%s, now())"
+
+INSERT_ORDER_CONTAINERS_SQL = """
+    INSERT INTO order_containers (order_id, container_number, packaging_type, message)
+    VALUES %s
+    RETURNING container_id, order_id, container_number
+"""
+
+INSERT_ORDER_ITEMS_SQL = """
+    INSERT INTO order_items (container_id, food_name, price)
+    VALUES %s
+"""
+
+# Allowed status changes, keyed by the new status
+ORDER_STATUS_PREVIOUS = {
+    'paid': 'pending',
+    'fulfilled': 'paid'
+}
+
+# A NULL payment keeps the current one; paying an order must also move its
+# payment off 'pending', which the pending-order indexes and the kitchen
+# feed key on
+UPDATE_ORDER_STATUS_SQL = """
+    UPDATE orders SET status = %s, payment = COALESCE(%s, payment), status_changed_at = now()
+    WHERE user_id = %s AND status = %s
+    RETURNING user_id, status, payment, created_at, status_changed_at
+"""
+
+ORDER_STATUS_SQL = "SELECT status FROM orders WHERE user_id = %s"
+
+USER_BY_USERNAME_SQL = "SELECT * FROM users WHERE username = %s"
+
+USERNAME_EXISTS_SQL = "SELECT id FROM users WHERE username = %s"
+
+INSERT_USER_SQL = """
+    INSERT INTO users (username, email, password_hash)
+    VALUES (%s, %s, %s)
+    RETURNING id, username, email
+"""
+
+
+def pending_orders_query(order_type=None, location=None, after=None, limit=None,
+                         order_ids=None, since=None):
+    """Build the pending-orders aggregation used by /cards and /api/orders.
+
+    Food items are aggregated per container in a single pass over the
+    pending set instead of a correlated subquery per container. Results are
+    ordered by order id; pass the last id of a page as ``after`` together
+    with ``limit`` for keyset pagination. ``order_ids`` restricts the result
+    to specific orders, e.g. the ones named in a change notification.
+    ``since`` skips orders created before it, which lets Postgres prune the
+    older day partitions of all three order tables.
+
+    Returns a ``(sql, params)`` tuple.
+    """
+    filters = [
+        "o.status = 'pending'",
+        "EXISTS (SELECT 1 FROM order_containers c "
+        "WHERE c.order_id = o.user_id AND c.created_at = o.created_at)"
+    ]
+    params = []
+    if since is not None:
+        filters.append("o.created_at >= %s")
+        params.append(since)
+    if order_type is not None:
+        filters.append("o.order_type = %s")
+        params.append(order_type)
+    if location is not None:
+        filters.append("o.location = %s")
+        params.append(location)
+    if after is not None:
+        filters.append("o.user_id > %s")
+        params.append(after)
+    if order_ids is not None:
+        filters.append("o.user_id = ANY(%s)")
+        params.append(list(order_ids))
+
+    limit_clause = ""
+    if limit is not None:
+        limit_clause = "LIMIT %s"
+        params.append(limit)
+
+    # Repeat the bound on the child tables so they are pruned at plan time
+    container_since = item_since = ""
+    if since is not None:
+        container_since = "WHERE c.created_at >= %s"
+        item_since = "WHERE f.created_at >= %s"
+        params.extend([since, since])
+
+    sql = f"""
+        WITH pending AS (
+            SELECT o.*
+            FROM orders o
+            WHERE {' AND '.join(filters)}
+            ORDER BY o.user_id
+            {limit_clause}
+        ),
+        pending_containers AS (
+            SELECT c.container_id, c.order_id, c.created_at, c.container_number,
+                   c.packaging_type, c.message
+            FROM order_containers c
+            JOIN pending p ON c.order_id = p.user_id AND c.created_at = p.created_at
+            {container_since}
+        ),
+        container_items AS (
+            SELECT f.container_id,
+                   json_agg(
+                       json_build_object(
+                           'food_name', f.food_name,
+                           'Price', f.price
+                       )
+                       ORDER BY f.item_id
+                   ) AS food_items
+            FROM order_items f
+            JOIN pending_containers pc
+              ON f.container_id = pc.container_id AND f.created_at = pc.created_at
+            {item_since}
+            GROUP BY f.container_id
+        ),
+        container_sets AS (
+            SELECT pc.order_id,
+                   json_object_agg(
+                       pc.container_id,
+                       json_build_object(
+                           'container_number', pc.container_number,
+                           'packaging_type', pc.packaging_type,
+                           'message', pc.message,
+                           'FoodItems', ci.food_items
+                       )
+                   ) AS containers
+            FROM pending_containers pc
+            LEFT JOIN container_items ci ON ci.container_id = pc.container_id
+            GROUP BY pc.order_id
+        )
+        SELECT p.*, oc.containers
+        FROM pending p
+        JOIN container_sets oc ON oc.order_id = p.user_id
+        ORDER BY p.user_id
+    """
+    return sql, params
@@ -0,0 +1,301 @@
+"""Sales and menu-popularity reporting backed by hourly rollups.
+
+A trigger logs every new order in report_queue, in the order's own
+transaction. refresh_reports() deletes the queued rows it can see, adds
+their orders to the rollup tables and records when it ran, all in one
+statement. A queued row only becomes visible when its order commits, so an
+order whose transaction committed long after it started is picked up by a
+later refresh instead of falling behind a time watermark, and every order
+is counted exactly once. Report queries read only the rollups; their cost
+depends on the requested range, not on how many orders have ever been
+taken. Rollups outlive archived order partitions.
+
+Revenue is the sum of item prices of submitted orders, whatever their
+status.
+"""
+import threading
+from logs import get_logger
+
+logger = get_logger('reports')
+
+REPORT_REFRESH_INTERVAL = 60.0  # seconds between runs of the background job
+REPORT_BUCKETS = ('hour', 'day', 'week', 'month')
+# Arbitrary key for pg_try_advisory_xact_lock so refreshes never overlap
+REPORT_LOCK_ID = 7243003
+WATERMARK_NAME = 'sales'
+
+# The aggregates below read the orders to count from a ``source`` CTE
+ORDER_TOTALS_SQL = """
+    order_totals AS (
+        SELECT c.order_id, c.created_at, sum(f.price) AS total
+        FROM source o
+        JOIN order_containers c ON c.order_id = o.user_id AND c.created_at = o.created_at
+        JOIN order_items f ON f.container_id = c.container_id AND f.created_at = c.created_at
+        GROUP BY c.order_id, c.created_at
+    )
+"""
+
+SALES_AGGREGATE_SQL = """
+    SELECT date_trunc('hour', o.created_at) AS bucket,
+           COALESCE(o.order_type, '') AS order_type,
+           COALESCE(o.location, '') AS location,
+           count(*) AS orders,
+           COALESCE(sum(t.total), 0) AS revenue
+    FROM source o
+    LEFT JOIN order_totals t ON t.order_id = o.user_id AND t.created_at = o.created_at
+    GROUP BY 1, 2, 3
+"""
+
+ITEM_AGGREGATE_SQL = """
+    SELECT date_trunc('hour', f.created_at) AS bucket,
+           COALESCE(f.food_name, '') AS food_name,
+           count(*) AS quantity,
+           COALESCE(sum(f.price), 0) AS revenue
+    FROM source o
+    JOIN order_containers c ON c.order_id = o.user_id AND c.created_at = o.created_at
+    JOIN order_items f ON f.container_id = c.container_id AND f.created_at = c.created_at
+    GROUP BY 1, 2
+"""
+
+# One statement, so the queue rows are removed exactly when their orders are
+# added. Rows of uncommitted orders are invisible to the DELETE and stay
+# queued for the next run. Returns the number of orders rolled up.
+ROLLUP_SQL = f"""
+    WITH drained AS (
+        DELETE FROM report_queue
+        RETURNING order_id, created_at
+    ),
+    source AS (
+        SELECT o.*
+        FROM orders o
+        JOIN drained d ON o.user_id = d.order_id AND o.created_at = d.created_at
+    ),
+    {ORDER_TOTALS_SQL},
+    sales AS (
+        INSERT INTO sales_hourly (bucket, order_type, location, orders, revenue)
+        {SALES_AGGREGATE_SQL}
+        ON CONFLICT (bucket, order_type, location) DO UPDATE
+        SET orders = sales_hourly.orders + EXCLUDED.orders,
+            revenue = sales_hourly.revenue + EXCLUDED.revenue
+    ),
+    items AS (
+        INSERT INTO item_sales_hourly (bucket, food_name, quantity, revenue)
+        {ITEM_AGGREGATE_SQL}
+        ON CONFLICT (bucket, food_name) DO UPDATE
+        SET quantity = item_sales_hourly.quantity + EXCLUDED.quantity,
+            revenue = item_sales_hourly.revenue + EXCLUDED.revenue
+    )
+    SELECT count(*) FROM drained
+"""
+
+WATERMARK_SQL = "SELECT through FROM report_watermark WHERE name = %s"
+
+SET_WATERMARK_SQL = """
+    INSERT INTO report_watermark (name, through) VALUES (%s, %s)
+    ON CONFLICT (name) DO UPDATE SET through = EXCLUDED.through
+"""
+
+REVENUE_REPORT_SQL = """
+    SELECT date_trunc(%(unit)s, s.bucket) AS bucket,
+           sum(s.orders) AS orders,
+           sum(s.revenue) AS revenue
+    FROM sales_hourly s
+    WHERE s.bucket >= %(start)s AND s.bucket < %(end)s
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+ORDERS_REPORT_SQL = """
+    SELECT date_trunc(%(unit)s, s.bucket) AS bucket,
+           s.order_type,
+           s.location,
+           sum(s.orders) AS orders,
+           sum(s.revenue) AS revenue
+    FROM sales_hourly s
+    WHERE s.bucket >= %(start)s AND s.bucket < %(end)s
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+"""
+
+ITEMS_REPORT_SQL = """
+    SELECT bucket, food_name, quantity, revenue, rank
+    FROM (
+        SELECT date_trunc(%(unit)s, i.bucket) AS bucket,
+               i.food_name,
+               sum(i.quantity) AS quantity,
+               sum(i.revenue) AS revenue,
+               rank() OVER (
+                   PARTITION BY date_trunc(%(unit)s, i.bucket)
+                   ORDER BY sum(i.quantity) DESC
+               ) AS rank
+        FROM item_sales_hourly i
+        WHERE i.bucket >= %(start)s AND i.bucket < %(end)s
+        GROUP BY 1, 2
+    ) ranked
+    WHERE rank <= %(limit)s
+    ORDER BY bucket, rank, food_name
+"""
+
+
+def watermark(cursor):
+    """When the rollups were last refreshed, or None if never.
+
+    Every order committed before then is included.
+    """
+    cursor.execute(WATERMARK_SQL, (WATERMARK_NAME,))
+    row = cursor.fetchone()
+    return _first_value(row) if row is not None else None
+
+
+def refresh_rollups(cursor):
+    """Roll up the queued orders, in the caller's transaction.
+
+    Returns ``(orders, through)``, the number of orders added and the new
+    watermark, or None if another refresh holds the lock.
+    """
+    cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (REPORT_LOCK_ID,))
+    if not _first_value(cursor.fetchone()):
+        return None
+    # Taken before the DELETE's snapshot, so everything committed by then is drained
+    cursor.execute("SELECT clock_timestamp()")
+    through = _first_value(cursor.fetchone())
+    cursor.execute(ROLLUP_SQL)
+    orders = _first_value(cursor.fetchone())
+    cursor.execute(SET_WATERMARK_SQL, (WATERMARK_NAME, through))
+    return orders, through
+
+
+def refresh_reports(conn):
+    try:
+        with conn.cursor() as cursor:
+            result = refresh_rollups(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+
+def _first_value(row):
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def revenue_report(cursor, start, end, unit='hour'):
+    cursor.execute(REVENUE_REPORT_SQL, {'unit': unit, 'start': start, 'end': end})
+    return cursor.fetchall()
+
+
+def orders_report(cursor, start, end, unit='hour'):
+    cursor.execute(ORDERS_REPORT_SQL, {'unit': unit, 'start': start, 'end': end})
+    return cursor.fetchall()
+
+
+def items_report(cursor, start, end, unit='hour', limit=10):
+    """Most ordered items per bucket; ties share a rank."""
+    cursor.execute(ITEMS_REPORT_SQL, {'unit': unit, 'start': start, 'end': end, 'limit': limit})
+    return cursor.fetchall()
+
+
+# Orders still queued are in neither the recomputation nor the rollups; a
+# refresh commits its queue deletions and rollup changes together, so the
+# two sides agree in any snapshot.
+RECONCILE_SQL = """
+    WITH source AS (
+        SELECT o.*
+        FROM orders o
+        WHERE o.created_at >= %(start)s
+          AND NOT EXISTS (
+              SELECT 1 FROM report_queue q
+              WHERE q.order_id = o.user_id AND q.created_at = o.created_at
+          )
+    ),
+    {totals},
+    raw AS ({aggregate}),
+    rolled AS (
+        SELECT {columns}
+        FROM {table}
+        WHERE bucket >= %(start)s
+    )
+    SELECT {keys},
+           {compare}
+    FROM raw
+    FULL JOIN rolled ON {join}
+    WHERE {mismatch}
+    ORDER BY 1
+"""
+
+
+def _reconcile_sql(aggregate, table, keys, values):
+    return RECONCILE_SQL.format(
+        totals=ORDER_TOTALS_SQL,
+        aggregate=aggregate,
+        columns=', '.join(keys + values),
+        table=table,
+        keys=', '.join(f"COALESCE(raw.{k}, rolled.{k}) AS {k}" for k in keys),
+        compare=', '.join(f"raw.{v} AS raw_{v}, rolled.{v} AS rollup_{v}" for v in values),
+        join=' AND '.join(f"raw.{k} = rolled.{k}" for k in keys),
+        mismatch=' OR '.join(f"raw.{v} IS DISTINCT FROM rolled.{v}" for v in values)
+    )
+
+
+RECONCILE_SALES_SQL = _reconcile_sql(SALES_AGGREGATE_SQL, 'sales_hourly',
+                                     ['bucket', 'order_type', 'location'], ['orders', 'revenue'])
+RECONCILE_ITEMS_SQL = _reconcile_sql(ITEM_AGGREGATE_SQL, 'item_sales_hourly',
+                                     ['bucket', 'food_name'], ['quantity', 'revenue'])
+
+
+def reconcile(cursor, start):
+    """Compare the rollups with a full recomputation from the order tables.
+
+    Checks buckets from ``start`` (the oldest day still attached; archived
+    days can't be recomputed) on, leaving out orders not yet rolled up.
+    Returns ``(through, mismatches)`` where each mismatch is ``(rollup, row)``.
+    """
+    through = watermark(cursor)
+    if through is None:
+        return None, []
+    window = {'start': start if start is not None else '-infinity'}
+    mismatches = []
+    for name, sql in (('sales_hourly', RECONCILE_SALES_SQL), ('item_sales_hourly', RECONCILE_ITEMS_SQL)):
+        cursor.execute(sql, window)
+        mismatches.extend((name, row) for row in cursor.fetchall())
+    return through, mismatches
+
+
+class ReportRefresher:
+    """Background thread that runs refresh_reports() every ``interval`` seconds."""
+
+    def __init__(self, pool, interval=REPORT_REFRESH_INTERVAL):
+        self._pool = pool
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="report-refresher",
+                                                daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _after_fork(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                conn = self._pool.getconn()
+                try:
+                    refresh_reports(conn)
+                finally:
+                    self._pool.putconn(conn)
+            except Exception:
+                logger.exception("Report refresh failed")
+            self._stop.wait(self.interval)
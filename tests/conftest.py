@@ -0,0 +1,53 @@
+"""Fixtures for tests that run against Postgres.
+
+Set POS_TEST_DATABASE to the name of a scratch database to run them; host,
+user and password come from the usual libpq variables (see config.py). The
+database is migrated on first use. Without it, or when it can't be reached,
+the database tests are skipped.
+"""
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+TEST_DATABASE = os.environ.get('POS_TEST_DATABASE')
+if TEST_DATABASE:
+    # Before config.py is imported, so the app's pools use it too
+    os.environ['PGDATABASE'] = TEST_DATABASE
+
+
+@pytest.fixture(scope='session')
+def database():
+    """DB_CONFIG for a migrated test database with today's partitions."""
+    if not TEST_DATABASE:
+        pytest.skip("POS_TEST_DATABASE is not set")
+    psycopg2 = pytest.importorskip('psycopg2')
+    from config import DB_CONFIG
+    from migrations import migrate
+    from partitions import ensure_partitions
+    try:
+        conn = psycopg2.connect(connect_timeout=5, **DB_CONFIG)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Test database is not reachable: {e}")
+    try:
+        migrate(conn)
+        ensure_partitions(conn)
+    finally:
+        conn.close()
+    return DB_CONFIG
+
+
+@pytest.fixture
+def conn(database):
+    """A connection whose transaction is rolled back after the test."""
+    import psycopg2
+    conn = psycopg2.connect(**database)
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
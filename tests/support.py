@@ -0,0 +1,101 @@
+"""Reference queries and data helpers shared by the tests and benchmark.py."""
+
+# The per-container correlated subquery /cards and /api/orders used before
+# the shared pending-orders builder, kept as the reference its payload is
+# checked against.
+LEGACY_CARDS_SQL = """
+    SELECT o.*,
+           json_object_agg(
+               c.container_id,
+               json_build_object(
+                   'container_number', c.container_number,
+                   'packaging_type', c.packaging_type,
+                   'message', c.message,
+                   'FoodItems', (
+                       SELECT json_agg(
+                           json_build_object(
+                               'food_name', f.food_name,
+                               'Price', f.price
+                           )
+                       )
+                       FROM order_items f
+                       WHERE f.container_id = c.container_id
+                   )
+               )
+           ) as containers
+    FROM orders o
+    JOIN order_containers c ON o.user_id = c.order_id
+    WHERE o.status = 'pending'
+    GROUP BY o.created_at, o.user_id
+"""
+
+
+def normalize_cards(rows):
+    """Order-independent view of a cards payload for comparing two queries."""
+    normalized = {}
+    for row in rows:
+        containers = {}
+        for container_id, container in row['containers'].items():
+            container = dict(container)
+            container['FoodItems'] = sorted(
+                (item['food_name'], str(item['Price'])) for item in container['FoodItems'] or []
+            )
+            containers[str(container_id)] = container
+        normalized[row['user_id']] = (dict(row, containers=None), containers)
+    return normalized
+
+
+def insert_order(cursor, order_id, containers, status='pending', order_type='walk_in',
+                 location='test', created_at=None, food_name='item'):
+    """Insert one order with ``containers`` = item counts per container.
+
+    ``created_at`` defaults to the transaction's now(), like write_orders().
+    """
+    cursor.execute("""
+        INSERT INTO orders (user_id, order_type, location, payment, status, created_at)
+        VALUES (%s, %s, %s, %s, %s, COALESCE(%s, now()))
+        RETURNING created_at
+    """, (order_id, order_type, location, 'pending' if status == 'pending' else 'card',
+          status, created_at))
+    created_at = cursor.fetchone()[0]
+    for number, items in enumerate(containers, 1):
+        cursor.execute("""
+            INSERT INTO order_containers (order_id, created_at, container_number, packaging_type, message)
+            VALUES (%s, %s, %s, 'box', '')
+            RETURNING container_id
+        """, (order_id, created_at, number))
+        container_id = cursor.fetchone()[0]
+        for n in range(items):
+            cursor.execute("""
+                INSERT INTO order_items (container_id, created_at, food_name, price)
+                VALUES (%s, %s, %s, %s)
+            """, (container_id, created_at, f"{food_name} {n}", 1.25 + n))
+    return created_at
+
+
+def delete_orders(conn, pattern):
+    """Commit the removal of orders whose id matches the LIKE ``pattern``."""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            DELETE FROM order_items WHERE container_id IN (
+                SELECT container_id FROM order_containers WHERE order_id LIKE %s
+            )
+        """, (pattern,))
+        cursor.execute("DELETE FROM order_containers WHERE order_id LIKE %s", (pattern,))
+        cursor.execute("DELETE FROM orders WHERE user_id LIKE %s", (pattern,))
+        cursor.execute("DELETE FROM order_ids WHERE user_id LIKE %s", (pattern,))
+    conn.commit()
+
+
+class PerRequestStore:
+    """Stands in for app.idempotency_store so that every request behaves as
+    if it ran in a different worker: no memory cache, no shared execution."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def claim(self, *args):
+        return self._store.claim(*args)
+
+    def run(self, scope, key, request_hash, execute):
+        return execute()
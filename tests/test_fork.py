@@ -0,0 +1,60 @@
+"""Forked workers must not inherit the parent's threads or per-process state."""
+import os
+import pytest
+
+import logs
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason="os.fork is not available")
+
+
+def run_in_child(check):
+    """Fork, run ``check()`` in the child and return whether it returned True."""
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = 0 if check() else 2
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status) == 0
+
+
+def test_log_listener_starts_on_first_record_and_not_across_fork():
+    logs.configure_logging()
+    logger = logs.get_logger('test')
+    logger.info("before fork")
+    assert logs._listener._thread is not None
+
+    def child():
+        idle = logs._listener._thread is None
+        logger.info("in child")
+        return idle and logs._listener._thread.is_alive()
+
+    assert run_in_child(child)
+    # Stopped for the fork; the parent's next record starts it again
+    assert logs._listener._thread is None
+    logger.info("after fork")
+    assert logs._listener._thread.is_alive()
+
+
+def test_after_fork_hook_resets_replica_state_and_registered_singletons():
+    pytest.importorskip('psycopg2')
+    import database
+
+    class Probe:
+        reset = False
+
+        def _after_fork(self):
+            self.reset = True
+
+    probe = database.reset_after_fork(Probe())
+    router = database.replica_router
+    router._down_until['probe'] = float('inf')
+    try:
+        assert run_in_child(lambda: probe.reset and 'probe' not in router._down_until)
+        assert not probe.reset
+        assert 'probe' in router._down_until
+    finally:
+        database._fork_resets.remove(probe)
+        router._down_until.pop('probe', None)
@@ -0,0 +1,191 @@
+"""Idempotent order submission: one order per key, however the duplicates arrive."""
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from support import PerRequestStore
+
+psycopg2 = pytest.importorskip('psycopg2')
+pytest.importorskip('flask')
+pytest.importorskip('flask_cors')
+jwt = pytest.importorskip('jwt')
+import app as pos_app  # noqa: E402
+from idempotency import request_fingerprint  # noqa: E402
+from orders import prepare_order, write_orders  # noqa: E402
+
+PREFIX = 'TEST_IDEM_'
+SECRET_KEY = 'test-secret'
+USER_ID = 0
+DUPLICATES = 8
+
+
+def make_order(location):
+    return {
+        'order_type': 'walk_in',
+        'location': location,
+        'payment': 'pending',
+        'containers': [{
+            'container_number': 1,
+            'packaging_type': 'box',
+            'message': '',
+            'FoodItems': [{'food_name': 'item', 'Price': 2.5}]
+        }]
+    }
+
+
+def headers(key=None):
+    token = jwt.encode({
+        'user_id': USER_ID,
+        'username': 'test',
+        'exp': datetime.utcnow() + timedelta(hours=1)
+    }, SECRET_KEY)
+    result = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+    if key is not None:
+        result['Idempotency-Key'] = key
+    return result
+
+
+def submit(client, body, key=None):
+    response = client.post('/api/submit-order', data=body, headers=headers(key))
+    return (response.status_code, response.get_json(),
+            response.headers.get('Idempotent-Replayed') == 'true')
+
+
+@pytest.fixture
+def run_id(database):
+    """Unique prefix for locations and keys; the orders and keys are removed afterwards."""
+    run_id = f"{PREFIX}{uuid.uuid4().hex[:12]}"
+    yield run_id
+    conn = psycopg2.connect(**database)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT user_id FROM orders WHERE location LIKE %s", (run_id + '%',))
+            order_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute("""
+                DELETE FROM order_items WHERE container_id IN (
+                    SELECT container_id FROM order_containers WHERE order_id = ANY(%s)
+                )
+            """, (order_ids,))
+            cursor.execute("DELETE FROM order_containers WHERE order_id = ANY(%s)", (order_ids,))
+            cursor.execute("DELETE FROM orders WHERE user_id = ANY(%s)", (order_ids,))
+            cursor.execute("DELETE FROM order_ids WHERE user_id = ANY(%s)", (order_ids,))
+            cursor.execute("DELETE FROM report_queue WHERE order_id = ANY(%s)", (order_ids,))
+            cursor.execute("DELETE FROM idempotency_keys WHERE key LIKE %s", (run_id + '%',))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def make_app(group_commit):
+    return pos_app.create_app({
+        'SECRET_KEY': SECRET_KEY,
+        'ORDER_GROUP_COMMIT': group_commit,
+        'PARTITION_MAINTENANCE': False,
+        'REPORT_REFRESH': False
+    })
+
+
+def orders_at(database, location):
+    conn = psycopg2.connect(**database)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT user_id FROM orders WHERE location = %s", (location,))
+            return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('group_commit', [False, True], ids=['per-request', 'group-commit'])
+@pytest.mark.parametrize('workers', ['one', 'many'])
+def test_concurrent_duplicates_create_one_order(database, run_id, monkeypatch, group_commit, workers):
+    if workers == 'many':
+        # Every request acts as its own worker, so duplicates meet in the database
+        monkeypatch.setattr(pos_app, 'idempotency_store', PerRequestStore(pos_app.idempotency_store))
+    app = make_app(group_commit)
+    location = f"{run_id}_burst"
+    body = json.dumps(make_order(location))
+    barrier = threading.Barrier(DUPLICATES)
+    responses = [None] * DUPLICATES
+
+    def duplicate(n):
+        client = app.test_client()
+        barrier.wait()
+        responses[n] = submit(client, body, f"{run_id}_key")
+
+    threads = [threading.Thread(target=duplicate, args=(n,)) for n in range(DUPLICATES)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    orders = orders_at(database, location)
+    assert len(orders) == 1
+    assert {status for status, _, _ in responses} == {201}
+    assert {body['order_id'] for _, body, _ in responses} == set(orders)
+    assert sum(replayed for _, _, replayed in responses) == DUPLICATES - 1
+
+
+def test_replays_and_refuses_a_reused_key(database, run_id):
+    client = make_app(False).test_client()
+    body = json.dumps(make_order(f"{run_id}_replay"))
+    key = f"{run_id}_key"
+
+    first = submit(client, body, key)
+    assert first[0] == 201 and not first[2]
+    pos_app.idempotency_store.clear()
+    # From the table this time, not the worker's memory
+    assert submit(client, body, key) == (201, first[1], True)
+
+    status, _, _ = submit(client, json.dumps(make_order(f"{run_id}_other")), key)
+    assert status == 422
+    assert len(orders_at(database, f"{run_id}_replay")) == 1
+
+
+def test_contended_key_does_not_stall_group_commit(database, run_id):
+    """A duplicate of an order still being written elsewhere must wait outside the batch."""
+    app = make_app(True)
+    key = f"{run_id}_held"
+    body = json.dumps(make_order(f"{run_id}_held")).encode()
+    held_id = f"{run_id[-12:]}_HELD"
+    stored_body = {"message": "Order submitted successfully", "order_id": held_id}
+
+    # Another worker has written this key's order but not committed yet
+    held = psycopg2.connect(**database)
+    watcher = psycopg2.connect(**database)
+    try:
+        prepared = prepare_order(json.loads(body))
+        prepared['idempotency'] = pos_app.idempotency_store.claim(
+            str(USER_ID), key, request_fingerprint('/api/submit-order', body), 201, stored_body)
+        write_orders(held, [(held_id, prepared)])
+
+        results = {}
+        duplicate = threading.Thread(
+            target=lambda: results.update(duplicate=submit(app.test_client(), body, key)))
+        duplicate.start()
+
+        # The duplicate gets past the writer and waits on the key in its own request
+        deadline = time.monotonic() + 10
+        waiting = False
+        while not waiting and time.monotonic() < deadline:
+            with watcher.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND NOT granted")
+                waiting = cursor.fetchone()[0] > 0
+            watcher.rollback()
+            time.sleep(0.01)
+        assert waiting
+
+        started = time.monotonic()
+        other = submit(app.test_client(), json.dumps(make_order(f"{run_id}_other")))
+        assert other[0] == 201
+        assert time.monotonic() - started < 5
+        assert duplicate.is_alive()
+
+        held.commit()
+        duplicate.join(10)
+        assert results['duplicate'] == (201, stored_body, True)
+    finally:
+        held.rollback()
+        held.close()
+        watcher.close()
@@ -0,0 +1,60 @@
+"""write_orders() keeps order ids unique across day partitions."""
+import pytest
+from support import delete_orders
+
+psycopg2 = pytest.importorskip('psycopg2')
+from database import ConnectionPool  # noqa: E402
+from order_queue import OrderBatchWriter, _PendingOrder  # noqa: E402
+from orders import DuplicateOrderId, prepare_order, write_orders  # noqa: E402
+
+PAYLOAD = {
+    'order_type': 'walk_in',
+    'location': 'test',
+    'payment': 'pending',
+    'containers': [{
+        'container_number': 1,
+        'packaging_type': 'box',
+        'message': '',
+        'FoodItems': [{'food_name': 'item', 'Price': 2.5}]
+    }]
+}
+
+
+def test_reused_order_id_is_refused_before_writing(conn):
+    write_orders(conn, [('TEST_DUP_1', prepare_order(PAYLOAD))])
+    with conn.cursor() as cursor:
+        # An order with the same id on another day would not clash on the
+        # partitioned table's (created_at, user_id) key
+        cursor.execute("UPDATE orders SET created_at = created_at - interval '1 day' "
+                       "WHERE user_id = 'TEST_DUP_1'")
+        cursor.execute("SAVEPOINT second_order")
+        with pytest.raises(DuplicateOrderId) as raised:
+            write_orders(conn, [('TEST_DUP_2', prepare_order(PAYLOAD)),
+                                ('TEST_DUP_1', prepare_order(PAYLOAD))])
+        assert raised.value.order_ids == ['TEST_DUP_1']
+        cursor.execute("ROLLBACK TO SAVEPOINT second_order")
+        cursor.execute("SELECT count(*) FROM orders WHERE user_id LIKE 'TEST_DUP_%'")
+        assert cursor.fetchone()[0] == 1
+
+
+def test_group_commit_refuses_only_the_reused_id(database):
+    pool = ConnectionPool(1, 1, **database)
+    writer = OrderBatchWriter(pool)
+    try:
+        writer._write([_PendingOrder('TEST_DUP_GC_1', prepare_order(PAYLOAD))])
+        batch = [_PendingOrder(order_id, prepare_order(PAYLOAD))
+                 for order_id in ('TEST_DUP_GC_2', 'TEST_DUP_GC_1', 'TEST_DUP_GC_3')]
+        writer._write_batch(batch)
+        assert [type(pending.error) for pending in batch] == [type(None), DuplicateOrderId, type(None)]
+        # The other two still share one commit
+        assert writer.batches == 2 and writer.orders == 3
+    finally:
+        conn = psycopg2.connect(**database)
+        try:
+            delete_orders(conn, 'TEST\\_DUP\\_GC\\_%')
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM report_queue WHERE order_id LIKE 'TEST\\_DUP\\_GC\\_%'")
+            conn.commit()
+        finally:
+            conn.close()
+        pool.closeall()
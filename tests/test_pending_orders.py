@@ -0,0 +1,62 @@
+"""The shared pending-orders query must return what the legacy per-container query did."""
+import pytest
+from support import LEGACY_CARDS_SQL, insert_order, normalize_cards
+
+pytest.importorskip('psycopg2')
+from psycopg2.extras import RealDictCursor  # noqa: E402
+from queries import pending_orders_query  # noqa: E402
+
+# Item counts per container; an empty container and an order without
+# containers are edge cases for the joins
+SEEDED_ORDERS = {
+    'TEST_CARDS_1': [1],
+    'TEST_CARDS_2': [3, 2, 4],
+    'TEST_CARDS_3': [0, 2],
+    'TEST_CARDS_4': [],
+    'TEST_CARDS_5': [5],
+}
+
+
+@pytest.fixture
+def seeded(conn):
+    with conn.cursor() as cursor:
+        for order_id, containers in SEEDED_ORDERS.items():
+            insert_order(cursor, order_id, containers)
+        insert_order(cursor, 'TEST_CARDS_PAID', [2], status='paid')
+    return conn
+
+
+def test_payload_matches_legacy_query(seeded):
+    with seeded.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(LEGACY_CARDS_SQL)
+        legacy = normalize_cards(cursor.fetchall())
+        sql, params = pending_orders_query()
+        cursor.execute(sql, params)
+        current = normalize_cards(cursor.fetchall())
+
+    assert current == legacy
+    seeded_ids = {order_id for order_id, containers in SEEDED_ORDERS.items() if containers}
+    assert seeded_ids <= set(current)
+    assert 'TEST_CARDS_4' not in current
+    assert 'TEST_CARDS_PAID' not in current
+
+
+def test_keyset_pages_cover_the_full_result(seeded):
+    order_ids = list(SEEDED_ORDERS)
+    with seeded.cursor(cursor_factory=RealDictCursor) as cursor:
+        sql, params = pending_orders_query(order_ids=order_ids)
+        cursor.execute(sql, params)
+        everything = cursor.fetchall()
+
+        pages, after = [], None
+        while True:
+            sql, params = pending_orders_query(order_ids=order_ids, after=after, limit=2)
+            cursor.execute(sql, params)
+            page = cursor.fetchall()
+            if not page:
+                break
+            pages.extend(page)
+            after = page[-1]['user_id']
+
+    assert [row['user_id'] for row in pages] == [row['user_id'] for row in everything]
+    assert normalize_cards(pages) == normalize_cards(everything)
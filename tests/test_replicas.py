@@ -0,0 +1,36 @@
+"""ReplicaRouter skips busy replicas without marking them down."""
+import pytest
+
+pytest.importorskip('psycopg2')
+import database  # noqa: E402
+
+
+class FakePool:
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+        self.timeouts = []
+
+    def getconn(self, timeout=None):
+        self.timeouts.append(timeout)
+        if self.error is not None:
+            raise self.error
+        return f"{self.name} connection"
+
+
+def test_busy_replica_is_skipped_but_not_marked_down():
+    busy = FakePool('busy', database.PoolTimeout("no free connection"))
+    idle = FakePool('idle')
+    router = database.ReplicaRouter([busy, idle])
+
+    assert router.getconn() == (idle, 'idle connection')
+    assert busy.timeouts == [database.REPLICA_CHECKOUT_TIMEOUT]
+    assert router.stats()['replicas_healthy'] == 2
+
+
+def test_broken_replica_is_marked_down():
+    broken = FakePool('broken', database.psycopg2.OperationalError("connection refused"))
+    router = database.ReplicaRouter([broken])
+
+    assert router.getconn() == (None, None)
+    assert router.stats()['replicas_healthy'] == 0
@@ -0,0 +1,108 @@
+"""Rollups must count every order exactly once, however late it commits."""
+import pytest
+from support import delete_orders, insert_order
+
+psycopg2 = pytest.importorskip('psycopg2')
+import reports  # noqa: E402
+
+PREFIX = 'TEST_REPORTS_'
+ORDER_TYPE = 'report_test'
+FOOD = 'report test item'
+
+RAW_SALES_SQL = """
+    SELECT date_trunc('hour', o.created_at) AS bucket,
+           count(DISTINCT o.user_id) AS orders,
+           COALESCE(sum(f.price), 0) AS revenue
+    FROM orders o
+    LEFT JOIN order_containers c ON c.order_id = o.user_id AND c.created_at = o.created_at
+    LEFT JOIN order_items f ON f.container_id = c.container_id AND f.created_at = c.created_at
+    WHERE o.user_id LIKE %s
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+ROLLED_SALES_SQL = """
+    SELECT bucket, orders, revenue FROM sales_hourly WHERE order_type = %s ORDER BY 1
+"""
+
+RAW_ITEMS_SQL = """
+    SELECT date_trunc('hour', f.created_at) AS bucket, f.food_name,
+           count(*) AS quantity, sum(f.price) AS revenue
+    FROM order_containers c
+    JOIN order_items f ON f.container_id = c.container_id AND f.created_at = c.created_at
+    WHERE c.order_id LIKE %s
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+
+ROLLED_ITEMS_SQL = """
+    SELECT bucket, food_name, quantity, revenue
+    FROM item_sales_hourly WHERE food_name LIKE %s ORDER BY 1, 2
+"""
+
+
+@pytest.fixture
+def connections(database):
+    """Three connections; the test orders and their rollup rows are removed afterwards."""
+    conns = [psycopg2.connect(**database) for _ in range(3)]
+    try:
+        yield conns
+    finally:
+        for conn in conns:
+            conn.rollback()
+        cleanup = conns[0]
+        delete_orders(cleanup, PREFIX + '%')
+        with cleanup.cursor() as cursor:
+            cursor.execute("DELETE FROM report_queue WHERE order_id LIKE %s", (PREFIX + '%',))
+            cursor.execute("DELETE FROM sales_hourly WHERE order_type = %s", (ORDER_TYPE,))
+            cursor.execute("DELETE FROM item_sales_hourly WHERE food_name LIKE %s", (FOOD + '%',))
+        cleanup.commit()
+        for conn in conns:
+            conn.close()
+
+
+def fetch(conn, sql, pattern):
+    with conn.cursor() as cursor:
+        cursor.execute(sql, (pattern,))
+        rows = cursor.fetchall()
+    conn.rollback()
+    return rows
+
+
+def test_order_committed_behind_the_watermark_is_rolled_up(connections):
+    slow, fast, refresher = connections
+    with slow.cursor() as cursor:
+        slow_created = insert_order(cursor, PREFIX + 'SLOW', [2, 1],
+                                    order_type=ORDER_TYPE, food_name=FOOD)
+    with fast.cursor() as cursor:
+        insert_order(cursor, PREFIX + 'FAST', [3], order_type=ORDER_TYPE, food_name=FOOD)
+    fast.commit()
+
+    result = reports.refresh_reports(refresher)
+    assert result is not None
+    _, through = result
+    # The slow order is stamped before the watermark but not yet committed
+    assert slow_created < through
+    assert sum(row[1] for row in fetch(refresher, ROLLED_SALES_SQL, ORDER_TYPE)) == 1
+
+    slow.commit()
+    assert reports.refresh_reports(refresher) is not None
+
+    rolled = fetch(refresher, ROLLED_SALES_SQL, ORDER_TYPE)
+    assert rolled == fetch(refresher, RAW_SALES_SQL, PREFIX + '%')
+    assert sum(row[1] for row in rolled) == 2
+    assert (fetch(refresher, ROLLED_ITEMS_SQL, FOOD + '%')
+            == fetch(refresher, RAW_ITEMS_SQL, PREFIX + '%'))
+
+
+def test_refresh_without_new_orders_adds_nothing(connections):
+    _, fast, refresher = connections
+    with fast.cursor() as cursor:
+        insert_order(cursor, PREFIX + 'ONCE', [2], order_type=ORDER_TYPE, food_name=FOOD)
+    fast.commit()
+    reports.refresh_reports(refresher)
+    before = fetch(refresher, ROLLED_SALES_SQL, ORDER_TYPE)
+
+    reports.refresh_reports(refresher)
+    assert fetch(refresher, ROLLED_SALES_SQL, ORDER_TYPE) == before == \
+        fetch(refresher, RAW_SALES_SQL, PREFIX + '%')